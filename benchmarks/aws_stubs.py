@@ -0,0 +1,449 @@
+"""In-memory stand-ins for the AWS clients and the pymysql connection used by the
+Lambda handlers, so the handlers run locally without AWS and without network.
+`SQLiteMySQLConnection` keeps the rows (in SQLite) for benchmarks that check them.
+
+Only the calls that the handlers make are implemented.
+"""
+
+import datetime
+import decimal
+import io
+import itertools
+import re
+import sqlite3
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from botocore.hooks import HierarchicalEmitter
+from pymysql.converters import escape_item
+
+
+class FakeS3Client:
+    class exceptions:  # same name as the modeled exception of a boto3 S3 client
+        class NoSuchKey(Exception):
+            pass
+
+    MAX_KEYS = 1000  # per page of `list_objects_v2`
+
+    def __init__(self) -> None:
+        self.objects: Dict[str, bytes] = {}
+        self.num_requests = 0
+        # like a boto3 client, so handlers can be registered on "before-call"
+        self.meta = SimpleNamespace(client=self, events=HierarchicalEmitter())
+
+    def _request(self, operation_name: str) -> None:
+        self.num_requests += 1
+        self.meta.events.emit(f"before-call.s3.{operation_name}")
+
+    def put_object(self, Key: str, Body, Bucket: Optional[str] = None) -> dict:
+        self._request("PutObject")
+        self.objects[Key] = Body.encode() if isinstance(Body, str) else bytes(Body)
+        return {}
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        self._request("GetObject")
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: dict) -> dict:
+        self._request("CopyObject")
+        if CopySource["Key"] not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "CopyObject")
+        self.objects[Key] = self.objects[CopySource["Key"]]
+        return {}
+
+    def delete_object(self, Bucket: str, Key: str) -> dict:
+        self._request("DeleteObject")
+        self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: dict) -> dict:
+        self._request("DeleteObjects")
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"], None)
+        return {}
+
+    def list_objects_v2(
+        self, Bucket: str, Prefix: str = "", MaxKeys: int = MAX_KEYS
+    ) -> dict:
+        self._request("ListObjectsV2")
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))[:MaxKeys]
+        now = datetime.datetime.now(datetime.timezone.utc)  # no object is older
+        return {
+            "Contents": [
+                {"Key": key, "Size": len(self.objects[key]), "LastModified": now}
+                for key in keys
+            ]
+        }
+
+    def get_paginator(self, operation_name: str):
+        assert operation_name == "list_objects_v2"
+        return self
+
+    def paginate(
+        self,
+        Bucket: str,
+        Prefix: str = "",
+        Delimiter: Optional[str] = None,
+        StartAfter: str = "",
+    ):
+        entries = []  # (key or common prefix, is common prefix) in key order
+        for key in sorted(self.objects):
+            if not key.startswith(Prefix) or key <= StartAfter:
+                continue
+            rest = key[len(Prefix) :]
+            if Delimiter and Delimiter in rest:
+                common_prefix = Prefix + rest[: rest.index(Delimiter) + 1]
+                if not entries or entries[-1][0] != common_prefix:
+                    entries.append((common_prefix, True))
+            else:
+                entries.append((key, False))
+        for i in range(0, max(len(entries), 1), self.MAX_KEYS):
+            self._request("ListObjectsV2")
+            page = entries[i : i + self.MAX_KEYS]
+            yield {
+                "Contents": [
+                    {"Key": key, "Size": len(self.objects[key])}
+                    for key, is_common_prefix in page
+                    if not is_common_prefix
+                ],
+                "CommonPrefixes": [
+                    {"Prefix": key}
+                    for key, is_common_prefix in page
+                    if is_common_prefix
+                ],
+            }
+
+    def Bucket(self, name: str):  # stands in for `boto3.resource("s3")` too
+        return self
+
+
+class FakeRedshiftDataClient:
+    """Every statement finishes immediately; the SQL is recorded"""
+
+    def __init__(self) -> None:
+        self.sql_statements: List[str] = []
+        self.statements: Dict[str, dict] = {}
+        self.sub_statement_sql_statements: Dict[str, str] = {}
+
+    def _finish(self, sql_statements: List[str]) -> dict:
+        self.sql_statements.extend(sql_statements)
+        statement_id = str(uuid.uuid4())
+        self.statements[statement_id] = {
+            "Id": statement_id,
+            "Status": "FINISHED",
+            "QueryString": ";".join(sql_statements),
+            "SubStatements": [
+                {"Id": f"{statement_id}:{i + 1}", "Status": "FINISHED"}
+                for i in range(len(sql_statements))
+            ],
+        }
+        for i, sql_statement in enumerate(sql_statements):
+            self.sub_statement_sql_statements[f"{statement_id}:{i + 1}"] = sql_statement
+        if len(sql_statements) == 1:  # its result is read by the statement's own ID
+            self.sub_statement_sql_statements[statement_id] = sql_statements[0]
+        return {"Id": statement_id}
+
+    def execute_statement(self, Sql: str, **kwargs) -> dict:
+        return self._finish([Sql])
+
+    def batch_execute_statement(self, Sqls: List[str], **kwargs) -> dict:
+        return self._finish(Sqls)
+
+    def describe_statement(self, Id: str) -> dict:
+        return self.statements[Id]
+
+    def get_statement_result(self, Id: str, **kwargs) -> dict:
+        sql_statement = self.sub_statement_sql_statements.get(Id, "")
+        if "__load_ledger" in sql_statement:
+            return {"Records": []}  # no file was loaded by a run that then timed out
+        if "svv_columns" in sql_statement:
+            return {"Records": []}  # the table is created by the 1st run
+        return {"Records": [[{"longValue": 0}]]}
+
+
+class FakeReconciliationRedshiftDataClient(FakeRedshiftDataClient):
+    """Answers the queries of the reconciliation Lambda. The replicated RDS table has
+    `columns` (name -> Redshift data type) and `num_rows_per_bucket` rows in each of
+    `buckets`, all of whose checksums are 0. The DynamoDB CDC table has 1 live image of
+    each of `keys`, all of which changed since the last run."""
+
+    def __init__(
+        self,
+        columns: Dict[str, str],
+        buckets: List[str],
+        num_rows_per_bucket: int,
+        keys: List[str],
+    ) -> None:
+        super().__init__()
+        self.columns = columns
+        self.buckets = buckets
+        self.num_rows_per_bucket = num_rows_per_bucket
+        self.keys = keys
+
+    def get_statement_result(self, Id: str, **kwargs) -> dict:
+        sql_statement = self.sub_statement_sql_statements.get(Id, "")
+        if "information_schema.columns" in sql_statement:
+            return {
+                "Records": [
+                    [{"stringValue": column}, {"stringValue": data_type}]
+                    for column, data_type in self.columns.items()
+                ]
+            }
+        if "_cdc_op" in sql_statement:  # the latest images of some ids
+            keys = (
+                re.findall(r"'((?:[^']|'')*)'", sql_statement.split("id IN (", 2)[2])
+                if "_cdc_event_time >" not in sql_statement
+                else self.keys
+            )
+            return {
+                "Records": [
+                    [
+                        {"stringValue": key.replace("''", "'")},
+                        {"stringValue": "INSERT"},
+                        {"stringValue": "2022-01-01 00:00:00"},
+                    ]
+                    for key in keys
+                ]
+            }
+        if "GROUP BY 1" in sql_statement:  # bucket checksums
+            return {
+                "Records": [
+                    [{"stringValue": bucket}, {"longValue": self.num_rows_per_bucket}]
+                    + [{"stringValue": "0"}] * len(self.columns)
+                    for bucket in self.buckets
+                ]
+            }
+        if "COUNT(*)" in sql_statement:
+            return {"Records": [[{"longValue": len(self.keys)}]]}
+        return {"Records": [[{"isNull": True}]]}  # e.g. no heartbeat replicated yet
+
+
+class FakeDynamoDBClient:
+    """A table of `keys` (the `id` of every item) for Scan, BatchGetItem and
+    DescribeTable. A scan segment is every `TotalSegments`th key."""
+
+    SCAN_PAGE_SIZE = 10000  # about 1 MB of ids, the most that 1 Scan call returns
+
+    def __init__(self, keys: List[str]) -> None:
+        self.keys = keys
+        self.key_set = set(keys)
+        self.meta = SimpleNamespace(client=self, events=HierarchicalEmitter())
+
+    def scan(
+        self,
+        TableName: str,
+        Segment: int,
+        TotalSegments: int,
+        ExclusiveStartKey: Optional[dict] = None,
+        **kwargs,
+    ) -> dict:
+        self.meta.events.emit("before-call.dynamodb.Scan")
+        start = 0 if ExclusiveStartKey is None else ExclusiveStartKey["position"] + 1
+        segment_keys = self.keys[Segment::TotalSegments][
+            start : start + self.SCAN_PAGE_SIZE
+        ]
+        response = {"Items": [{"id": {"S": key}} for key in segment_keys]}
+        if start + len(segment_keys) < len(self.keys[Segment::TotalSegments]):
+            response["LastEvaluatedKey"] = {"position": start + len(segment_keys) - 1}
+        return response
+
+    def batch_get_item(self, RequestItems: dict) -> dict:
+        self.meta.events.emit("before-call.dynamodb.BatchGetItem")
+        return {
+            "Responses": {
+                table_name: [
+                    key for key in request["Keys"] if key["id"]["S"] in self.key_set
+                ]
+                for table_name, request in RequestItems.items()
+            },
+            "UnprocessedKeys": {},
+        }
+
+    def describe_table(self, TableName: str) -> dict:
+        self.meta.events.emit("before-call.dynamodb.DescribeTable")
+        return {"Table": {"TableName": TableName, "ItemCount": len(self.keys)}}
+
+
+class FakeDMSClient:
+    def __init__(self, status: str = "running") -> None:
+        self.status = status
+
+    def describe_replication_tasks(self, Filters: List[dict]) -> dict:
+        return {
+            "ReplicationTasks": [
+                {"ReplicationTaskArn": arn, "Status": self.status}
+                for arn in Filters[0]["Values"]
+            ]
+        }
+
+    def start_replication_task(self, ReplicationTaskArn: str, **kwargs) -> dict:
+        return {"ReplicationTask": {"ReplicationTaskArn": ReplicationTaskArn}}
+
+
+class FakeMySQLCursor:
+    """Renders every statement like pymysql does, then throws it away"""
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def execute(self, query: str, args=None) -> int:
+        if args is not None:
+            query = query % tuple(escape_item(arg, "utf8mb4") for arg in args)
+        self.connection.sql_statements.append(query)
+        return 0
+
+    def executemany(self, query: str, args) -> int:
+        values = query[query.index("VALUES") + len("VALUES") :].strip().rstrip(";")
+        rows = [
+            values % tuple(escape_item(arg, "utf8mb4") for arg in row) for row in args
+        ]
+        self.connection.num_rows += len(rows)
+        self.connection.num_bytes += sum(len(row) for row in rows)
+        return len(rows)
+
+    def fetchone(self) -> tuple:
+        return (self.connection.num_rows,)
+
+
+class FakeMySQLConnection:
+    def __init__(self, **connect_kwargs) -> None:
+        self.sql_statements: List[str] = []
+        self.num_rows = 0
+        self.num_bytes = 0
+
+    def cursor(self) -> FakeMySQLCursor:
+        return FakeMySQLCursor(self)
+
+    def ping(self, reconnect: bool = False) -> None:
+        pass
+
+    def commit(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FakeReconciliationMySQLCursor(FakeMySQLCursor):
+    """Answers the queries of the reconciliation Lambda, see
+    `FakeReconciliationMySQLConnection`"""
+
+    def execute(self, query: str, args=None) -> int:
+        self.query = query
+        return super().execute(query, args)
+
+    def fetchall(self) -> List[tuple]:
+        if "information_schema.columns" in self.query:
+            return list(self.connection.columns)
+        if "GROUP BY 1" in self.query:  # bucket checksums
+            return [
+                (bucket, self.connection.num_rows_per_bucket)
+                + (decimal.Decimal(0),) * len(self.connection.columns)
+                for bucket in self.connection.buckets
+            ]
+        return []
+
+    def fetchone(self) -> tuple:
+        return (None,)  # e.g. every heartbeat is replicated
+
+
+class FakeReconciliationMySQLConnection(FakeMySQLConnection):
+    """The RDS table has `columns` ((name, DATA_TYPE, COLUMN_TYPE) in
+    `information_schema.columns`) and `num_rows_per_bucket` rows in each of `buckets`,
+    all of whose checksums are 0"""
+
+    def __init__(
+        self,
+        columns: List[tuple],
+        buckets: List[str],
+        num_rows_per_bucket: int,
+        **connect_kwargs,
+    ) -> None:
+        super().__init__(**connect_kwargs)
+        self.columns = columns
+        self.buckets = buckets
+        self.num_rows_per_bucket = num_rows_per_bucket
+
+    def cursor(self) -> FakeReconciliationMySQLCursor:
+        return FakeReconciliationMySQLCursor(self)
+
+
+# types that the RDS loader's schema inference converts CSV values into
+sqlite3.register_adapter(decimal.Decimal, str)
+sqlite3.register_adapter(datetime.date, datetime.date.isoformat)
+
+
+class SQLiteMySQLCursor:
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.cursor = connection.sqlite_connection.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.cursor.close()
+
+    def execute(self, query: str, args=None) -> int:
+        self.cursor.execute(query.replace("%s", "?"), args or ())
+        return self.cursor.rowcount
+
+    def executemany(self, query: str, args) -> int:
+        self.cursor.executemany(query.replace("%s", "?"), args)
+        return self.cursor.rowcount
+
+    def fetchone(self) -> tuple:
+        return self.cursor.fetchone()
+
+
+class SQLiteMySQLConnection:
+    """The SQL that the handlers send to MySQL (CREATE TABLE with MySQL column types,
+    INSERT, SELECT COUNT(*)) is also valid in SQLite. LOAD DATA is not."""
+
+    def __init__(self, database: str = ":memory:", **connect_kwargs) -> None:
+        self.sqlite_connection = sqlite3.connect(database, check_same_thread=False)
+
+    def cursor(self) -> SQLiteMySQLCursor:
+        return SQLiteMySQLCursor(self)
+
+    def ping(self, reconnect: bool = False) -> None:
+        pass
+
+    def commit(self) -> None:
+        self.sqlite_connection.commit()
+
+    def close(self) -> None:  # keeps the rows, like closing a connection to MySQL
+        pass
+
+
+def short_circuit_batch_write_item(dynamodb_client) -> None:
+    """Answer DynamoDB's BatchWriteItem right before it would go over the network,
+    so boto3's serialization of the items is still measured"""
+    dynamodb_client.meta.events.register(
+        "before-call.dynamodb.BatchWriteItem",
+        lambda **kwargs: (SimpleNamespace(status_code=200), {"UnprocessedItems": {}}),
+    )
+
+
+class FakeLambdaContext:
+    def __init__(self, timeout_in_seconds: float = 900) -> None:
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.time() + timeout_in_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self.deadline - time.time()) * 1000)
+
+
+def cycle(items: list, num_items: int) -> list:
+    return list(itertools.islice(itertools.cycle(items), num_items))
@@ -0,0 +1,487 @@
+"""Run the whole CDC pipeline locally: all 5 Lambda handlers in 1 process, in the order
+data flows through them, on synthesized `txns.csv`- and `trades.json`-shaped data.
+
+    1. load_data_to_rds       CSV -> RDS (SQLite behind a pymysql-compatible adapter)
+    2. start_dms              DMS task status
+    3. load_data_to_dynamodb  JSON -> DynamoDB table
+    4. write_stream_to_s3     DynamoDB stream batches -> S3 unprocessed folder
+    5. load_s3_to_redshift    S3 -> Redshift COPY, run until no file is pending
+
+S3 and DynamoDB are moto (`--aws moto`) or the in-memory stand-ins of `aws_stubs.py`
+(`--aws stubs`, which is much faster for 10^6+ records). The Redshift Data API is
+always a stand-in that records the SQL, and so is DMS, because moto's replication
+tasks never become "ready". The stream events are built from the same trades that
+are loaded into DynamoDB, in the shape and batch size that Lambda receives them.
+
+Per stage: records/sec, latency percentiles of the Lambda invocations, and the S3
+objects and bytes in each folder afterwards. `--output-json` keeps the numbers for
+comparing runs.
+
+$ python benchmarks/benchmark_cdc_pipeline.py --num-records 1000 10000
+$ python benchmarks/benchmark_cdc_pipeline.py --aws stubs --num-records 1000000
+"""
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Callable, Iterator, List
+from unittest import mock
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPO_DIRECTORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+SOURCE_DIRECTORY = os.path.join(REPO_DIRECTORY, "source")
+sys.path.insert(0, BENCHMARKS_DIRECTORY)
+
+with open(os.path.join(REPO_DIRECTORY, "cdk.json")) as f:
+    CDK_ENVIRONMENT = json.load(f)["context"]["environment"]
+S3_BUCKET = "cdc-pipeline-benchmark"
+STREAM_BATCH_SIZE = CDK_ENVIRONMENT["DYNAMODB_STREAM_BATCH_SIZE"]
+STAGES = [
+    "load_data_to_rds",
+    "start_dms",
+    "load_data_to_dynamodb",
+    "write_stream_to_s3",
+    "load_s3_to_redshift",
+]
+PERCENTILES = [50, 90, 99]
+
+
+def generate_txns(num_records: int) -> Iterator[list]:
+    """Rows shaped like `txns.csv`, including its padded and quoted amounts"""
+    rng = random.Random(0)
+    details = [
+        "TRF FROM  Indiaforensic SERVICES",
+        "INDO GIBL Indiaforensic STL01071",
+        "FDRL/INTERNAL FUND TRANSFE",
+    ]
+    balance = Decimal(0)
+    for i in range(num_records):
+        day = date(2017, 6, 29) + timedelta(days=i // 1000)
+        amount = Decimal(rng.randrange(100, 10_000_000)) / 100
+        is_deposit = rng.random() < 0.5
+        balance += amount if is_deposit else -amount
+        yield [
+            str(409000611074 + i % 10),
+            f"{day.day}-{day:%b-%y}",
+            rng.choice(details),
+            rng.choice(["TRUE", "FALSE"]),
+            f"{day.day}-{day:%b-%y}",
+            "" if is_deposit else f"  {amount:,.2f} ",
+            f"  {amount:,.2f} " if is_deposit else "",
+            f"  {balance:,.2f} ",
+        ]
+
+
+def generate_trades(num_records: int) -> Iterator[dict]:
+    """Records shaped like `trades.json`; some have no `ticket`, like the original"""
+    rng = random.Random(0)
+    for i in range(num_records):
+        price = round(rng.uniform(10, 500), 2)
+        trade = {
+            "id": f"{i:024x}",
+            "details": {
+                "asks": [round(price + rng.uniform(0, 1), 2) for _ in range(3)],
+                "bids": [round(price - rng.uniform(0, 1), 2) for _ in range(4)],
+                "lag": rng.randrange(3),
+                "system": rng.choice(["abc", "def"]),
+            },
+            "price": price,
+            "shares": rng.randrange(1, 1000),
+            "ticker": rng.choice(["abcd", "efgh", "ijkl"]),
+            "time": {"date": f"2012-03-{1 + i % 28:02d}T{i % 24:02d}:00:00.000Z"},
+        }
+        if i % 2:
+            trade["ticket"] = f"z{i % 1000}"
+        yield trade
+
+
+def write_txns_csv(csv_filename: str, num_records: int) -> None:
+    with open(
+        os.path.join(SOURCE_DIRECTORY, "load_data_to_rds_lambda", "txns.csv")
+    ) as f:
+        header = next(csv.reader(f))
+    with open(csv_filename, "w", newline="") as f:
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(header)
+        csv_writer.writerows(generate_txns(num_records))
+
+
+def write_trades_json(json_filename: str, num_records: int) -> None:
+    with open(json_filename, "w") as f:
+        f.write('{"data": [')
+        for i, trade in enumerate(generate_trades(num_records)):
+            f.write(("," if i else "") + json.dumps(trade))
+        f.write("]}")
+
+
+def generate_stream_events(num_records: int) -> Iterator[dict]:
+    """What Lambda receives from the stream of the DynamoDB table (NEW_IMAGE)"""
+    from boto3.dynamodb.types import TypeSerializer
+
+    type_serializer = TypeSerializer()
+    records = []
+    for i, trade in enumerate(generate_trades(num_records)):
+        image = type_serializer.serialize(
+            json.loads(json.dumps(trade), parse_float=Decimal)
+        )["M"]
+        records.append(
+            {
+                "eventID": f"{i:032x}",
+                "eventName": "INSERT",
+                "eventVersion": "1.1",
+                "eventSource": "aws:dynamodb",
+                "awsRegion": CDK_ENVIRONMENT["AWS_REGION"],
+                "dynamodb": {
+                    "ApproximateCreationDateTime": int(time.time()),
+                    "Keys": {"id": image["id"]},
+                    "NewImage": image,
+                    "SequenceNumber": str(10**20 + i),
+                    "SizeBytes": len(json.dumps(image)),
+                    "StreamViewType": "NEW_IMAGE",
+                },
+            }
+        )
+        if len(records) == STREAM_BATCH_SIZE:
+            # round trip through JSON like the Lambda event payload
+            yield json.loads(json.dumps({"Records": records}))
+            records = []
+    if records:
+        yield json.loads(json.dumps({"Records": records}))
+
+
+def set_environment(temp_directory: str) -> None:
+    """The environment variables that `cdk_infrastructure` gives the Lambdas"""
+    os.environ.update(
+        {
+            key: value if isinstance(value, str) else json.dumps(value)
+            for key, value in CDK_ENVIRONMENT.items()
+            if isinstance(value, (str, int, bool, dict)) and value is not None
+        }
+    )
+    os.environ.update(
+        AWS_DEFAULT_REGION=CDK_ENVIRONMENT["AWS_REGION"],
+        AWS_ACCESS_KEY_ID="testing",  # never sent anywhere
+        AWS_SECRET_ACCESS_KEY="testing",
+        AWSREGION=CDK_ENVIRONMENT["AWS_REGION"],
+        RDS_HOST="localhost",
+        RDS_LOAD_MODE="chunked_insert",  # LOAD DATA needs a real MySQL server
+        CSV_FILENAME=os.path.join(temp_directory, "txns.csv"),
+        DMS_REPLICATION_TASK_ARNS=",".join(
+            f"arn:aws:dms:us-east-1:123456789012:task:{i}"
+            for i in range(CDK_ENVIRONMENT["DMS_NUM_REPLICATION_TASKS"])
+        ),
+        DYNAMODB_TABLE_NAME="trades",
+        JSON_FILENAME=os.path.join(temp_directory, "trades.json"),
+        DYNAMODB_LOAD_MAX_WRITE_UNITS_PER_SECOND=json.dumps(
+            CDK_ENVIRONMENT["DYNAMODB_LOAD_MAX_WRITE_UNITS_PER_SECOND"]
+        ),
+        S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT=S3_BUCKET,
+        DYNAMODB_STREAM_SINK="s3",  # Firehose does the encoding itself
+        DYNAMODB_STREAM_ATTRIBUTES_FOLDER=f"{CDK_ENVIRONMENT['LOADER_STATE_FOLDER']}/stream_attributes",
+        FAILED_DYNAMODB_STREAM_RECORDS_FOLDER=CDK_ENVIRONMENT[
+            "FAILED_DYNAMODB_STREAM_RECORDS_FOLDER"
+        ],
+        REDSHIFT_ENDPOINT_ADDRESS="cluster.abc.us-east-1.redshift.amazonaws.com",
+        REDSHIFT_ROLE_ARN="arn:aws:iam::123456789012:role/redshift",
+    )
+    os.environ.pop("LOADER_LEASE_TABLE_NAME", None)  # 1 loader at a time
+
+
+def import_handler(lambda_directory: str):
+    """Every Lambda's module is called `handler`, so each gets its own name here"""
+    sys.path[:0] = [
+        os.path.join(SOURCE_DIRECTORY, lambda_directory),
+        os.path.join(SOURCE_DIRECTORY, "shared_lambda_layer", "python"),
+    ]
+    spec = importlib.util.spec_from_file_location(
+        lambda_directory, os.path.join(SOURCE_DIRECTORY, lambda_directory, "handler.py")
+    )
+    handler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handler)
+    return handler
+
+
+def get_percentile(sorted_values: List[float], percentile: int) -> float:
+    """Nearest rank"""
+    return sorted_values[max(0, -(-len(sorted_values) * percentile // 100) - 1)]
+
+
+def get_s3_usage(s3_client) -> dict:
+    """Number of objects and bytes per top level folder of the bucket"""
+    s3_usage = {}
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=S3_BUCKET):
+        for dct in page.get("Contents", []):
+            folder_usage = s3_usage.setdefault(
+                dct["Key"].split("/")[0], {"objects": 0, "bytes": 0}
+            )
+            folder_usage["objects"] += 1
+            folder_usage["bytes"] += dct["Size"]
+    return s3_usage
+
+
+def run_stage(invocations: Iterator[Callable], num_records: int, s3_client) -> dict:
+    from aws_stubs import FakeLambdaContext
+
+    latencies = []
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")  # the handlers print a lot
+    try:
+        for invoke in invocations:
+            start_time = time.perf_counter()
+            invoke(FakeLambdaContext())
+            latencies.append(time.perf_counter() - start_time)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    latencies.sort()
+    return {
+        "records": num_records,
+        "invocations": len(latencies),
+        "seconds": sum(latencies),
+        "records_per_second": num_records / sum(latencies) if sum(latencies) else None,
+        **{
+            f"p{percentile}_ms": get_percentile(latencies, percentile) * 1000
+            for percentile in PERCENTILES
+        },
+        "s3": get_s3_usage(s3_client),
+    }
+
+
+def run_pipeline(num_records: int, aws: str, stages: List[str]) -> dict:
+    """Runs in the child process"""
+    import boto3
+    import pymysql
+    from aws_stubs import (
+        FakeDMSClient,
+        FakeRedshiftDataClient,
+        FakeS3Client,
+        SQLiteMySQLConnection,
+        short_circuit_batch_write_item,
+    )
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_directory:
+        set_environment(temp_directory)
+        write_txns_csv(os.environ["CSV_FILENAME"], num_records)
+        write_trades_json(os.environ["JSON_FILENAME"], num_records)
+
+        mysql_connection = SQLiteMySQLConnection(
+            os.path.join(temp_directory, "rds.sqlite")
+        )
+        redshift_data_client = FakeRedshiftDataClient()
+        fake_clients = {
+            "dms": FakeDMSClient(status="running"),
+            "redshift-data": redshift_data_client,
+        }
+        if aws == "moto":
+            from moto import mock_aws
+
+            mock_aws().start()
+            s3_client = boto3.client("s3")
+            s3_client.create_bucket(Bucket=S3_BUCKET)
+            boto3.client("dynamodb").create_table(
+                TableName="trades",
+                KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+                AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+                BillingMode="PAY_PER_REQUEST",
+            )
+        else:
+            s3_client = FakeS3Client()
+            fake_clients["s3"] = s3_client
+        boto3_client, boto3_resource = boto3.client, boto3.resource
+        # for the whole child process, as the handlers connect when invoked
+        mock.patch.object(pymysql, "connect", lambda **kwargs: mysql_connection).start()
+        mock.patch(
+            "boto3.client",
+            lambda service_name, **kwargs: fake_clients.get(service_name)
+            or boto3_client(service_name, **kwargs),
+        ).start()
+        mock.patch(
+            "boto3.resource",
+            lambda service_name, **kwargs: fake_clients.get(service_name)
+            or boto3_resource(service_name, **kwargs),
+        ).start()
+        handlers = {
+            "load_data_to_rds": import_handler("load_data_to_rds_lambda"),
+            "start_dms": import_handler("start_dms_replication_task_lambda"),
+            "load_data_to_dynamodb": import_handler("load_data_to_dynamodb_lambda"),
+            "write_stream_to_s3": import_handler("write_dynamodb_stream_to_s3_lambda"),
+            "load_s3_to_redshift": import_handler(
+                "load_s3_files_from_dynamodb_stream_to_redshift_lambda"
+            ),
+        }
+        if aws == "stubs":
+            short_circuit_batch_write_item(
+                handlers["load_data_to_dynamodb"].dynamodb_client
+            )
+
+        def is_pending() -> bool:
+            return bool(
+                get_s3_usage(s3_client).get(
+                    CDK_ENVIRONMENT["UNPROCESSED_DYNAMODB_STREAM_FOLDER"]
+                )
+            )
+
+        def invoke_loader_until_done() -> Iterator[Callable]:
+            while is_pending():
+                yield lambda context: handlers["load_s3_to_redshift"].lambda_handler(
+                    {}, context
+                )
+
+        stage_invocations = {
+            "load_data_to_rds": [
+                lambda context: handlers["load_data_to_rds"].lambda_handler({}, context)
+            ],
+            "start_dms": [
+                lambda context: handlers["start_dms"].lambda_handler({}, context)
+            ],
+            "load_data_to_dynamodb": [
+                lambda context: handlers["load_data_to_dynamodb"].lambda_handler(
+                    {}, context
+                )
+            ],
+            "write_stream_to_s3": (
+                lambda context, event=event: handlers[
+                    "write_stream_to_s3"
+                ].lambda_handler(event, context)
+                for event in generate_stream_events(num_records)
+            ),
+            "load_s3_to_redshift": invoke_loader_until_done(),
+        }
+        for stage in stages:
+            results[stage] = run_stage(
+                invocations=stage_invocations[stage],
+                num_records=0 if stage == "start_dms" else num_records,
+                s3_client=s3_client,
+            )
+        if "load_data_to_rds" in results:
+            results["load_data_to_rds"]["input_bytes"] = os.path.getsize(
+                os.environ["CSV_FILENAME"]
+            )
+            with mysql_connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {os.environ['RDS_TABLE_NAME']}")
+                rds_num_rows = cursor.fetchone()[0]
+            assert (
+                rds_num_rows == num_records
+            ), f"RDS has {rds_num_rows} rows, not {num_records}"
+        if "load_data_to_dynamodb" in results:
+            results["load_data_to_dynamodb"]["input_bytes"] = os.path.getsize(
+                os.environ["JSON_FILENAME"]
+            )
+        if "load_s3_to_redshift" in results:
+            results["load_s3_to_redshift"]["redshift_sql_statements"] = len(
+                redshift_data_client.sql_statements
+            )
+            results["load_s3_to_redshift"]["redshift_copies"] = sum(
+                sql_statement.lstrip().startswith("COPY")
+                for sql_statement in redshift_data_client.sql_statements
+            )
+    return results
+
+
+def print_results(num_records: int, results: dict) -> None:
+    print(f"\n{num_records:,} records")
+    print(
+        f"{'stage':<22} {'invocations':>11} {'records/s':>11} "
+        + " ".join(f"{f'p{percentile} ms':>9}" for percentile in PERCENTILES)
+        + f" {'input MB':>9} {'S3 objects':>11} {'S3 MB':>9}"
+    )
+    s3_usage = {}
+    for stage in [stage for stage in STAGES if stage in results]:
+        result = results[stage]
+        input_mb = (
+            f"{result['input_bytes'] / 2**20:.2f}" if "input_bytes" in result else "-"
+        )
+        records_per_second = (
+            f"{result['records_per_second']:,.0f}"
+            if result["records_per_second"]
+            else "-"
+        )
+        print(
+            f"{stage:<22} {result['invocations']:>11,} {records_per_second:>11} "
+            + " ".join(
+                f"{result[f'p{percentile}_ms']:>9.1f}" for percentile in PERCENTILES
+            )
+            + f" {input_mb:>9}"
+            + f" {sum(usage['objects'] for usage in result['s3'].values()):>11,}"
+            + f" {sum(usage['bytes'] for usage in result['s3'].values()) / 2**20:>9.2f}"
+        )
+        for folder in sorted(set(s3_usage) | set(result["s3"])):
+            usage = result["s3"].get(folder, {"objects": 0, "bytes": 0})
+            if usage != s3_usage.get(folder):  # only the folders that the stage changed
+                print(
+                    f"    {folder}/: {usage['objects']:,} objects, "
+                    f"{usage['bytes'] / 2**20:.2f} MB"
+                )
+        s3_usage = result["s3"]
+    if "load_s3_to_redshift" in results:
+        print(
+            f"Redshift: {results['load_s3_to_redshift']['redshift_copies']} COPYs in "
+            f"{results['load_s3_to_redshift']['redshift_sql_statements']} SQL statements"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--num-records", nargs="+", type=int, default=[1000, 10000])
+    parser.add_argument("--aws", choices=["moto", "stubs"], default="moto")
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help="e.g. without load_data_to_dynamodb, whose boto3 serialization dominates big runs",
+    )
+    parser.add_argument(
+        "--output-json", help="file to write the numbers of every run to"
+    )
+    parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(
+            json.dumps(
+                run_pipeline(num_records=args.run_one, aws=args.aws, stages=args.stages)
+            )
+        )
+        return
+
+    all_results = {}
+    for num_records in args.num_records:
+        # a fresh process per size, as the handlers keep state at module level
+        results = json.loads(
+            subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--aws",
+                    args.aws,
+                    "--run-one",
+                    str(num_records),
+                ]
+                + ["--stages", *args.stages],
+                check=True,
+                stdout=subprocess.PIPE,  # errors go to stderr
+                text=True,
+            ).stdout.splitlines()[-1]
+        )
+        print_results(num_records=num_records, results=results)
+        all_results[num_records] = results
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump({"aws": args.aws, "results": all_results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
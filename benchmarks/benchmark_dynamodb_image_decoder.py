@@ -0,0 +1,84 @@
+"""Compare the DynamoDB stream image decoder of the stream Lambda with the previous
+TypeDeserializer + DecimalEncoder path on `trades.json`-shaped records.
+
+$ python benchmarks/benchmark_dynamodb_image_decoder.py --num-records 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(
+    0, os.path.join(REPO_DIRECTORY, "source", "write_dynamodb_stream_to_s3_lambda")
+)
+from dynamodb_image_decoder import encode_image  # noqa: E402
+
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return float(o)
+        return super().default(o)
+
+
+def type_deserializer_path(images: list) -> list:
+    return [
+        json.dumps(TypeDeserializer().deserialize({"M": image}), cls=DecimalEncoder)
+        for image in images
+    ]
+
+
+def dynamodb_image_decoder_path(images: list) -> list:
+    return [encode_image(image) for image in images]
+
+
+def get_images(num_records: int) -> list:
+    """NewImages as they arrive in the DynamoDB stream event"""
+    with open(
+        os.path.join(
+            REPO_DIRECTORY, "source", "load_data_to_dynamodb_lambda", "trades.json"
+        )
+    ) as f:
+        trades = json.load(f, parse_float=Decimal)["data"]
+    type_serializer = TypeSerializer()
+    images = [type_serializer.serialize(trade)["M"] for trade in trades]
+    # round trip through JSON like the Lambda event payload
+    images = json.loads(json.dumps(images))
+    return [images[i % len(images)] for i in range(num_records)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-records", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    images = get_images(args.num_records)
+    results = {}
+    for name, decode in [
+        ("TypeDeserializer + DecimalEncoder", type_deserializer_path),
+        ("dynamodb_image_decoder", dynamodb_image_decoder_path),
+    ]:
+        best_seconds = min(
+            timeit.repeat(lambda: decode(images), number=1, repeat=args.repeat)
+        )
+        num_bytes = sum(len(line.encode()) for line in decode(images))
+        results[name] = best_seconds
+        print(
+            f"{name:>35}: {args.num_records / best_seconds:>12,.0f} records/s, "
+            f"{num_bytes / args.num_records:.1f} bytes/record"
+        )
+    print(
+        "Speedup: "
+        f'{results["TypeDeserializer + DecimalEncoder"] / results["dynamodb_image_decoder"]:.1f}x'
+    )
+
+
+if __name__ == "__main__":
+    main()
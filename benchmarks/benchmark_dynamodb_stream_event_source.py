@@ -0,0 +1,325 @@
+"""Compare settings of the DynamoDB stream event source of the stream Lambda
+(`DYNAMODB_STREAM_*` in `cdk.json`): batch size, batching window, parallelization
+factor and the `eventName` filter.
+
+Lambda polls every shard of the stream and keeps up to 1 batch per key hash slot
+in flight, i.e. `--num-shards` x parallelization factor concurrent invocations, with
+the changes of a key always in the same slot and in order. A batch is sent once it
+has the batch size or once the batching window has passed since its 1st record.
+This simulates that schedule over a burst (or a steady `--write-rate`) of stream
+records, and runs every batch through the real Lambda handler (`aws_stubs.py` for
+S3) to time it. `--invocation-overhead-ms` and `--s3-put-ms` add what the local run
+does not pay: the Lambda invoke round trip and the S3 PutObject of the batch file.
+
+Per configuration: invocations, records per invocation, records/sec from the 1st
+record written to the last batch done, the p50/p99 delay of a record between being
+written and its batch being done, and what is written to S3.
+
+$ python benchmarks/benchmark_dynamodb_stream_event_source.py --num-records 50000
+$ python benchmarks/benchmark_dynamodb_stream_event_source.py --write-rate 0 \\
+      --batch-sizes 100 1000 --batching-windows 5 --event-filters all
+"""
+
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+from typing import List
+from unittest import mock
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIRECTORY)
+
+from benchmark_cdc_pipeline import (  # noqa: E402
+    CDK_ENVIRONMENT,
+    PERCENTILES,
+    generate_trades,
+    get_percentile,
+    import_handler,
+)
+
+EVENT_FILTERS = {  # `DYNAMODB_STREAM_EVENT_NAMES` in `cdk.json`
+    "all": ["INSERT", "MODIFY", "REMOVE"],
+    "no_remove": ["INSERT", "MODIFY"],
+}
+MAX_PAYLOAD_BYTES = 6 * 2**20  # of a synchronous Lambda invocation
+
+
+def generate_stream_records(
+    num_records: int, modify_fraction: float, remove_fraction: float
+) -> List[dict]:
+    """INSERTs of new trades, MODIFYs and REMOVEs of earlier ones, in stream order"""
+    from boto3.dynamodb.types import TypeSerializer
+
+    rng = random.Random(0)
+    type_serializer = TypeSerializer()
+    trades = generate_trades(num_records)
+    live_ids, records = [], []
+    for i in range(num_records):
+        dice = rng.random()
+        if live_ids and dice < remove_fraction:
+            event_name = "REMOVE"
+            image = {"id": {"S": live_ids.pop(rng.randrange(len(live_ids)))}}
+        elif live_ids and dice < remove_fraction + modify_fraction:
+            event_name = "MODIFY"
+            # hot keys: most changes are to recently written items
+            trade = dict(
+                next(trades),
+                id=live_ids[-1 - min(int(rng.expovariate(0.1)), len(live_ids) - 1)],
+            )
+            image = type_serializer.serialize(
+                json.loads(json.dumps(trade), parse_float=Decimal)
+            )["M"]
+        else:
+            event_name = "INSERT"
+            trade = next(trades)
+            live_ids.append(trade["id"])
+            image = type_serializer.serialize(
+                json.loads(json.dumps(trade), parse_float=Decimal)
+            )["M"]
+        change = {
+            "ApproximateCreationDateTime": 1640995200 + i // 1000,
+            "Keys": {"id": image["id"]},
+            "SequenceNumber": str(10**20 + i),
+            "StreamViewType": "NEW_IMAGE",
+        }
+        if event_name != "REMOVE":
+            change["NewImage"] = image
+        records.append(
+            {"eventID": f"{i:032x}", "eventName": event_name, "dynamodb": change}
+        )
+    # round trip through JSON like the Lambda event payload
+    return json.loads(json.dumps(records))
+
+
+def get_slot(record: dict, num_shards: int, parallelization_factor: int) -> tuple:
+    """(shard, slot within the shard) by the hash of the key, like DynamoDB and Lambda"""
+    key_hash = int(
+        hashlib.md5(record["dynamodb"]["Keys"]["id"]["S"].encode()).hexdigest(), 16
+    )
+    return key_hash % num_shards, key_hash // num_shards % parallelization_factor
+
+
+def run_configuration(
+    records: List[dict],
+    arrival_seconds: List[float],
+    handler,
+    s3_client,
+    args,
+    batch_size: int,
+    batching_window_in_seconds: float,
+    parallelization_factor: int,
+    event_filter: str,
+) -> dict:
+    from aws_stubs import FakeLambdaContext
+
+    slots = (
+        {}
+    )  # (shard, slot): [(arrival second, record, record bytes)] in stream order
+    num_filtered_records = 0
+    for record, arrival_second in zip(records, arrival_seconds):
+        if record["eventName"] not in EVENT_FILTERS[event_filter]:
+            num_filtered_records += 1  # dropped by the event source, never invoked
+            continue
+        slots.setdefault(
+            get_slot(record, args.num_shards, parallelization_factor), []
+        ).append((arrival_second, record, len(json.dumps(record))))
+    s3_client.objects.clear()
+    num_invocations, delays, handler_seconds, done_second = 0, [], 0, 0
+    # all slots are polled concurrently: each one's batches are simulated in turn,
+    # ordered by when the slot is free, so the handler runs in simulated time order
+    free_slots = [(0.0, slot) for slot in slots]
+    heapq.heapify(free_slots)
+    positions = dict.fromkeys(slots, 0)
+    while free_slots:
+        free_second, slot = heapq.heappop(free_slots)
+        slot_records, position = slots[slot], positions[slot]
+        if position == len(slot_records):
+            continue
+        # the batch opens with the 1st record that is there once the slot is free
+        open_second = max(free_second, slot_records[position][0])
+        close_second = open_second + batching_window_in_seconds
+        end, payload_bytes = position, 0
+        while (
+            end < len(slot_records)
+            and end - position < batch_size
+            and payload_bytes + slot_records[end][2] <= MAX_PAYLOAD_BYTES
+            and slot_records[end][0] <= close_second
+        ):
+            payload_bytes += slot_records[end][2]
+            end += 1
+        if end < len(slot_records) and slot_records[end][0] <= close_second:
+            # full before the window is over
+            close_second = max(open_second, slot_records[end - 1][0])
+        event = {"Records": [record for _, record, _ in slot_records[position:end]]}
+        start_time = time.perf_counter()
+        handler.lambda_handler(event, FakeLambdaContext())
+        seconds = time.perf_counter() - start_time
+        handler_seconds += seconds
+        batch_done_second = (
+            close_second
+            + seconds
+            + (args.invocation_overhead_ms + args.s3_put_ms) / 1000
+        )
+        delays.extend(
+            batch_done_second - arrival_second
+            for arrival_second, _, _ in slot_records[position:end]
+        )
+        done_second = max(done_second, batch_done_second)
+        num_invocations += 1
+        positions[slot] = end
+        heapq.heappush(free_slots, (batch_done_second, slot))
+    delays.sort()
+    num_invoked_records = len(records) - num_filtered_records
+    return {
+        "batch_size": batch_size,
+        "batching_window_in_seconds": batching_window_in_seconds,
+        "parallelization_factor": parallelization_factor,
+        "event_filter": event_filter,
+        "filtered_records": num_filtered_records,
+        "invocations": num_invocations,
+        "records_per_invocation": (
+            num_invoked_records / num_invocations if num_invocations else 0
+        ),
+        "records_per_second": len(records) / done_second if done_second else None,
+        **{
+            f"p{percentile}_delay_seconds": (
+                get_percentile(delays, percentile) if delays else 0
+            )
+            for percentile in PERCENTILES
+        },
+        "handler_seconds": handler_seconds,
+        "s3_objects": len(s3_client.objects),
+        "s3_bytes": sum(len(body) for body in s3_client.objects.values()),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--num-records", type=int, default=20000)
+    parser.add_argument(
+        "--write-rate",
+        type=float,
+        default=10000,
+        help="stream records per second; 0 for a burst that is all there at once",
+    )
+    parser.add_argument("--num-shards", type=int, default=4)
+    parser.add_argument("--modify-fraction", type=float, default=0.3)
+    parser.add_argument("--remove-fraction", type=float, default=0.05)
+    parser.add_argument(
+        "--batch-sizes", nargs="+", type=int, default=[100, 1000, 10000]
+    )
+    parser.add_argument("--batching-windows", nargs="+", type=float, default=[0, 1])
+    parser.add_argument(
+        "--parallelization-factors", nargs="+", type=int, default=[1, 10]
+    )
+    parser.add_argument(
+        "--event-filters", nargs="+", choices=EVENT_FILTERS, default=list(EVENT_FILTERS)
+    )
+    parser.add_argument("--invocation-overhead-ms", type=float, default=20)
+    parser.add_argument("--s3-put-ms", type=float, default=30)
+    parser.add_argument(
+        "--output-json", help="file to write the numbers of every run to"
+    )
+    args = parser.parse_args()
+
+    from aws_stubs import FakeS3Client
+
+    os.environ.update(
+        AWS_DEFAULT_REGION=CDK_ENVIRONMENT["AWS_REGION"],
+        S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT="bucket",
+        UNPROCESSED_DYNAMODB_STREAM_FOLDER=CDK_ENVIRONMENT[
+            "UNPROCESSED_DYNAMODB_STREAM_FOLDER"
+        ],
+        DYNAMODB_STREAM_SINK="s3",  # 1 S3 file per invocation
+        DYNAMODB_STREAM_OUTPUT_FORMAT=CDK_ENVIRONMENT["DYNAMODB_STREAM_OUTPUT_FORMAT"],
+        REDSHIFT_LOAD_MODE=CDK_ENVIRONMENT["REDSHIFT_LOAD_MODE"],
+        DYNAMODB_STREAM_ATTRIBUTE_TYPES=json.dumps(
+            CDK_ENVIRONMENT["DYNAMODB_STREAM_ATTRIBUTE_TYPES"]
+        ),
+        DYNAMODB_STREAM_NUM_S3_SHARDS=str(
+            CDK_ENVIRONMENT["DYNAMODB_STREAM_NUM_S3_SHARDS"]
+        ),
+        DYNAMODB_STREAM_ATTRIBUTES_FOLDER=f"{CDK_ENVIRONMENT['LOADER_STATE_FOLDER']}/stream_attributes",
+        FAILED_DYNAMODB_STREAM_RECORDS_FOLDER=CDK_ENVIRONMENT[
+            "FAILED_DYNAMODB_STREAM_RECORDS_FOLDER"
+        ],
+    )
+    s3_client = FakeS3Client()
+    with mock.patch("boto3.resource", lambda service_name, **kwargs: s3_client):
+        handler = import_handler("write_dynamodb_stream_to_s3_lambda")
+    records = generate_stream_records(
+        args.num_records,
+        modify_fraction=args.modify_fraction,
+        remove_fraction=args.remove_fraction,
+    )
+    arrival_seconds = [
+        i / args.write_rate if args.write_rate else 0 for i in range(len(records))
+    ]
+
+    results = []
+    print(
+        f"{args.num_records:,} stream records over {args.num_shards} shards, "
+        + (f"{args.write_rate:,.0f} records/s" if args.write_rate else "all at once")
+    )
+    print(
+        f"{'batch':>6} {'window s':>8} {'factor':>6} {'filter':>9} {'invocations':>11} "
+        f"{'records/inv':>11} {'records/s':>10} "
+        + " ".join(f"{f'p{percentile} delay s':>13}" for percentile in PERCENTILES)
+        + f" {'S3 objects':>10} {'S3 MB':>7}"
+    )
+    stdout = sys.stdout
+    for (
+        batch_size,
+        batching_window,
+        parallelization_factor,
+        event_filter,
+    ) in itertools.product(
+        args.batch_sizes,
+        args.batching_windows,
+        args.parallelization_factors,
+        args.event_filters,
+    ):
+        sys.stdout = open(os.devnull, "w")  # the handler prints a lot
+        try:
+            result = run_configuration(
+                records=records,
+                arrival_seconds=arrival_seconds,
+                handler=handler,
+                s3_client=s3_client,
+                args=args,
+                batch_size=batch_size,
+                batching_window_in_seconds=batching_window,
+                parallelization_factor=parallelization_factor,
+                event_filter=event_filter,
+            )
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        results.append(result)
+        print(
+            f"{batch_size:>6} {batching_window:>8g} {parallelization_factor:>6} "
+            f"{event_filter:>9} {result['invocations']:>11,} "
+            f"{result['records_per_invocation']:>11,.0f} "
+            f"{result['records_per_second'] or 0:>10,.0f} "
+            + " ".join(
+                f"{result[f'p{percentile}_delay_seconds']:>13.2f}"
+                for percentile in PERCENTILES
+            )
+            + f" {result['s3_objects']:>10,} {result['s3_bytes'] / 2**20:>7.2f}"
+        )
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
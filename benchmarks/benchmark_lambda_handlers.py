@@ -0,0 +1,418 @@
+"""Run each Lambda handler locally against stubbed AWS clients (`aws_stubs.py`) at
+several payload sizes and report the duration and peak RSS, so the Lambda
+performance profiles in `cdk.json` are backed by measurements.
+
+Every handler and payload size runs in a fresh Python process, so peak RSS is not
+inflated by an earlier run. The payload is the number of DynamoDB stream records,
+CSV rows or JSON records; for the Redshift loader it is the number of pending stream
+files, and for the reconciliation it is the number of DynamoDB items, all of which
+changed since the last run. Lambda gives a function CPU in proportion to its memory
+(1 vCPU at 1769 MB), so the estimated duration of a CPU-bound handler at a profile is
+the local duration scaled by 1769 MB / memory size.
+
+$ python benchmarks/benchmark_lambda_handlers.py --num-records 1000 10000 100000
+"""
+
+import argparse
+import csv
+import gc
+import importlib.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPO_DIRECTORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+SOURCE_DIRECTORY = os.path.join(REPO_DIRECTORY, "source")
+sys.path.insert(0, BENCHMARKS_DIRECTORY)
+
+# without importing `cdk_infrastructure`, which needs aws-cdk-lib
+spec = importlib.util.spec_from_file_location(
+    "lambda_profiles",
+    os.path.join(REPO_DIRECTORY, "cdk_infrastructure", "lambda_profiles.py"),
+)
+lambda_profiles = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(lambda_profiles)
+
+with open(os.path.join(REPO_DIRECTORY, "cdk.json")) as f:
+    CDK_ENVIRONMENT = json.load(f)["context"]["environment"]
+FULL_VCPU_MEMORY_SIZE = lambda_profiles.LAMBDA_PERFORMANCE_PROFILES["large"]
+HEADROOM = 1.25  # peak RSS may differ a little on Lambda
+HANDLER_DIRECTORIES = {  # keys of `LAMBDA_PERFORMANCE_PROFILES` in `cdk.json`
+    "LOAD_DATA_TO_RDS": "load_data_to_rds_lambda",
+    "START_DMS_REPLICATION_TASK": "start_dms_replication_task_lambda",
+    "LOAD_DATA_TO_DYNAMODB": "load_data_to_dynamodb_lambda",
+    "WRITE_DYNAMODB_STREAM_TO_S3": "write_dynamodb_stream_to_s3_lambda",
+    "LOAD_S3_FILES_TO_REDSHIFT": "load_s3_files_from_dynamodb_stream_to_redshift_lambda",
+    "RECONCILE_CDC": "reconcile_cdc_lambda",
+}
+
+
+def import_handler(name: str):
+    sys.path[:0] = [
+        os.path.join(SOURCE_DIRECTORY, HANDLER_DIRECTORIES[name]),
+        os.path.join(SOURCE_DIRECTORY, "shared_lambda_layer", "python"),
+    ]
+    import handler
+
+    return handler
+
+
+def prepare_load_data_to_rds(num_records: int, temp_directory: str):
+    import pymysql
+    from aws_stubs import FakeMySQLConnection, cycle
+
+    with open(
+        os.path.join(SOURCE_DIRECTORY, "load_data_to_rds_lambda", "txns.csv")
+    ) as f:
+        header, *rows = list(csv.reader(f))
+    csv_filename = os.path.join(temp_directory, "txns.csv")
+    with open(csv_filename, "w", newline="") as f:
+        csv.writer(f).writerows([header] + cycle(rows, num_records))
+    os.environ.update(
+        RDS_HOST="localhost",
+        RDS_USER=CDK_ENVIRONMENT["RDS_USER"],
+        RDS_PASSWORD=CDK_ENVIRONMENT["RDS_PASSWORD"],
+        RDS_DATABASE_NAME=CDK_ENVIRONMENT["RDS_DATABASE_NAME"],
+        RDS_TABLE_NAME=CDK_ENVIRONMENT["RDS_TABLE_NAME"],
+        CSV_FILENAME=csv_filename,
+        RDS_LOAD_MODE="chunked_insert",  # LOAD DATA needs a real MySQL server
+        RDS_LOAD_BATCH_SIZE=str(CDK_ENVIRONMENT["RDS_LOAD_BATCH_SIZE"]),
+        RDS_INFER_COLUMN_TYPES=json.dumps(CDK_ENVIRONMENT["RDS_INFER_COLUMN_TYPES"]),
+        RDS_SCHEMA_SAMPLE_SIZE=str(CDK_ENVIRONMENT["RDS_SCHEMA_SAMPLE_SIZE"]),
+    )
+    pymysql.connect = FakeMySQLConnection
+    handler = import_handler("LOAD_DATA_TO_RDS")
+    return lambda context: handler.lambda_handler({}, context)
+
+
+def prepare_start_dms_replication_task(num_records: int, temp_directory: str):
+    from aws_stubs import FakeDMSClient
+
+    os.environ.update(
+        DMS_REPLICATION_TASK_ARNS=",".join(
+            f"arn:aws:dms:us-east-1:123456789012:task:{i}"
+            for i in range(CDK_ENVIRONMENT["DMS_NUM_REPLICATION_TASKS"])
+        )
+    )
+    with mock.patch("boto3.client", lambda service_name, **kwargs: FakeDMSClient()):
+        handler = import_handler("START_DMS_REPLICATION_TASK")
+    return lambda context: handler.lambda_handler({}, context)
+
+
+def prepare_load_data_to_dynamodb(num_records: int, temp_directory: str):
+    from aws_stubs import cycle, short_circuit_batch_write_item
+
+    with open(
+        os.path.join(SOURCE_DIRECTORY, "load_data_to_dynamodb_lambda", "trades.json")
+    ) as f:
+        trades = json.load(f)["data"]
+    trades = [
+        {**trade, "id": f"{trade['id']}{i}"}  # unique ids, as in 1 BatchWriteItem
+        for i, trade in enumerate(cycle(trades, num_records))
+    ]
+    json_filename = os.path.join(temp_directory, "trades.json")
+    with open(json_filename, "w") as f:
+        json.dump({"data": trades}, f)
+    os.environ.update(
+        DYNAMODB_TABLE_NAME="trades",
+        JSON_FILENAME=json_filename,
+        DYNAMODB_LOAD_MAX_WORKERS=str(CDK_ENVIRONMENT["DYNAMODB_LOAD_MAX_WORKERS"]),
+        DYNAMODB_LOAD_MAX_WRITE_UNITS_PER_SECOND=json.dumps(
+            CDK_ENVIRONMENT["DYNAMODB_LOAD_MAX_WRITE_UNITS_PER_SECOND"]
+        ),
+    )
+    handler = import_handler("LOAD_DATA_TO_DYNAMODB")
+    short_circuit_batch_write_item(handler.dynamodb_client)
+    return lambda context: handler.lambda_handler({}, context)
+
+
+def prepare_write_dynamodb_stream_to_s3(num_records: int, temp_directory: str):
+    from aws_stubs import FakeS3Client
+    from benchmark_dynamodb_image_decoder import get_images
+
+    event = {
+        "Records": [
+            {
+                "eventName": "INSERT",
+                "dynamodb": {
+                    "ApproximateCreationDateTime": 1640995200,
+                    "Keys": {"id": {"S": f"{i:010d}"}},
+                    # unique `id`s, or the Lambda collapses the repeated trades
+                    "NewImage": dict(image, id={"S": f"{i:010d}"}),
+                    "SequenceNumber": str(10**20 + i),
+                },
+            }
+            for i, image in enumerate(get_images(num_records))
+        ]
+    }
+    os.environ.update(
+        S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT="bucket",
+        UNPROCESSED_DYNAMODB_STREAM_FOLDER=CDK_ENVIRONMENT[
+            "UNPROCESSED_DYNAMODB_STREAM_FOLDER"
+        ],
+        DYNAMODB_STREAM_SINK="s3",  # Firehose does the encoding itself
+        DYNAMODB_STREAM_OUTPUT_FORMAT=CDK_ENVIRONMENT["DYNAMODB_STREAM_OUTPUT_FORMAT"],
+        REDSHIFT_LOAD_MODE=CDK_ENVIRONMENT["REDSHIFT_LOAD_MODE"],
+        DYNAMODB_STREAM_ATTRIBUTE_TYPES=json.dumps(
+            CDK_ENVIRONMENT["DYNAMODB_STREAM_ATTRIBUTE_TYPES"]
+        ),
+        DYNAMODB_STREAM_NUM_S3_SHARDS=str(
+            CDK_ENVIRONMENT["DYNAMODB_STREAM_NUM_S3_SHARDS"]
+        ),
+        DYNAMODB_STREAM_ATTRIBUTES_FOLDER=f"{CDK_ENVIRONMENT['LOADER_STATE_FOLDER']}/stream_attributes",
+        FAILED_DYNAMODB_STREAM_RECORDS_FOLDER=CDK_ENVIRONMENT[
+            "FAILED_DYNAMODB_STREAM_RECORDS_FOLDER"
+        ],
+    )
+    with mock.patch("boto3.resource", lambda service_name, **kwargs: FakeS3Client()):
+        handler = import_handler("WRITE_DYNAMODB_STREAM_TO_S3")
+    return lambda context: handler.lambda_handler(event, context)
+
+
+def prepare_load_s3_files_to_redshift(num_records: int, temp_directory: str):
+    from aws_stubs import FakeRedshiftDataClient, FakeS3Client
+
+    s3_client = FakeS3Client()
+    folder = CDK_ENVIRONMENT["UNPROCESSED_DYNAMODB_STREAM_FOLDER"]
+    for i in range(num_records):  # 100 files per hourly partition
+        s3_client.objects[
+            f"{folder}/dt=2022-01-01/hour={i // 100 % 24:02d}/"
+            f"2022-01-01T00:00:00Z__{i:08d}__100__inserted_or_modified_records.json.gz"
+        ] = (b"\0" * 4096)
+    os.environ.update(
+        {
+            key: (
+                str(CDK_ENVIRONMENT[key])
+                if isinstance(CDK_ENVIRONMENT[key], int)
+                else CDK_ENVIRONMENT[key]
+            )
+            for key in [
+                "UNPROCESSED_DYNAMODB_STREAM_FOLDER",
+                "PROCESSED_DYNAMODB_STREAM_FOLDER",
+                "LOADER_STATE_FOLDER",
+                "S3_PROMOTION_MAX_WORKERS",
+                "LISTING_LOOKBACK_IN_MINUTES",
+                "FULL_LISTING_INTERVAL_IN_MINUTES",
+                "REDSHIFT_USER",
+                "REDSHIFT_DATABASE_NAME",
+                "REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC",
+                "REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC",
+                "REDSHIFT_LOAD_MODE",
+            ]
+        },
+        AWSREGION=CDK_ENVIRONMENT["AWS_REGION"],
+        S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT="bucket",
+        DYNAMODB_STREAM_ATTRIBUTES_FOLDER=f"{CDK_ENVIRONMENT['LOADER_STATE_FOLDER']}/stream_attributes",
+        REDSHIFT_ENDPOINT_ADDRESS="cluster.abc.us-east-1.redshift.amazonaws.com",
+        REDSHIFT_ROLE_ARN="arn:aws:iam::123456789012:role/redshift",
+        USE_MANIFEST_COPY=json.dumps(CDK_ENVIRONMENT["USE_MANIFEST_COPY"]),
+        LOAD_PARTITIONS_CONCURRENTLY=json.dumps(
+            CDK_ENVIRONMENT["LOAD_PARTITIONS_CONCURRENTLY"]
+        ),
+        # as deployed: a bigger backlog is loaded over several runs
+        MAX_FILES_PER_RUN=str(CDK_ENVIRONMENT["MAX_FILES_PER_RUN"]),
+    )
+    os.environ.pop("LOADER_LEASE_TABLE_NAME", None)
+    clients = {"s3": s3_client, "redshift-data": FakeRedshiftDataClient()}
+    with mock.patch(
+        "boto3.client", lambda service_name, **kwargs: clients[service_name]
+    ):
+        handler = import_handler("LOAD_S3_FILES_TO_REDSHIFT")
+    return lambda context: handler.lambda_handler({}, context)
+
+
+def prepare_reconcile_cdc(num_records: int, temp_directory: str):
+    """The 1st run: there is no state object yet, so every month of the RDS table is
+    checksummed and every changed id is looked up in DynamoDB"""
+    import pymysql
+    from aws_stubs import (
+        FakeDynamoDBClient,
+        FakeReconciliationMySQLConnection,
+        FakeReconciliationRedshiftDataClient,
+        FakeS3Client,
+    )
+
+    columns = [  # the RDS loader's table of `txns.csv`: (name, MySQL type, Redshift type)
+        ("account_no", "bigint", "bigint", "bigint"),
+        ("date", "date", "date", "date"),
+        ("transaction_details", "text", "text", "character varying"),
+        ("chip_used", "tinyint", "tinyint(1)", "boolean"),
+        ("value_date", "date", "date", "date"),
+        ("withdrawal_amt", "decimal", "decimal(20,2)", "numeric"),
+        ("deposit_amt", "decimal", "decimal(20,2)", "numeric"),
+        ("balance_amt", "decimal", "decimal(20,2)", "numeric"),
+    ]
+    buckets = [
+        f"{year}-{month:02d}" for year in range(2017, 2020) for month in range(1, 13)
+    ]
+    keys = [f"{i:010d}" for i in range(num_records)]
+    os.environ.update(
+        {
+            key: (
+                str(CDK_ENVIRONMENT[key])
+                if isinstance(CDK_ENVIRONMENT[key], int)
+                else CDK_ENVIRONMENT[key]
+            )
+            for key in [
+                "RECONCILIATION_NUM_BUCKETS",
+                "RECONCILIATION_RDS_BUCKET_COLUMN",
+                "RECONCILIATION_HEARTBEAT_TABLE_NAME",
+                "RECONCILIATION_SAMPLE_BUCKETS_PER_RUN",
+                "RECONCILIATION_DYNAMODB_SCAN_SEGMENTS",
+                "RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN",
+                "RECONCILIATION_LOOKBACK_IN_MINUTES",
+                "RECONCILIATION_STATE_FOLDER",
+                "RDS_USER",
+                "RDS_PASSWORD",
+                "RDS_DATABASE_NAME",
+                "RDS_TABLE_NAME",
+                "UNPROCESSED_DYNAMODB_STREAM_FOLDER",
+                "REDSHIFT_USER",
+                "REDSHIFT_DATABASE_NAME",
+                "REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC",
+                "REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC",
+            ]
+        },
+        RDS_HOST="localhost",
+        DYNAMODB_TABLE_NAME="trades",
+        S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT="bucket",
+        REDSHIFT_ENDPOINT_ADDRESS="cluster.abc.us-east-1.redshift.amazonaws.com",
+    )
+    pymysql.connect = lambda **connect_kwargs: FakeReconciliationMySQLConnection(
+        columns=[
+            (name, data_type, column_type)
+            for name, data_type, column_type, _ in columns
+        ],
+        buckets=buckets,
+        num_rows_per_bucket=1000,
+        **connect_kwargs,
+    )
+    clients = {
+        "s3": FakeS3Client(),
+        "dynamodb": FakeDynamoDBClient(keys),
+        "redshift-data": FakeReconciliationRedshiftDataClient(
+            columns={
+                name: redshift_data_type for name, _, _, redshift_data_type in columns
+            },
+            buckets=buckets,
+            num_rows_per_bucket=1000,
+            keys=keys,
+        ),
+    }
+    with mock.patch(
+        "boto3.client", lambda service_name, **kwargs: clients[service_name]
+    ):
+        handler = import_handler("RECONCILE_CDC")
+    return lambda context: handler.lambda_handler({}, context)
+
+
+PREPARE_FUNCTIONS = {
+    "LOAD_DATA_TO_RDS": prepare_load_data_to_rds,
+    "START_DMS_REPLICATION_TASK": prepare_start_dms_replication_task,
+    "LOAD_DATA_TO_DYNAMODB": prepare_load_data_to_dynamodb,
+    "WRITE_DYNAMODB_STREAM_TO_S3": prepare_write_dynamodb_stream_to_s3,
+    "LOAD_S3_FILES_TO_REDSHIFT": prepare_load_s3_files_to_redshift,
+    "RECONCILE_CDC": prepare_reconcile_cdc,
+}
+
+
+def get_peak_rss_in_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def run_one(name: str, num_records: int) -> dict:
+    """Runs in the child process"""
+    from aws_stubs import FakeLambdaContext
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", CDK_ENVIRONMENT["AWS_REGION"])
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")  # never sent anywhere
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    with tempfile.TemporaryDirectory() as temp_directory:
+        invoke = PREPARE_FUNCTIONS[name](num_records, temp_directory)
+        gc.collect()
+        peak_rss_before_in_mb = get_peak_rss_in_mb()
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")  # the handlers print a lot
+        try:
+            start_time = time.perf_counter()
+            invoke(FakeLambdaContext())
+            seconds = time.perf_counter() - start_time
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return {
+        "seconds": seconds,
+        "peak_rss_in_mb": get_peak_rss_in_mb(),
+        "handler_rss_in_mb": get_peak_rss_in_mb() - peak_rss_before_in_mb,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--handlers",
+        nargs="+",
+        choices=list(PREPARE_FUNCTIONS),
+        default=list(PREPARE_FUNCTIONS),
+    )
+    parser.add_argument(
+        "--num-records", nargs="+", type=int, default=[1000, 10000, 100000]
+    )
+    parser.add_argument(
+        "--run-one", nargs=2, metavar=("HANDLER", "NUM_RECORDS"), help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(
+            json.dumps(run_one(name=args.run_one[0], num_records=int(args.run_one[1])))
+        )
+        return
+
+    profiles = lambda_profiles.LAMBDA_PERFORMANCE_PROFILES
+    print(
+        f"{'handler':<28} {'payload':>9} {'local s':>9} {'peak RSS MB':>12}  "
+        + "  ".join(f"{f'~s at {profile}':>14}" for profile in profiles)
+        + "  configured"
+    )
+    for name in args.handlers:
+        configured_sizing = lambda_profiles.get_lambda_sizing(
+            profile=CDK_ENVIRONMENT["LAMBDA_PERFORMANCE_PROFILES"][name],
+            default_timeout_in_seconds=0,
+        )
+        for num_records in args.num_records:
+            result = json.loads(
+                subprocess.run(
+                    [sys.executable, __file__, "--run-one", name, str(num_records)],
+                    check=True,
+                    stdout=subprocess.PIPE,  # errors go to stderr
+                    text=True,
+                ).stdout.splitlines()[-1]
+            )
+            estimates = []
+            for memory_size in profiles.values():
+                if result["peak_rss_in_mb"] * HEADROOM > memory_size:
+                    estimates.append(f"{'out of memory':>14}")
+                else:
+                    estimated_seconds = result["seconds"] * max(
+                        1, FULL_VCPU_MEMORY_SIZE / memory_size
+                    )
+                    estimates.append(f"{estimated_seconds:>14.3f}")
+            print(
+                f"{name:<28} {num_records:>9,} {result['seconds']:>9.3f} "
+                f"{result['peak_rss_in_mb']:>12.1f}  "
+                + "  ".join(estimates)
+                + f"  {configured_sizing['memory_size']} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,20 +7,35 @@ from aws_cdk import (
     RemovalPolicy,
     SecretValue,
     Stack,
-    aws_dms as dms,
-    aws_dynamodb as dynamodb,
-    aws_ec2 as ec2,
-    aws_events as events,
-    aws_events_targets as events_targets,
-    aws_iam as iam,
-    aws_lambda as _lambda,
-    aws_lambda_event_sources as event_sources,
-    aws_rds as rds,
-    aws_redshift as redshift,
-    aws_s3 as s3,
 )
+from aws_cdk import aws_dms as dms
+from aws_cdk import aws_dynamodb as dynamodb
+from aws_cdk import aws_ec2 as ec2
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as events_targets
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_kinesisfirehose as firehose
+from aws_cdk import aws_lambda as _lambda
+from aws_cdk import aws_lambda_event_sources as event_sources
+from aws_cdk import aws_rds as rds
+from aws_cdk import aws_redshift as redshift
+from aws_cdk import aws_s3 as s3
+from aws_cdk import aws_s3_notifications as s3n
+from aws_cdk import aws_sqs as sqs
 from constructs import Construct
 
+from cdk_infrastructure.dms_task_config import (
+    get_replication_task_settings,
+    get_table_mappings,
+    shard_tables,
+)
+from cdk_infrastructure.lambda_profiles import get_lambda_sizing
+
+# output formats of the DynamoDB stream Lambda that need extra Python packages
+OUTPUT_FORMAT_PYTHON_PACKAGES = {"json_zstd": "zstandard", "parquet": "pyarrow"}
+FIREHOSE_COMPRESSION_FORMATS = {"json": "UNCOMPRESSED", "json_gzip": "GZIP"}
+DYNAMODB_STREAM_EVENT_NAMES = ["INSERT", "MODIFY", "REMOVE"]
+
 
 class RedshiftService(Construct):
     def __init__(
@@ -65,6 +80,7 @@ class RDSService(Construct):
         environment: dict,
         vpc: ec2.Vpc,
         security_group: ec2.SecurityGroup,
+        shared_lambda_layer: _lambda.LayerVersion,
     ) -> None:
         super().__init__(scope, construct_id)  # required
         self.rds_instance = rds.DatabaseInstance(
@@ -91,6 +107,7 @@ class RDSService(Construct):
                 "binlog_format": "ROW",
                 "binlog_row_image": "full",
                 "binlog_checksum": "NONE",
+                "local_infile": "1",  # for LOAD DATA LOCAL INFILE of the CSV file
                 ### eventually set binlog retention hours with CustomResource
             },
             publicly_accessible=True,  ### will have to figure out VPC
@@ -98,6 +115,10 @@ class RDSService(Construct):
             delete_automated_backups=True,
         )
 
+        load_data_to_rds_lambda_sizing = get_lambda_sizing(
+            profile=environment["LAMBDA_PERFORMANCE_PROFILES"]["LOAD_DATA_TO_RDS"],
+            default_timeout_in_seconds=3,  # should be fairly quick
+        )
         self.load_data_to_rds_lambda = _lambda.Function(
             self,
             "LoadDataToRDSLambda",
@@ -113,22 +134,31 @@ class RDSService(Construct):
                         " && ".join(
                             [
                                 "pip install -r requirements.txt -t /asset-output",
-                                "cp handler.py txns.csv /asset-output",  # need to cp instead of mv
+                                "cp *.py txns.csv /asset-output",  # need to cp instead of mv
                             ]
                         ),
                     ],
                 ),
             ),
             handler="handler.lambda_handler",
-            timeout=Duration.seconds(3),  # should be fairly quick
-            memory_size=128,  # in MB
+            timeout=Duration.seconds(
+                load_data_to_rds_lambda_sizing["timeout_in_seconds"]
+            ),
+            memory_size=load_data_to_rds_lambda_sizing["memory_size"],  # in MB
             environment={
                 "RDS_USER": environment["RDS_USER"],
                 "RDS_PASSWORD": environment["RDS_PASSWORD"],
                 "RDS_DATABASE_NAME": environment["RDS_DATABASE_NAME"],
                 "RDS_TABLE_NAME": environment["RDS_TABLE_NAME"],
                 "CSV_FILENAME": environment["CSV_FILENAME"],
+                "RDS_LOAD_MODE": environment["RDS_LOAD_MODE"],
+                "RDS_LOAD_BATCH_SIZE": str(environment["RDS_LOAD_BATCH_SIZE"]),
+                "RDS_INFER_COLUMN_TYPES": json.dumps(
+                    environment["RDS_INFER_COLUMN_TYPES"]
+                ),
+                "RDS_SCHEMA_SAMPLE_SIZE": str(environment["RDS_SCHEMA_SAMPLE_SIZE"]),
             },
+            layers=[shared_lambda_layer],
         )
 
         # connect the AWS resources
@@ -146,6 +176,7 @@ class CDCFromRDSToRedshiftService(Construct):
         rds_endpoint_address: str,
         redshift_endpoint_address: str,
         security_group_id: str,
+        shared_lambda_layer: _lambda.LayerVersion,
     ) -> None:
         super().__init__(scope, construct_id)  # required
         self.dms_rds_source_endpoint = dms.CfnEndpoint(
@@ -172,55 +203,43 @@ class CDCFromRDSToRedshiftService(Construct):
         self.dms_replication_instance = dms.CfnReplicationInstance(
             self,
             "DMSReplicationInstance",
-            replication_instance_class="dms.t3.micro",  # for demo purposes
+            replication_instance_class=environment[
+                "DMS_REPLICATION_INSTANCE_CLASS"
+            ],  # dms.t3.micro for demo purposes
             vpc_security_group_ids=[security_group_id],
             publicly_accessible=False,
         )
-        self.dms_replication_task = dms.CfnReplicationTask(
-            self,
-            "DMSReplicationTask",
-            migration_type="full-load-and-cdc",
-            replication_instance_arn=self.dms_replication_instance.ref,  # appears that
-            source_endpoint_arn=self.dms_rds_source_endpoint.ref,  # `ref` means
-            target_endpoint_arn=self.dms_redshift_target_endpoint.ref,  # arn
-            table_mappings=json.dumps(
-                {
-                    "rules": [
-                        {
-                            "rule-type": "selection",
-                            "rule-id": "1",
-                            "rule-name": "1",
-                            "object-locator": {
-                                "schema-name": "%",
-                                "table-name": environment["RDS_TABLE_NAME"],
-                            },
-                            "rule-action": "include",
-                            "filters": [],
-                        }
-                    ]
-                }
-            ),
-            replication_task_settings=json.dumps({"Logging": {"EnableLogging": True}}),
+        replication_task_settings = get_replication_task_settings(
+            tuning=environment["DMS_REPLICATION_TASK_TUNING"]
         )
-
-        env_vars = {
-            "PRINT_RDS_AND_REDSHIFT_NUM_ROWS": json.dumps(
-                environment["PRINT_RDS_AND_REDSHIFT_NUM_ROWS"]
+        self.dms_replication_tasks = []
+        for i, tables in enumerate(
+            shard_tables(
+                tables=environment["DMS_TABLES"],
+                num_replication_tasks=environment["DMS_NUM_REPLICATION_TASKS"],
             )
-        }
-        if environment["PRINT_RDS_AND_REDSHIFT_NUM_ROWS"]:
-            env_vars.update(
-                {
-                    "RDS_HOST": rds_endpoint_address,
-                    "RDS_USER": environment["RDS_USER"],
-                    "RDS_PASSWORD": environment["RDS_PASSWORD"],
-                    "RDS_DATABASE_NAME": environment["RDS_DATABASE_NAME"],
-                    "RDS_TABLE_NAME": environment["RDS_TABLE_NAME"],
-                    "REDSHIFT_ENDPOINT_ADDRESS": redshift_endpoint_address,
-                    "REDSHIFT_USER": environment["REDSHIFT_USER"],
-                    "REDSHIFT_DATABASE_NAME": environment["REDSHIFT_DATABASE_NAME"],
-                }
+        ):
+            self.dms_replication_tasks.append(
+                dms.CfnReplicationTask(
+                    self,
+                    # 1st task keeps its original ID so it is not replaced
+                    "DMSReplicationTask" if i == 0 else f"DMSReplicationTask{i + 1}",
+                    migration_type="full-load-and-cdc",
+                    replication_instance_arn=self.dms_replication_instance.ref,  # appears that
+                    source_endpoint_arn=self.dms_rds_source_endpoint.ref,  # `ref` means
+                    target_endpoint_arn=self.dms_redshift_target_endpoint.ref,  # arn
+                    table_mappings=json.dumps(get_table_mappings(tables=tables)),
+                    replication_task_settings=json.dumps(replication_task_settings),
+                )
             )
+        self.dms_replication_task = self.dms_replication_tasks[0]
+
+        start_dms_replication_task_lambda_sizing = get_lambda_sizing(
+            profile=environment["LAMBDA_PERFORMANCE_PROFILES"][
+                "START_DMS_REPLICATION_TASK"
+            ],
+            default_timeout_in_seconds=3,  # should be fairly quick
+        )
         self.start_dms_replication_task_lambda = _lambda.Function(
             self,
             "StartDMSReplicationTaskLambda",
@@ -243,9 +262,13 @@ class CDCFromRDSToRedshiftService(Construct):
                 ),
             ),
             handler="handler.lambda_handler",
-            timeout=Duration.seconds(3),  # should be fairly quick
-            memory_size=128,  # in MB
-            environment=env_vars,
+            timeout=Duration.seconds(
+                start_dms_replication_task_lambda_sizing["timeout_in_seconds"]
+            ),
+            memory_size=start_dms_replication_task_lambda_sizing[
+                "memory_size"
+            ],  # in MB
+            layers=[shared_lambda_layer],
         )
         self.start_dms_replication_task_lambda.add_to_role_policy(
             iam.PolicyStatement(
@@ -253,23 +276,14 @@ class CDCFromRDSToRedshiftService(Construct):
                 resources=["*"],
             )
         )
-        if environment["PRINT_RDS_AND_REDSHIFT_NUM_ROWS"]:
-            self.start_dms_replication_task_lambda.add_to_role_policy(
-                iam.PolicyStatement(
-                    actions=[
-                        "redshift-data:ExecuteStatement",
-                        "redshift-data:DescribeStatement",
-                        "redshift-data:GetStatementResult",
-                        "redshift:GetClusterCredentials",
-                    ],
-                    resources=["*"],
-                )
-            )
 
         # connect the AWS resources
         self.start_dms_replication_task_lambda.add_environment(
-            key="DMS_REPLICATION_TASK_ARN",
-            value=self.dms_replication_task.ref,  # appears `ref` means arn
+            key="DMS_REPLICATION_TASK_ARNS",
+            value=",".join(  # appears `ref` means arn
+                dms_replication_task.ref
+                for dms_replication_task in self.dms_replication_tasks
+            ),
         )
 
 
@@ -279,6 +293,7 @@ class DynamoDBService(Construct):
         scope: Construct,
         construct_id: str,
         environment: dict,
+        shared_lambda_layer: _lambda.LayerVersion,
     ) -> None:
         super().__init__(scope, construct_id)  # required
         self.dynamodb_table = dynamodb.Table(
@@ -302,11 +317,16 @@ class DynamoDBService(Construct):
                 s3.LifecycleRule(
                     id="expire_files_with_certain_prefix_after_1_day",
                     expiration=Duration.days(1),
+                    # also covers the dt=/hour= partitions and the manifests below it
                     prefix=f"{environment['PROCESSED_DYNAMODB_STREAM_FOLDER']}/",
                 ),
             ],
         )
 
+        load_data_to_dynamodb_lambda_sizing = get_lambda_sizing(
+            profile=environment["LAMBDA_PERFORMANCE_PROFILES"]["LOAD_DATA_TO_DYNAMODB"],
+            default_timeout_in_seconds=3,  # should be fairly quick
+        )
         self.load_data_to_dynamodb_lambda = _lambda.Function(
             self,
             "LoadDataToDynamoDBLambda",
@@ -316,27 +336,94 @@ class DynamoDBService(Construct):
                 exclude=[".venv/*"],
             ),
             handler="handler.lambda_handler",
-            timeout=Duration.seconds(3),  # should be fairly quick
-            memory_size=128,  # in MB
-            environment={"JSON_FILENAME": environment["JSON_FILENAME"]},
+            timeout=Duration.seconds(
+                load_data_to_dynamodb_lambda_sizing["timeout_in_seconds"]
+            ),
+            memory_size=load_data_to_dynamodb_lambda_sizing["memory_size"],  # in MB
+            environment={
+                "JSON_FILENAME": environment["JSON_FILENAME"],
+                "DYNAMODB_LOAD_MAX_WORKERS": str(
+                    environment["DYNAMODB_LOAD_MAX_WORKERS"]
+                ),
+                # no key for `null` (an on-demand table), as CDK drops null context values
+                "DYNAMODB_LOAD_MAX_WRITE_UNITS_PER_SECOND": json.dumps(
+                    environment.get("DYNAMODB_LOAD_MAX_WRITE_UNITS_PER_SECOND")
+                ),
+            },
+            layers=[shared_lambda_layer],
+        )
+        output_format = environment["DYNAMODB_STREAM_OUTPUT_FORMAT"]
+        if (
+            environment["DYNAMODB_STREAM_SINK"] == "firehose"
+            and output_format not in FIREHOSE_COMPRESSION_FORMATS
+        ):
+            raise ValueError(
+                f'"{output_format}" output format is not supported with Firehose; '
+                f"use one of {list(FIREHOSE_COMPRESSION_FORMATS)}"
+            )
+        if output_format in OUTPUT_FORMAT_PYTHON_PACKAGES:
+            write_dynamodb_stream_to_s3_lambda_code = _lambda.Code.from_asset(
+                "source/write_dynamodb_stream_to_s3_lambda",
+                bundling=BundlingOptions(
+                    image=_lambda.Runtime.PYTHON_3_9.bundling_image,
+                    command=[
+                        "bash",
+                        "-c",
+                        " && ".join(
+                            [
+                                f"pip install {OUTPUT_FORMAT_PYTHON_PACKAGES[output_format]} -t /asset-output",
+                                "cp *.py /asset-output",  # need to cp instead of mv
+                            ]
+                        ),
+                    ],
+                ),
+            )
+        else:
+            write_dynamodb_stream_to_s3_lambda_code = _lambda.Code.from_asset(
+                "source/write_dynamodb_stream_to_s3_lambda",
+                exclude=[".venv/*"],
+            )
+        write_dynamodb_stream_to_s3_lambda_sizing = get_lambda_sizing(
+            profile=environment["LAMBDA_PERFORMANCE_PROFILES"][
+                "WRITE_DYNAMODB_STREAM_TO_S3"
+            ],
+            default_timeout_in_seconds=3,  # should be fairly quick
         )
         self.write_dynamodb_stream_to_s3_lambda = _lambda.Function(
             self,
             "WriteDynamoDBStreamToS3Lambda",
             runtime=_lambda.Runtime.PYTHON_3_9,
-            code=_lambda.Code.from_asset(
-                "source/write_dynamodb_stream_to_s3_lambda",
-                exclude=[".venv/*"],
-            ),
+            code=write_dynamodb_stream_to_s3_lambda_code,
             handler="handler.lambda_handler",
-            timeout=Duration.seconds(3),  # should be fairly quick
-            memory_size=128,  # in MB
+            timeout=Duration.seconds(
+                write_dynamodb_stream_to_s3_lambda_sizing["timeout_in_seconds"]
+            ),
+            memory_size=write_dynamodb_stream_to_s3_lambda_sizing[
+                "memory_size"
+            ],  # in MB
             environment={  # apparently "AWS_REGION" is not allowed as a Lambda env variable
                 "AWSREGION": environment["AWS_REGION"],
                 "UNPROCESSED_DYNAMODB_STREAM_FOLDER": environment[
                     "UNPROCESSED_DYNAMODB_STREAM_FOLDER"
                 ],
+                "FAILED_DYNAMODB_STREAM_RECORDS_FOLDER": environment[
+                    "FAILED_DYNAMODB_STREAM_RECORDS_FOLDER"
+                ],
+                "DYNAMODB_STREAM_OUTPUT_FORMAT": output_format,
+                # tombstones of REMOVEs are only written for the upsert
+                "REDSHIFT_LOAD_MODE": environment["REDSHIFT_LOAD_MODE"],
+                "DYNAMODB_STREAM_ATTRIBUTE_TYPES": json.dumps(
+                    environment["DYNAMODB_STREAM_ATTRIBUTE_TYPES"]
+                ),
+                "DYNAMODB_STREAM_NUM_S3_SHARDS": str(
+                    environment["DYNAMODB_STREAM_NUM_S3_SHARDS"]
+                ),
+                # read by the Redshift loader
+                "DYNAMODB_STREAM_ATTRIBUTES_FOLDER": (
+                    f"{environment['LOADER_STATE_FOLDER']}/stream_attributes"
+                ),
             },
+            layers=[shared_lambda_layer],
         )
 
         # connect the AWS resources
@@ -348,18 +435,118 @@ class DynamoDBService(Construct):
             key="S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT",
             value=self.s3_bucket_for_cdc_from_dynamodb_to_redshift.bucket_name,
         )
+        # gets the shard and sequence numbers (not the records) of the batches that
+        # still failed after the retries, to read them from the stream within 24 hours
+        self.failed_dynamodb_stream_batches_queue = sqs.Queue(
+            self,
+            "FailedDynamoDBStreamBatchesQueue",
+            retention_period=Duration.days(14),
+        )
+        event_names = environment["DYNAMODB_STREAM_EVENT_NAMES"]
+        if not event_names or set(event_names) - set(DYNAMODB_STREAM_EVENT_NAMES):
+            raise ValueError(
+                "`DYNAMODB_STREAM_EVENT_NAMES` should be some of "
+                f"{DYNAMODB_STREAM_EVENT_NAMES}, not {event_names}"
+            )
         self.write_dynamodb_stream_to_s3_lambda.add_event_source(
             event_sources.DynamoEventSource(
                 self.dynamodb_table,
                 starting_position=_lambda.StartingPosition.LATEST,
-                batch_size=100,  # hard coded
-                max_batching_window=Duration.seconds(5),  # hard coded
-                # filters=[{"event_name": _lambda.FilterRule.is_equal("INSERT")}]
+                # up to 10000 records or 6 MB per invocation
+                batch_size=environment["DYNAMODB_STREAM_BATCH_SIZE"],
+                max_batching_window=Duration.seconds(
+                    environment["DYNAMODB_STREAM_MAX_BATCHING_WINDOW_IN_SECONDS"]
+                ),
+                # up to 10 concurrent batches per shard; the records of a key still
+                # go to 1 batch at a time, in stream order
+                parallelization_factor=environment[
+                    "DYNAMODB_STREAM_PARALLELIZATION_FACTOR"
+                ],
+                # the Lambda reports the records from the 1st one that it cannot
+                # encode or write on, so only those are retried
+                report_batch_item_failures=True,
+                # an unexpected error is retried in halves, to isolate a poison record
+                bisect_batch_on_error=True,
+                retry_attempts=environment["DYNAMODB_STREAM_MAX_RETRY_ATTEMPTS"],
+                on_failure=event_sources.SqsDlq(
+                    self.failed_dynamodb_stream_batches_queue
+                ),
             )
         )
+        if set(event_names) != set(DYNAMODB_STREAM_EVENT_NAMES):
+            # `filters` is not in this version of CDK yet; filtered out records never
+            # invoke the Lambda and do not count towards the batch size
+            next(
+                child
+                for child in self.write_dynamodb_stream_to_s3_lambda.node.find_all()
+                if isinstance(child, _lambda.CfnEventSourceMapping)
+            ).add_property_override(
+                "FilterCriteria",
+                {"Filters": [{"Pattern": json.dumps({"eventName": event_names})}]},
+            )
         self.s3_bucket_for_cdc_from_dynamodb_to_redshift.grant_write(
             self.write_dynamodb_stream_to_s3_lambda
         )
+        # lists the attributes that the Redshift loader already knows about
+        self.s3_bucket_for_cdc_from_dynamodb_to_redshift.grant_read(
+            self.write_dynamodb_stream_to_s3_lambda,
+            objects_key_pattern=f"{environment['LOADER_STATE_FOLDER']}/stream_attributes/*",
+        )
+        self.write_dynamodb_stream_to_s3_lambda.add_environment(
+            key="DYNAMODB_STREAM_SINK", value=environment["DYNAMODB_STREAM_SINK"]
+        )
+        if environment["DYNAMODB_STREAM_SINK"] == "firehose":
+            # buffers records across Lambda invocations into fewer, bigger S3 files
+            self.firehose_role = iam.Role(
+                self,
+                "FirehoseRole",
+                assumed_by=iam.ServicePrincipal("firehose.amazonaws.com"),
+            )
+            self.s3_bucket_for_cdc_from_dynamodb_to_redshift.grant_read_write(
+                self.firehose_role
+            )
+            self.firehose_delivery_stream = firehose.CfnDeliveryStream(
+                self,
+                "DynamoDBStreamToS3FirehoseDeliveryStream",
+                delivery_stream_type="DirectPut",
+                extended_s3_destination_configuration=firehose.CfnDeliveryStream.ExtendedS3DestinationConfigurationProperty(
+                    bucket_arn=self.s3_bucket_for_cdc_from_dynamodb_to_redshift.bucket_arn,
+                    role_arn=self.firehose_role.role_arn,
+                    # same partitions as the Lambda's files and sortable by time
+                    prefix=(
+                        f"{environment['UNPROCESSED_DYNAMODB_STREAM_FOLDER']}/"
+                        "dt=!{timestamp:yyyy-MM-dd}/hour=!{timestamp:HH}/"
+                        "!{timestamp:yyyy-MM-dd'T'HH}__firehose__"
+                    ),
+                    error_output_prefix="firehose_errors/!{firehose:error-output-type}/",
+                    buffering_hints=firehose.CfnDeliveryStream.BufferingHintsProperty(
+                        size_in_m_bs=environment["FIREHOSE_BUFFER_SIZE_IN_MB"],
+                        interval_in_seconds=environment[
+                            "FIREHOSE_BUFFER_INTERVAL_IN_SECONDS"
+                        ],
+                    ),
+                    compression_format=FIREHOSE_COMPRESSION_FORMATS[output_format],
+                ),
+            )
+            # not in this version of CDK yet; keeps the loader's hard coded suffixes
+            self.firehose_delivery_stream.add_property_override(
+                "ExtendedS3DestinationConfiguration.FileExtension",
+                {
+                    "json": ".__inserted_or_modified_records.json",
+                    "json_gzip": ".__inserted_or_modified_records.json.gz",
+                }[output_format],
+            )
+            self.firehose_delivery_stream.node.add_dependency(self.firehose_role)
+            self.write_dynamodb_stream_to_s3_lambda.add_environment(
+                key="FIREHOSE_DELIVERY_STREAM_NAME",
+                value=self.firehose_delivery_stream.ref,  # `ref` means name here
+            )
+            self.write_dynamodb_stream_to_s3_lambda.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["firehose:PutRecordBatch"],
+                    resources=[self.firehose_delivery_stream.attr_arn],
+                )
+            )
 
 
 class CDCFromDynamoDBToRedshiftService(Construct):
@@ -371,6 +558,7 @@ class CDCFromDynamoDBToRedshiftService(Construct):
         s3_bucket_for_cdc_from_dynamodb_to_redshift: s3.Bucket,
         redshift_endpoint_address: str,
         redshift_role_arn: str,
+        shared_lambda_layer: _lambda.LayerVersion,
     ) -> None:
         super().__init__(scope, construct_id)  # required
         self.lambda_redshift_full_access_role = iam.Role(
@@ -386,6 +574,12 @@ class CDCFromDynamoDBToRedshiftService(Construct):
                 ),  ### later principle of least privileges
             ],
         )
+        load_s3_files_to_redshift_lambda_sizing = get_lambda_sizing(
+            profile=environment["LAMBDA_PERFORMANCE_PROFILES"][
+                "LOAD_S3_FILES_TO_REDSHIFT"
+            ],
+            default_timeout_in_seconds=20,  # may take some time if many files
+        )
         self.load_s3_files_from_dynamodb_stream_to_redshift_lambda = _lambda.Function(
             self,
             "LoadS3FilesFromDynamoDBStreamToRedshiftLambda",
@@ -395,8 +589,16 @@ class CDCFromDynamoDBToRedshiftService(Construct):
                 exclude=[".venv/*"],
             ),
             handler="handler.lambda_handler",
-            timeout=Duration.seconds(20),  # may take some time if many files
-            memory_size=128,  # in MB
+            timeout=Duration.seconds(
+                load_s3_files_to_redshift_lambda_sizing["timeout_in_seconds"]
+            ),
+            memory_size=load_s3_files_to_redshift_lambda_sizing["memory_size"],  # in MB
+            # with 1, the SQS trigger and the schedule never run loaders side by side;
+            # otherwise concurrent loaders split the partitions with leases
+            # CDK drops `null` context values, so an unreserved loader has no key
+            reserved_concurrent_executions=environment.get(
+                "LOADER_RESERVED_CONCURRENCY"
+            ),
             environment={
                 "REDSHIFT_USER": environment["REDSHIFT_USER"],
                 "REDSHIFT_DATABASE_NAME": environment["REDSHIFT_DATABASE_NAME"],
@@ -415,8 +617,28 @@ class CDCFromDynamoDBToRedshiftService(Construct):
                 "PROCESSED_DYNAMODB_STREAM_FOLDER": environment[
                     "PROCESSED_DYNAMODB_STREAM_FOLDER"
                 ],
+                "USE_MANIFEST_COPY": json.dumps(environment["USE_MANIFEST_COPY"]),
+                "REDSHIFT_LOAD_MODE": environment["REDSHIFT_LOAD_MODE"],
+                "LOADER_STATE_FOLDER": environment["LOADER_STATE_FOLDER"],
+                "DYNAMODB_STREAM_ATTRIBUTES_FOLDER": (
+                    f"{environment['LOADER_STATE_FOLDER']}/stream_attributes"
+                ),
+                "S3_PROMOTION_MAX_WORKERS": str(
+                    environment["S3_PROMOTION_MAX_WORKERS"]
+                ),
+                "MAX_FILES_PER_RUN": str(environment["MAX_FILES_PER_RUN"]),
+                "LISTING_LOOKBACK_IN_MINUTES": str(
+                    environment["LISTING_LOOKBACK_IN_MINUTES"]
+                ),
+                "FULL_LISTING_INTERVAL_IN_MINUTES": str(
+                    environment["FULL_LISTING_INTERVAL_IN_MINUTES"]
+                ),
+                "LOAD_PARTITIONS_CONCURRENTLY": json.dumps(
+                    environment["LOAD_PARTITIONS_CONCURRENTLY"]
+                ),
             },
             role=self.lambda_redshift_full_access_role,
+            layers=[shared_lambda_layer],
         )
 
         # connect the AWS resources
@@ -432,6 +654,206 @@ class CDCFromDynamoDBToRedshiftService(Construct):
         s3_bucket_for_cdc_from_dynamodb_to_redshift.grant_read_write(
             self.load_s3_files_from_dynamodb_stream_to_redshift_lambda
         )
+        if environment.get("LOADER_RESERVED_CONCURRENCY") != 1:
+            if environment["REDSHIFT_LOAD_MODE"] != "append":
+                # upserts of concurrent loaders would race on the same `id`s
+                raise ValueError(
+                    "`LOADER_RESERVED_CONCURRENCY` other than 1 needs `REDSHIFT_LOAD_MODE` "
+                    f'to be "append", not "{environment["REDSHIFT_LOAD_MODE"]}"'
+                )
+            self.loader_lease_table = dynamodb.Table(
+                self,
+                "LoaderLeaseTable",
+                partition_key=dynamodb.Attribute(
+                    name="partition", type=dynamodb.AttributeType.STRING
+                ),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                time_to_live_attribute="expires_at",  # clean up leases of crashed loaders
+                removal_policy=RemovalPolicy.DESTROY,
+            )
+            self.load_s3_files_from_dynamodb_stream_to_redshift_lambda.add_environment(
+                key="LOADER_LEASE_TABLE_NAME", value=self.loader_lease_table.table_name
+            )
+            self.loader_lease_table.grant_read_write_data(
+                self.load_s3_files_from_dynamodb_stream_to_redshift_lambda
+            )
+        if environment["LOADER_TRIGGER"] == "sqs":
+            # load new stream files within seconds instead of on the next scheduled
+            # run; the schedule in CDCStack stays as a backstop
+            self.pending_dynamodb_stream_files_dead_letter_queue = sqs.Queue(
+                self,
+                "PendingDynamoDBStreamFilesDeadLetterQueue",
+                retention_period=Duration.days(14),
+            )
+            self.pending_dynamodb_stream_files_queue = sqs.Queue(
+                self,
+                "PendingDynamoDBStreamFilesQueue",
+                # AWS recommends 6x the Lambda timeout for SQS event sources
+                visibility_timeout=Duration.seconds(
+                    self.load_s3_files_from_dynamodb_stream_to_redshift_lambda.timeout.to_seconds()
+                    * 6
+                ),
+                dead_letter_queue=sqs.DeadLetterQueue(
+                    # throttled receives (only 1 loader at a time) count too
+                    max_receive_count=10,
+                    queue=self.pending_dynamodb_stream_files_dead_letter_queue,
+                ),
+            )
+            s3_bucket_for_cdc_from_dynamodb_to_redshift.add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                s3n.SqsDestination(self.pending_dynamodb_stream_files_queue),
+                s3.NotificationKeyFilter(
+                    prefix=f"{environment['UNPROCESSED_DYNAMODB_STREAM_FOLDER']}/"
+                ),
+            )
+            self.load_s3_files_from_dynamodb_stream_to_redshift_lambda.add_event_source(
+                event_sources.SqsEventSource(
+                    self.pending_dynamodb_stream_files_queue,
+                    # invoked once either threshold is reached
+                    batch_size=environment["LOADER_SQS_BATCH_SIZE"],
+                    max_batching_window=Duration.seconds(
+                        environment["LOADER_SQS_MAX_BATCHING_WINDOW_IN_SECONDS"]
+                    ),
+                )
+            )
+        elif environment["LOADER_TRIGGER"] != "schedule":
+            raise ValueError(
+                '`LOADER_TRIGGER` should be "sqs" or "schedule", '
+                f'not "{environment["LOADER_TRIGGER"]}"'
+            )
+
+
+class CDCReconciliationService(Construct):
+    """Compares RDS and DynamoDB with their Redshift replicas and publishes the
+    mismatches and the replication lag as metrics"""
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        environment: dict,
+        rds_endpoint_address: str,
+        redshift_endpoint_address: str,
+        dynamodb_table: dynamodb.Table,
+        s3_bucket_for_cdc_from_dynamodb_to_redshift: s3.Bucket,
+        shared_lambda_layer: _lambda.LayerVersion,
+    ) -> None:
+        super().__init__(scope, construct_id)  # required
+        # DMS replicates the heartbeat table, which is how the lag is measured
+        if environment["RECONCILIATION_HEARTBEAT_TABLE_NAME"] not in [
+            table["table_name"] for table in environment["DMS_TABLES"]
+        ]:
+            raise ValueError(
+                "`RECONCILIATION_HEARTBEAT_TABLE_NAME` should be 1 of the `DMS_TABLES`, "
+                f'not "{environment["RECONCILIATION_HEARTBEAT_TABLE_NAME"]}"'
+            )
+        if (
+            environment["RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN"]
+            > environment["RECONCILIATION_DYNAMODB_SCAN_SEGMENTS"]
+        ):
+            raise ValueError(
+                "`RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN` should be at most "
+                "`RECONCILIATION_DYNAMODB_SCAN_SEGMENTS`, "
+                f'not "{environment["RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN"]}"'
+            )
+        reconcile_cdc_lambda_sizing = get_lambda_sizing(
+            profile=environment["LAMBDA_PERFORMANCE_PROFILES"]["RECONCILE_CDC"],
+            default_timeout_in_seconds=60,  # checksums and samples both pipelines
+        )
+        self.reconcile_cdc_lambda = _lambda.Function(
+            self,
+            "ReconcileCDCLambda",
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            code=_lambda.Code.from_asset(
+                "source/reconcile_cdc_lambda",
+                # exclude=[".venv/*"],  # seems to no longer do anything if use BundlingOptions
+                bundling=BundlingOptions(
+                    image=_lambda.Runtime.PYTHON_3_9.bundling_image,
+                    command=[
+                        "bash",
+                        "-c",
+                        " && ".join(
+                            [
+                                "pip install -r requirements.txt -t /asset-output",
+                                "cp *.py /asset-output",  # need to cp instead of mv
+                            ]
+                        ),
+                    ],
+                ),
+            ),
+            handler="handler.lambda_handler",
+            timeout=Duration.seconds(reconcile_cdc_lambda_sizing["timeout_in_seconds"]),
+            memory_size=reconcile_cdc_lambda_sizing["memory_size"],  # in MB
+            environment={
+                "RECONCILIATION_NUM_BUCKETS": str(
+                    environment["RECONCILIATION_NUM_BUCKETS"]
+                ),
+                # no key for `null` (all rows in 1 bucket), as CDK drops null context values
+                "RECONCILIATION_RDS_BUCKET_COLUMN": environment.get(
+                    "RECONCILIATION_RDS_BUCKET_COLUMN"
+                )
+                or "",
+                "RECONCILIATION_HEARTBEAT_TABLE_NAME": environment[
+                    "RECONCILIATION_HEARTBEAT_TABLE_NAME"
+                ],
+                "RECONCILIATION_SAMPLE_BUCKETS_PER_RUN": str(
+                    environment["RECONCILIATION_SAMPLE_BUCKETS_PER_RUN"]
+                ),
+                "RECONCILIATION_DYNAMODB_SCAN_SEGMENTS": str(
+                    environment["RECONCILIATION_DYNAMODB_SCAN_SEGMENTS"]
+                ),
+                "RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN": str(
+                    environment["RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN"]
+                ),
+                "RECONCILIATION_LOOKBACK_IN_MINUTES": str(
+                    environment["RECONCILIATION_LOOKBACK_IN_MINUTES"]
+                ),
+                "RECONCILIATION_STATE_FOLDER": environment[
+                    "RECONCILIATION_STATE_FOLDER"
+                ],
+                "RDS_HOST": rds_endpoint_address,
+                "RDS_USER": environment["RDS_USER"],
+                "RDS_PASSWORD": environment["RDS_PASSWORD"],
+                "RDS_DATABASE_NAME": environment["RDS_DATABASE_NAME"],
+                "RDS_TABLE_NAME": environment["RDS_TABLE_NAME"],
+                "DYNAMODB_TABLE_NAME": dynamodb_table.table_name,
+                "S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT": s3_bucket_for_cdc_from_dynamodb_to_redshift.bucket_name,
+                "UNPROCESSED_DYNAMODB_STREAM_FOLDER": environment[
+                    "UNPROCESSED_DYNAMODB_STREAM_FOLDER"
+                ],
+                "REDSHIFT_ENDPOINT_ADDRESS": redshift_endpoint_address,
+                "REDSHIFT_USER": environment["REDSHIFT_USER"],
+                "REDSHIFT_DATABASE_NAME": environment["REDSHIFT_DATABASE_NAME"],
+                "REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC": environment[
+                    "REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC"
+                ],
+                "REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC": environment[
+                    "REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC"
+                ],
+            },
+            layers=[shared_lambda_layer],
+        )
+        self.reconcile_cdc_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "redshift-data:ExecuteStatement",
+                    "redshift-data:BatchExecuteStatement",
+                    "redshift-data:DescribeStatement",
+                    "redshift-data:GetStatementResult",
+                    "redshift:GetClusterCredentials",
+                ],
+                resources=["*"],
+            )
+        )
+        dynamodb_table.grant_read_data(self.reconcile_cdc_lambda)
+        s3_bucket_for_cdc_from_dynamodb_to_redshift.grant_read(
+            self.reconcile_cdc_lambda
+        )
+        # the saved checksums and watermarks
+        s3_bucket_for_cdc_from_dynamodb_to_redshift.grant_read_write(
+            self.reconcile_cdc_lambda,
+            objects_key_pattern=f"{environment['RECONCILIATION_STATE_FOLDER']}/*",
+        )
 
 
 class CDCStack(Stack):
@@ -455,6 +877,15 @@ class CDCStack(Stack):
             connection=ec2.Port.tcp(environment["REDSHIFT_PORT"]),
         )
 
+        self.shared_lambda_layer = _lambda.LayerVersion(
+            self,
+            "SharedLambdaLayer",
+            code=_lambda.Code.from_asset(
+                "source/shared_lambda_layer",  # modules must be in `python/` folder
+                exclude=[".venv/*", "pyproject.toml"],
+            ),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_9],
+        )
         self.redshift_service = RedshiftService(
             self,
             "RedshiftService",
@@ -467,6 +898,7 @@ class CDCStack(Stack):
             environment=environment,
             vpc=self.default_vpc,
             security_group=self.security_group_for_rds_redshift_dms,
+            shared_lambda_layer=self.shared_lambda_layer,
         )
         self.cdc_from_rds_to_redshift_service = CDCFromRDSToRedshiftService(
             self,
@@ -475,9 +907,13 @@ class CDCStack(Stack):
             rds_endpoint_address=self.rds_service.rds_instance.db_instance_endpoint_address,
             redshift_endpoint_address=self.redshift_service.redshift_cluster.attr_endpoint_address,
             security_group_id=self.security_group_for_rds_redshift_dms.security_group_id,
+            shared_lambda_layer=self.shared_lambda_layer,
         )
         self.dynamodb_service = DynamoDBService(
-            self, "DynamoDBService", environment=environment
+            self,
+            "DynamoDBService",
+            environment=environment,
+            shared_lambda_layer=self.shared_lambda_layer,
         )
         self.cdc_from_dynamodb_to_redshift_service = CDCFromDynamoDBToRedshiftService(
             self,
@@ -486,23 +922,45 @@ class CDCStack(Stack):
             s3_bucket_for_cdc_from_dynamodb_to_redshift=self.dynamodb_service.s3_bucket_for_cdc_from_dynamodb_to_redshift,
             redshift_endpoint_address=self.redshift_service.redshift_cluster.attr_endpoint_address,
             redshift_role_arn=self.redshift_service.redshift_full_commands_full_access_role.role_arn,
+            shared_lambda_layer=self.shared_lambda_layer,
         )
 
-        # schedule Lambdas to run
-        self.scheduled_eventbridge_event = events.Rule(
-            self,
-            "RunEvery5Minutes",
-            event_bus=None,  # scheduled events must be on "default" bus
-            schedule=events.Schedule.rate(Duration.minutes(5)),
-        )
-        lambda_functions = [
-            self.rds_service.load_data_to_rds_lambda,
-            self.cdc_from_rds_to_redshift_service.start_dms_replication_task_lambda,
-            self.dynamodb_service.load_data_to_dynamodb_lambda,
-            self.cdc_from_dynamodb_to_redshift_service.load_s3_files_from_dynamodb_stream_to_redshift_lambda,
-        ]
-        for lambda_function in lambda_functions:
-            self.scheduled_eventbridge_event.add_target(
+        # schedule Lambdas to run, each pipeline on its own rule
+        lambda_functions = {  # keys of `SCHEDULE_RATES_IN_MINUTES` in `cdk.json`
+            "LOAD_DATA_TO_RDS": self.rds_service.load_data_to_rds_lambda,
+            "START_DMS_REPLICATION_TASK": self.cdc_from_rds_to_redshift_service.start_dms_replication_task_lambda,
+            "LOAD_DATA_TO_DYNAMODB": self.dynamodb_service.load_data_to_dynamodb_lambda,
+            "LOAD_S3_FILES_TO_REDSHIFT": self.cdc_from_dynamodb_to_redshift_service.load_s3_files_from_dynamodb_stream_to_redshift_lambda,
+        }
+        if environment["RUN_CDC_RECONCILIATION"]:
+            self.cdc_reconciliation_service = CDCReconciliationService(
+                self,
+                "CDCReconciliationService",
+                environment=environment,
+                rds_endpoint_address=self.rds_service.rds_instance.db_instance_endpoint_address,
+                redshift_endpoint_address=self.redshift_service.redshift_cluster.attr_endpoint_address,
+                dynamodb_table=self.dynamodb_service.dynamodb_table,
+                s3_bucket_for_cdc_from_dynamodb_to_redshift=self.dynamodb_service.s3_bucket_for_cdc_from_dynamodb_to_redshift,
+                shared_lambda_layer=self.shared_lambda_layer,
+            )
+            lambda_functions["RECONCILE_CDC"] = (
+                self.cdc_reconciliation_service.reconcile_cdc_lambda
+            )
+        self.scheduled_eventbridge_events = {}
+        for name, lambda_function in lambda_functions.items():
+            # `null` (which CDK drops from the context) or missing
+            rate_in_minutes = environment["SCHEDULE_RATES_IN_MINUTES"].get(name)
+            if rate_in_minutes is None:  # not scheduled
+                continue
+            self.scheduled_eventbridge_events[name] = events.Rule(
+                self,
+                "Run{}OnSchedule".format(
+                    "".join(word.capitalize() for word in name.split("_"))
+                ),
+                event_bus=None,  # scheduled events must be on "default" bus
+                schedule=events.Schedule.rate(Duration.minutes(rate_in_minutes)),
+            )
+            self.scheduled_eventbridge_events[name].add_target(
                 target=events_targets.LambdaFunction(
                     handler=lambda_function,
                     retry_attempts=3,
@@ -510,6 +968,23 @@ class CDCStack(Stack):
                 ),
             )
 
+        # every Lambda emits its metrics in CloudWatch Embedded Metric Format
+        if environment["METRICS_SINK"] not in ["emf", "none"]:
+            raise ValueError(
+                '`METRICS_SINK` should be "emf" or "none", '
+                f'not "{environment["METRICS_SINK"]}"'
+            )
+        for lambda_function in [
+            *lambda_functions.values(),
+            self.dynamodb_service.write_dynamodb_stream_to_s3_lambda,
+        ]:
+            lambda_function.add_environment(
+                key="METRICS_SINK", value=environment["METRICS_SINK"]
+            )
+            lambda_function.add_environment(
+                key="METRICS_NAMESPACE", value=environment["METRICS_NAMESPACE"]
+            )
+
         # write Cloudformation Outputs
         self.output_redshift_endpoint_address = CfnOutput(
             self,
@@ -0,0 +1,84 @@
+"""Generate the JSON of DMS replication tasks from the `cdk.json` config"""
+
+from typing import List
+
+
+def get_table_mappings(tables: List[dict]) -> dict:
+    """1 selection rule per table, plus a table-settings rule for the tables with
+    `parallel_load`, e.g. {"type": "partitions-auto"} or {"type": "ranges", ...}"""
+    rules = []
+    for table in tables:
+        object_locator = {
+            "schema-name": table.get("schema_name", "%"),
+            "table-name": table["table_name"],
+        }
+        rules.append(
+            {
+                "rule-type": "selection",
+                "rule-id": str(len(rules) + 1),
+                "rule-name": str(len(rules) + 1),
+                "object-locator": object_locator,
+                "rule-action": "include",
+                "filters": [],
+            }
+        )
+        if table.get("parallel_load"):
+            rules.append(
+                {
+                    "rule-type": "table-settings",
+                    "rule-id": str(len(rules) + 1),
+                    "rule-name": str(len(rules) + 1),
+                    "object-locator": object_locator,
+                    "parallel-load": table["parallel_load"],
+                }
+            )
+    return {"rules": rules}
+
+
+def get_replication_task_settings(tuning: dict) -> dict:
+    """Task settings tuned for throughput to Redshift. Settings that are left out
+    keep the DMS defaults."""
+    lob_mode = tuning.get("LobMode", "limited")
+    if lob_mode not in ["none", "limited", "full"]:
+        raise ValueError(
+            f'`LobMode` should be "none", "limited" or "full", not "{lob_mode}"'
+        )
+    return {
+        "Logging": {"EnableLogging": True},
+        "FullLoadSettings": {
+            # number of tables loaded in parallel during full load
+            "MaxFullLoadSubTasks": tuning.get("MaxFullLoadSubTasks", 8),
+            # max number of rows transferred together during full load
+            "CommitRate": tuning.get("CommitRate", 10000),
+        },
+        "TargetMetadata": {
+            "SupportLobs": lob_mode != "none",
+            "FullLobMode": lob_mode == "full",
+            "LimitedSizeLobMode": lob_mode == "limited",
+            "LobMaxSize": tuning.get("LobMaxSizeInKB", 32),
+            # apply CDC changes to Redshift in batches instead of 1 row at a time
+            "BatchApplyEnabled": tuning.get("BatchApplyEnabled", True),
+            "ParallelApplyThreads": tuning.get("ParallelApplyThreads", 0),
+        },
+        "ChangeProcessingTuning": {
+            "BatchApplyTimeoutMin": tuning.get("BatchApplyTimeoutMin", 1),
+            "BatchApplyTimeoutMax": tuning.get("BatchApplyTimeoutMax", 30),
+            "BatchApplyMemoryLimit": tuning.get("BatchApplyMemoryLimit", 500),
+            "CommitTimeout": tuning.get("CommitTimeout", 1),
+        },
+    }
+
+
+def shard_tables(tables: List[dict], num_replication_tasks: int) -> List[List[dict]]:
+    """Spread the tables over the replication tasks: a table goes to its
+    `replication_task` index if set, otherwise round robin"""
+    shards = [[] for _ in range(num_replication_tasks)]
+    for i, table in enumerate(tables):
+        replication_task = table.get("replication_task", i % num_replication_tasks)
+        if not 0 <= replication_task < num_replication_tasks:
+            raise ValueError(
+                f'Table {table["table_name"]} has `replication_task` {replication_task}, '
+                f"but there are only {num_replication_tasks} replication tasks"
+            )
+        shards[replication_task].append(table)
+    return [shard for shard in shards if shard]
@@ -0,0 +1,37 @@
+"""Memory size (and thus CPU share) and timeout of the Lambdas from the `cdk.json`
+config. Lambda allocates CPU in proportion to memory, so CPU-bound handlers such as
+JSON decoding and CSV parsing run faster with more memory. Measure with
+`benchmarks/benchmark_lambda_handlers.py` before changing a profile.
+"""
+
+from typing import Union
+
+# memory size in MB per named profile
+LAMBDA_PERFORMANCE_PROFILES = {
+    "small": 128,
+    "medium": 512,
+    "large": 1769,  # 1 full vCPU
+}
+
+
+def get_lambda_sizing(
+    profile: Union[str, dict], default_timeout_in_seconds: int
+) -> dict:
+    """`profile` is a named profile, which keeps the Lambda's default timeout, or
+    explicit values, e.g. {"memory_size": 1024, "timeout_in_seconds": 30}"""
+    if isinstance(profile, str):
+        if profile not in LAMBDA_PERFORMANCE_PROFILES:
+            raise ValueError(
+                f"Lambda performance profile should be one of "
+                f'{list(LAMBDA_PERFORMANCE_PROFILES)} or explicit values, not "{profile}"'
+            )
+        return {
+            "memory_size": LAMBDA_PERFORMANCE_PROFILES[profile],
+            "timeout_in_seconds": default_timeout_in_seconds,
+        }
+    return {
+        "memory_size": profile.get("memory_size", LAMBDA_PERFORMANCE_PROFILES["small"]),
+        "timeout_in_seconds": profile.get(
+            "timeout_in_seconds", default_timeout_in_seconds
+        ),
+    }
@@ -1,16 +1,49 @@
 import json
 import os
-from decimal import Decimal
+import time
 
 import boto3
+from botocore.config import Config
+from json_items import iter_json_items
+from lambda_metrics import metrics  # from shared Lambda layer
+from parallel_batch_writer import AdaptiveTokenBucket, ParallelBatchWriter
 
-table = boto3.resource("dynamodb").Table(os.environ["DYNAMODB_TABLE_NAME"])
+DYNAMODB_LOAD_MAX_WORKERS = int(os.environ["DYNAMODB_LOAD_MAX_WORKERS"])
+# null for an on-demand table: no limit until DynamoDB throttles
+DYNAMODB_LOAD_MAX_WRITE_UNITS_PER_SECOND = json.loads(
+    os.environ["DYNAMODB_LOAD_MAX_WRITE_UNITS_PER_SECOND"]
+)
+# 1 pooled connection per worker
+dynamodb_client = boto3.client(
+    "dynamodb", config=Config(max_pool_connections=DYNAMODB_LOAD_MAX_WORKERS)
+)
+metrics.count_requests(dynamodb_client, name="DynamoDBRequests")
+DYNAMODB_TABLE_NAME = os.environ["DYNAMODB_TABLE_NAME"]
 JSON_FILENAME = os.environ["JSON_FILENAME"]
 
 
+@metrics.instrument
 def lambda_handler(event, context):
-    with table.batch_writer() as writer, open(JSON_FILENAME) as f:
-        trades = json.load(f, parse_float=Decimal)["data"]
-        for trade in trades:
-            writer.put_item(Item=trade)
+    parallel_batch_writer = ParallelBatchWriter(
+        dynamodb_client=dynamodb_client,
+        table_name=DYNAMODB_TABLE_NAME,
+        # per invocation, so the rate learnt from throttles starts over
+        token_bucket=AdaptiveTokenBucket(
+            rate_per_second=DYNAMODB_LOAD_MAX_WRITE_UNITS_PER_SECOND
+        ),
+        max_workers=DYNAMODB_LOAD_MAX_WORKERS,
+    )
+    start_time = time.perf_counter()
+    with metrics.timer("BatchWrite"), open(JSON_FILENAME) as f:  # read as it is written
+        num_items = parallel_batch_writer.write(
+            iter_json_items(f, filename=JSON_FILENAME)
+        )
+    seconds = time.perf_counter() - start_time
+    metrics.add("RecordsIn", num_items)  # every item read is written or raises
+    metrics.add("RecordsOut", num_items)
+    metrics.add("RecordsPerSecond", num_items / seconds, unit="Count/Second")
+    print(
+        f"Wrote {num_items} items to DynamoDB table {DYNAMODB_TABLE_NAME} in "
+        f"{seconds:.2f} seconds ({num_items / seconds:.0f} items/second)."
+    )
     return
@@ -0,0 +1,56 @@
+"""Read the items of a JSON file one at a time, so memory stays flat however big the
+file is: either the `{"data": [...]}` document of `trades.json` or JSON Lines (1 item
+per line, any file ending in `.jsonl`). Floats are parsed as `Decimal`, which is what
+DynamoDB takes for numbers.
+"""
+
+import json
+import re
+from decimal import Decimal
+from typing import IO, Iterator
+
+SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_json_lines(f: IO[str]) -> Iterator[dict]:
+    for line in f:
+        if line.strip():
+            yield json.loads(line, parse_float=Decimal)
+
+
+def iter_json_array_items(
+    f: IO[str], array_key: str = "data", chunk_size: int = 64 * 1024
+) -> Iterator[dict]:
+    """Items of the 1st array under `array_key`. Only the item being parsed and the
+    rest of the current chunk are kept in memory."""
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    array_start = re.compile(r'"{}"\s*:\s*\['.format(re.escape(array_key)))
+    buffer = f.read(chunk_size)
+    while True:
+        match = array_start.search(buffer)
+        if match:
+            break
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError(f'No "{array_key}" array in the JSON document')
+        buffer += chunk
+    position = match.end()
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:  # the item goes on in the next chunk
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item
+
+
+def iter_json_items(f: IO[str], filename: str) -> Iterator[dict]:
+    if filename.endswith(".jsonl"):
+        return iter_json_lines(f)
+    return iter_json_array_items(f)
@@ -0,0 +1,210 @@
+"""Write items to DynamoDB with concurrent `BatchWriteItem` calls.
+
+The items are cut into batches of 25 (the API limit) as they are read, and at most
+2 batches per worker are in flight, so a big file is never held in memory. Every
+batch first takes its write capacity units from a shared token bucket; unprocessed
+items are resent with exponential backoff. A throttle (unprocessed items or a
+throughput exception) halves the bucket's rate, which then grows back while batches
+succeed, so the workers settle around what the table accepts instead of hammering it.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, List, Optional
+
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+from lambda_metrics import metrics  # from shared Lambda layer
+
+MAX_ITEMS_PER_BATCH_WRITE_ITEM = 25  # hard limit of the DynamoDB API
+THROTTLING_ERROR_CODES = [
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+]
+
+
+class AdaptiveTokenBucket:
+    """Write capacity units per second, with up to 1 second of them as burst.
+    With `rate_per_second=None` (e.g. an on-demand table), nothing waits until the
+    1st throttle, which sets the rate to half of the throughput until then."""
+
+    def __init__(
+        self,
+        rate_per_second: Optional[float],
+        min_rate_per_second: float = 1,
+        increase_per_second: float = 0.5,
+    ) -> None:
+        self.max_rate_per_second = rate_per_second
+        self.rate_per_second = rate_per_second
+        self.min_rate_per_second = min_rate_per_second
+        self.increase_per_second = increase_per_second
+        self.tokens = rate_per_second or 0
+        self.consumed_units = 0
+        self.started_at = self.updated_at = self.increased_at = time.monotonic()
+        self.decreased_at = None
+        self.lock = threading.Lock()  # shared by all the workers
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate_per_second is not None:
+            self.tokens = min(
+                self.rate_per_second,
+                self.tokens + (now - self.updated_at) * self.rate_per_second,
+            )
+        self.updated_at = now
+
+    def acquire(self, units: float) -> None:
+        while True:
+            with self.lock:
+                self._refill()
+                # a batch bigger than the burst goes into debt instead of waiting forever
+                if self.rate_per_second is None or self.tokens >= min(
+                    units, self.rate_per_second
+                ):
+                    self.tokens -= units
+                    self.consumed_units += units
+                    return
+                seconds_to_wait = (
+                    min(units, self.rate_per_second) - self.tokens
+                ) / self.rate_per_second
+            time.sleep(seconds_to_wait)
+
+    def adjust(self, units: float) -> None:
+        """Correct an estimate with the units DynamoDB actually consumed"""
+        with self.lock:
+            self.tokens -= units
+            self.consumed_units += units
+
+    def on_throttle(self) -> None:
+        """Halves the rate at most once per second, as the batches of all workers
+        that were in flight get throttled together"""
+        with self.lock:
+            now = time.monotonic()
+            if self.decreased_at is not None and now - self.decreased_at < 1:
+                return
+            self.decreased_at = self.increased_at = now
+            if self.rate_per_second is None:
+                # over at least 100 ms, as a throttle can come with the 1st batches
+                self.rate_per_second = self.consumed_units / max(
+                    now - self.started_at, 0.1
+                )
+            self.rate_per_second = max(
+                self.rate_per_second / 2, self.min_rate_per_second
+            )
+            self.tokens = min(self.tokens, 0)
+
+    def on_success(self) -> None:
+        """Grows the rate by `increase_per_second` of itself per second, so it is
+        back where it was about 2 seconds after a throttle"""
+        with self.lock:
+            now = time.monotonic()
+            seconds, self.increased_at = now - self.increased_at, now
+            if self.rate_per_second is None:
+                return
+            self.rate_per_second *= 1 + self.increase_per_second * min(seconds, 1)
+            if self.max_rate_per_second is not None:
+                self.rate_per_second = min(
+                    self.rate_per_second, self.max_rate_per_second
+                )
+
+
+class ParallelBatchWriter:
+    MAX_RETRIES = 8
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name: str,
+        token_bucket: AdaptiveTokenBucket,
+        max_workers: int = 8,
+    ) -> None:
+        self.dynamodb_client = dynamodb_client  # thread safe, unlike a boto3 resource
+        self.table_name = table_name
+        self.token_bucket = token_bucket
+        self.max_workers = max_workers
+        self.type_serializer = TypeSerializer()
+
+    def write(self, items: Iterable[dict]) -> int:
+        """Returns the number of items written"""
+        num_items = 0
+        futures = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as thread_pool:
+            try:
+                batch = []
+                for item in items:
+                    batch.append(item)
+                    if len(batch) == MAX_ITEMS_PER_BATCH_WRITE_ITEM:
+                        futures = self._wait_for_room(futures)
+                        futures.add(thread_pool.submit(self._write_batch, batch))
+                        num_items += len(batch)
+                        batch = []
+                if batch:
+                    futures.add(thread_pool.submit(self._write_batch, batch))
+                    num_items += len(batch)
+                for future in futures:
+                    future.result()  # re-raise
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        return num_items
+
+    def _wait_for_room(self, futures: set) -> set:
+        """Blocks the reader while 2 batches per worker are in flight"""
+        while len(futures) >= 2 * self.max_workers:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()  # re-raise
+        return futures
+
+    def _write_batch(self, items: List[dict]) -> None:
+        write_requests = [
+            {
+                "PutRequest": {
+                    "Item": {
+                        key: self.type_serializer.serialize(value)
+                        for key, value in item.items()
+                    }
+                }
+            }
+            for item in items
+        ]
+        for attempt in range(self.MAX_RETRIES + 1):
+            # 1 unit per item of up to 1 KB, corrected below with the consumed units
+            self.token_bucket.acquire(len(write_requests))
+            try:
+                response = self.dynamodb_client.batch_write_item(
+                    RequestItems={self.table_name: write_requests},
+                    ReturnConsumedCapacity="TOTAL",
+                )
+            except ClientError as error:
+                if error.response["Error"]["Code"] not in THROTTLING_ERROR_CODES:
+                    raise
+                metrics.add("ThrottledRequests")
+                self.token_bucket.on_throttle()
+            else:
+                if "ConsumedCapacity" in response:
+                    consumed_units = sum(
+                        consumed_capacity["CapacityUnits"]
+                        for consumed_capacity in response["ConsumedCapacity"]
+                    )
+                    metrics.add("WriteCapacityUnits", consumed_units)
+                    # unprocessed items take their units again when they are resent
+                    self.token_bucket.adjust(consumed_units - len(write_requests))
+                write_requests = response.get("UnprocessedItems", {}).get(
+                    self.table_name, []
+                )
+                if not write_requests:
+                    self.token_bucket.on_success()
+                    return
+                metrics.add("UnprocessedItemsRetried", len(write_requests))
+                self.token_bucket.on_throttle()
+            # full jitter, so the workers do not retry in lockstep
+            time.sleep(random.uniform(0, min(0.05 * 2**attempt, 5)))
+        raise RuntimeError(
+            f"{len(write_requests)} items were not written to DynamoDB table "
+            f"{self.table_name} after {self.MAX_RETRIES} retries"
+        )
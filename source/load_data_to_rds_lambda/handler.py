@@ -1,7 +1,19 @@
 import csv
+import itertools
+import json
 import os
+import re
+from typing import Iterator, List
 
 import pymysql
+from lambda_metrics import metrics  # from shared Lambda layer
+from mysql_connection_manager import MySQLConnectionManager  # from shared Lambda layer
+from schema_inference import (
+    InferredColumn,
+    get_create_table_sql_statement,
+    get_row_converter,
+    infer_columns,
+)
 
 RDS_HOST = os.environ["RDS_HOST"]
 RDS_USER = os.environ["RDS_USER"]
@@ -9,41 +21,152 @@ RDS_PASSWORD = os.environ["RDS_PASSWORD"]
 RDS_DATABASE_NAME = os.environ["RDS_DATABASE_NAME"]
 RDS_TABLE_NAME = os.environ["RDS_TABLE_NAME"]
 CSV_FILENAME = os.environ["CSV_FILENAME"]
+RDS_LOAD_MODE = os.environ["RDS_LOAD_MODE"]
+if RDS_LOAD_MODE not in ["load_data_local_infile", "chunked_insert"]:
+    raise ValueError(
+        '`RDS_LOAD_MODE` should be "load_data_local_infile" or "chunked_insert", '
+        f'not "{RDS_LOAD_MODE}"'
+    )
+RDS_LOAD_BATCH_SIZE = int(os.environ["RDS_LOAD_BATCH_SIZE"])
+RDS_INFER_COLUMN_TYPES = json.loads(os.environ["RDS_INFER_COLUMN_TYPES"])
+RDS_SCHEMA_SAMPLE_SIZE = int(os.environ["RDS_SCHEMA_SAMPLE_SIZE"])
+# module level, so the connection is reused across warm invocations
+mysql_connection_manager = MySQLConnectionManager(
+    host=RDS_HOST,
+    user=RDS_USER,
+    passwd=RDS_PASSWORD,
+    db=RDS_DATABASE_NAME,
+    connect_timeout=5,
+    local_infile=RDS_LOAD_MODE == "load_data_local_infile",
+)
+# MySQL 5.7 and 8.0 error codes when LOAD DATA LOCAL INFILE is disabled on the server
+# (the client side is enabled above, and pymysql never raises libmysqlclient's 2068)
+LOCAL_INFILE_DISABLED_ERROR_CODES = [1148, 3948]
+LOAD_DATA_RECORDS_PATTERN = re.compile(rb"Records: (\d+)")
 
 
-def lambda_handler(event, context):
-    conn = pymysql.connect(
-        host=RDS_HOST,
-        user=RDS_USER,
-        passwd=RDS_PASSWORD,
-        db=RDS_DATABASE_NAME,
-        connect_timeout=5,
+def read_csv_in_chunks(csv_reader, batch_size: int) -> Iterator[List[tuple]]:
+    """Only `batch_size` rows are in memory at a time, however big the file is"""
+    while True:
+        chunk = [tuple(row) for row in itertools.islice(csv_reader, batch_size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_data_local_infile(cursor, columns: List[InferredColumn]) -> None:
+    """MySQL parses the CSV itself and pymysql streams the file in small packets.
+    Each CSV value goes through a user variable so that MySQL normalizes it into
+    the inferred column type."""
+    num_rows = cursor.execute(
+        """
+        LOAD DATA LOCAL INFILE '{csv_filename}'
+        INTO TABLE {rds_table_name}
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+        LINES TERMINATED BY '\\n'
+        IGNORE 1 LINES
+        ({column_variables})
+        SET {column_expressions};""".format(
+            csv_filename=CSV_FILENAME,
+            rds_table_name=RDS_TABLE_NAME,
+            column_variables=", ".join(f"@{column.name}" for column in columns),
+            column_expressions=", ".join(
+                f"{column.name} = {column.load_data_expression}" for column in columns
+            ),
+        )
     )
-    with conn, conn.cursor() as cursor, open(CSV_FILENAME) as f:
-        csv_reader = csv.reader(f)
-        column_names = next(csv_reader)
-        column_names = [
-            column_name.replace(" ", "_").lower() for column_name in column_names
-        ]
-        csv_data = [tuple(row) for row in csv_reader]
-        # print(csv_data)
-        cursor.execute(
-            "CREATE TABLE if not exists {rds_table_name} ({column_name_and_types});".format(
-                rds_table_name=RDS_TABLE_NAME,
-                column_name_and_types=", ".join(
-                    f"{column_name} varchar(40)" for column_name in column_names
-                ),
-            )  # did not define a primary key
+    # e.g. b"Records: 3  Deleted: 0  Skipped: 1  Warnings: 0", where Records counts
+    # the CSV rows read and the skipped ones are not in `num_rows`
+    match = LOAD_DATA_RECORDS_PATTERN.search(cursor._result.message or b"")
+    metrics.add("RecordsIn", int(match.group(1)) if match else num_rows)
+    metrics.add("RecordsOut", num_rows)
+
+
+def insert_in_chunks(
+    conn, cursor, csv_rows, column_names: List[str], convert_rows
+) -> None:
+    # pymysql's `executemany` turns each chunk into multi-row INSERT statements
+    sql_statement = """
+        INSERT INTO {rds_table_name} ({column_names})
+        VALUES ({column_types});""".format(
+        rds_table_name=RDS_TABLE_NAME,
+        column_names=", ".join(column_names),
+        column_types=", ".join(["%s"] * len(column_names)),
+    )
+    for chunk in read_csv_in_chunks(
+        csv_reader=csv_rows, batch_size=RDS_LOAD_BATCH_SIZE
+    ):
+        metrics.add("RecordsIn", len(chunk))
+        metrics.add(
+            "RecordsOut", cursor.executemany(sql_statement, convert_rows(chunk))
         )
         conn.commit()
-        cursor.executemany(
-            """
-            INSERT INTO {rds_table_name} ({column_names})
-            VALUES ({column_types});""".format(
-                rds_table_name=RDS_TABLE_NAME,
-                column_names=", ".join(column_names),
-                column_types=", ".join(["%s"] * len(column_names)),
-            ),
-            csv_data,
+
+
+def load_csv_file(conn, cursor, f) -> None:
+    csv_reader = csv.reader(f)
+    column_names = next(csv_reader)
+    column_names = [
+        column_name.replace(" ", "_").lower() for column_name in column_names
+    ]
+    if RDS_INFER_COLUMN_TYPES:
+        # e.g. DECIMAL instead of "  1,000,000.00 " and DATE instead of 29-Jun-17
+        sample_rows = [
+            tuple(row) for row in itertools.islice(csv_reader, RDS_SCHEMA_SAMPLE_SIZE)
+        ]
+        with metrics.timer("InferSchema"):
+            columns = infer_columns(column_names=column_names, sample_rows=sample_rows)
+        csv_rows = itertools.chain(sample_rows, csv_reader)
+        convert_rows = get_row_converter(columns=columns)
+    else:
+        columns = [
+            InferredColumn(
+                name=column_name,
+                mysql_type="varchar(40)",
+                convert=str,
+                load_data_expression=f"@{column_name}",
+            )
+            for column_name in column_names
+        ]
+        csv_rows = csv_reader
+        convert_rows = lambda rows: rows  # noqa: E731
+    # only sent once per Lambda container (unless the inferred columns change)
+    mysql_connection_manager.ensure_ddl(
+        cursor=cursor,
+        sql_statement=get_create_table_sql_statement(
+            table_name=RDS_TABLE_NAME, columns=columns
+        ),
+    )
+    if RDS_LOAD_MODE == "load_data_local_infile":
+        try:
+            with metrics.timer("LoadDataLocalInfile"):
+                load_data_local_infile(cursor=cursor, columns=columns)
+                conn.commit()
+            return
+        except (pymysql.err.OperationalError, pymysql.err.InternalError) as e:
+            if e.args[0] not in LOCAL_INFILE_DISABLED_ERROR_CODES:
+                raise
+            print(f"LOAD DATA LOCAL INFILE is disabled ({e}), so inserting in chunks")
+    with metrics.timer("InsertInChunks"):
+        insert_in_chunks(
+            conn=conn,
+            cursor=cursor,
+            csv_rows=csv_rows,
+            column_names=column_names,
+            convert_rows=convert_rows,
         )
-        conn.commit()
+
+
+@metrics.instrument
+def lambda_handler(event, context):
+    with metrics.timer(
+        "Connect"
+    ):  # ~0 if the connection of the last invocation is alive
+        conn = mysql_connection_manager.get_connection()
+    try:
+        with conn.cursor() as cursor, open(CSV_FILENAME) as f:
+            load_csv_file(conn=conn, cursor=cursor, f=f)
+    except Exception:
+        mysql_connection_manager.discard_connection()  # drops uncommitted rows too
+        raise
+    print(f"MySQL connection stats of this container: {mysql_connection_manager.stats}")
@@ -0,0 +1,151 @@
+"""Infer MySQL column types from a sample of CSV rows, then emit typed DDL, the SET
+clauses of LOAD DATA and a column-wise converter for chunked INSERTs"""
+
+import re
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, List, Optional, Sequence
+
+INTEGER_PATTERN = re.compile(r"^-?(0|[1-9]\d*)$")  # leading zeros stay strings
+DECIMAL_PATTERN = re.compile(r"^-?\d+\.\d+$")
+THOUSANDS_SEPARATOR_PATTERN = re.compile(r"^-?\d{1,3}(,\d{3})+(\.\d+)?$")
+BOOLEAN_VALUES = {"TRUE": 1, "FALSE": 0}
+DATE_FORMATS = ["%Y-%m-%d", "%d-%b-%y", "%d-%b-%Y"]  # same in Python and MySQL
+MAX_INT = 2**31 - 1
+
+
+def normalize_number(value: str) -> str:
+    if THOUSANDS_SEPARATOR_PATTERN.match(value):
+        return value.replace(",", "")
+    return value
+
+
+class InferredColumn:
+    def __init__(
+        self,
+        name: str,
+        mysql_type: str,
+        convert: Callable[[str], object],
+        load_data_expression: str,
+    ) -> None:
+        self.name = name
+        self.mysql_type = mysql_type
+        self.convert = convert  # stripped, non-empty CSV value -> Python value
+        # MySQL expression of the CSV value in `@{name}`, for LOAD DATA ... SET
+        self.load_data_expression = load_data_expression
+
+
+def get_varchar_column(name: str, max_length: int) -> InferredColumn:
+    return InferredColumn(
+        name=name,
+        mysql_type=f"varchar({max_length})",
+        convert=str,
+        load_data_expression=f"NULLIF(TRIM(@{name}), '')",
+    )
+
+
+def infer_column(name: str, values: Sequence[str]) -> InferredColumn:
+    """`values` are the stripped, non-empty sample values of 1 column"""
+    if not values:
+        return get_varchar_column(name=name, max_length=40)
+    if all(value.upper() in BOOLEAN_VALUES for value in values):
+        return InferredColumn(
+            name=name,
+            mysql_type="boolean",
+            convert=lambda value: BOOLEAN_VALUES[value.upper()],
+            load_data_expression=(
+                f"CASE UPPER(TRIM(@{name})) WHEN 'TRUE' THEN 1 WHEN 'FALSE' THEN 0 END"
+            ),
+        )
+    numbers = [normalize_number(value) for value in values]
+    number_expression = f"NULLIF(REPLACE(TRIM(@{name}), ',', ''), '')"
+    if all(INTEGER_PATTERN.match(number) for number in numbers):
+        fits_int = all(abs(int(number)) <= MAX_INT for number in numbers)
+        return InferredColumn(
+            name=name,
+            mysql_type="int" if fits_int else "bigint",
+            convert=lambda value: int(normalize_number(value)),
+            load_data_expression=number_expression,
+        )
+    if all(
+        INTEGER_PATTERN.match(number) or DECIMAL_PATTERN.match(number)
+        for number in numbers
+    ):
+        scale = max(len(number.partition(".")[2]) for number in numbers)
+        integer_digits = max(
+            len(number.partition(".")[0].lstrip("-")) for number in numbers
+        )
+        precision = min(65, max(18, integer_digits + scale))
+        return InferredColumn(
+            name=name,
+            mysql_type=f"decimal({precision}, {scale})",
+            convert=lambda value: Decimal(normalize_number(value)),
+            load_data_expression=number_expression,
+        )
+    date_format = get_date_format(values)
+    if date_format is not None:
+        return InferredColumn(
+            name=name,
+            mysql_type="date",
+            convert=lambda value: datetime.strptime(value, date_format).date(),
+            load_data_expression=(
+                f"STR_TO_DATE(NULLIF(TRIM(@{name}), ''), '{date_format}')"
+            ),
+        )
+    max_length = max(len(value) for value in values)
+    return get_varchar_column(  # headroom for longer values than in the sample
+        name=name, max_length=max(8, 1 << max_length.bit_length())
+    )
+
+
+def get_date_format(values: Sequence[str]) -> Optional[str]:
+    for date_format in DATE_FORMATS:
+        try:
+            for value in values:
+                datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        return date_format
+    return None
+
+
+def infer_columns(
+    column_names: List[str], sample_rows: List[tuple]
+) -> List[InferredColumn]:
+    columns_values = zip(*sample_rows) if sample_rows else [()] * len(column_names)
+    return [
+        infer_column(
+            name=column_name,
+            values=[value.strip() for value in column_values if value.strip()],
+        )
+        for column_name, column_values in zip(column_names, columns_values)
+    ]
+
+
+def get_create_table_sql_statement(
+    table_name: str, columns: List[InferredColumn]
+) -> str:
+    return "CREATE TABLE if not exists {table_name} ({column_name_and_types});".format(
+        table_name=table_name,
+        column_name_and_types=", ".join(
+            f"{column.name} {column.mysql_type}" for column in columns
+        ),
+    )  # did not define a primary key
+
+
+def get_row_converter(
+    columns: List[InferredColumn],
+) -> Callable[[List[tuple]], List[tuple]]:
+    """Converts a whole chunk of rows 1 column at a time: whitespace is stripped,
+    empty values become NULL and the rest are parsed into the inferred types"""
+    converters = [column.convert for column in columns]
+
+    def convert_column(convert, values):
+        return [convert(value.strip()) if value.strip() else None for value in values]
+
+    def convert_rows(rows: List[tuple]) -> List[tuple]:
+        if not rows:
+            return []
+        return list(zip(*map(convert_column, converters, zip(*rows))))
+
+    return convert_rows
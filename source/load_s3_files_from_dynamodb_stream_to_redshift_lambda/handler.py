@@ -1,118 +1,580 @@
+import json
 import os
 import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import unquote_plus
 
 import boto3
-
+from botocore.config import Config
+from lambda_metrics import metrics  # from shared Lambda layer
+from load_ledger import LoadLedger
+from partition_leases import PartitionLeases
+from pending_s3_files import PendingS3FileLister
+from redshift_data_executor import (  # from shared Lambda layer
+    MAX_SQL_STATEMENTS_PER_BATCH,
+    RedshiftDataExecutor,
+    RedshiftStatementError,
+)
+from s3_file_promotion import S3FilePromoter
+from table_schema import TableSchemaManager, quote_identifier
 
 AWS_REGION = os.environ["AWSREGION"]
 
-s3_client = boto3.client("s3")
-S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT = os.environ["S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT"]
+S3_PROMOTION_MAX_WORKERS = int(os.environ["S3_PROMOTION_MAX_WORKERS"])
+# 1 pooled connection per promotion thread
+s3_client = boto3.client(
+    "s3", config=Config(max_pool_connections=S3_PROMOTION_MAX_WORKERS)
+)
+metrics.count_requests(s3_client, name="S3Requests")
+S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT = os.environ[
+    "S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT"
+]
 UNPROCESSED_DYNAMODB_STREAM_FOLDER = os.environ["UNPROCESSED_DYNAMODB_STREAM_FOLDER"]
 PROCESSED_DYNAMODB_STREAM_FOLDER = os.environ["PROCESSED_DYNAMODB_STREAM_FOLDER"]
+LOADER_STATE_FOLDER = os.environ["LOADER_STATE_FOLDER"]
+s3_file_promoter = S3FilePromoter(
+    s3_client=s3_client,
+    s3_bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
+    old_folder=UNPROCESSED_DYNAMODB_STREAM_FOLDER,
+    new_folder=PROCESSED_DYNAMODB_STREAM_FOLDER,
+    state_folder=f"{LOADER_STATE_FOLDER}/pending_promotions",
+    max_workers=S3_PROMOTION_MAX_WORKERS,
+)
+MAX_FILES_PER_RUN = int(
+    os.environ["MAX_FILES_PER_RUN"]
+)  # stay within the Lambda timeout
+pending_s3_file_lister = PendingS3FileLister(
+    s3_client=s3_client,
+    s3_bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
+    folder=UNPROCESSED_DYNAMODB_STREAM_FOLDER,
+    state_folder=f"{LOADER_STATE_FOLDER}/listing_cursors",
+    lookback_in_minutes=int(os.environ["LISTING_LOOKBACK_IN_MINUTES"]),
+    full_listing_interval_in_minutes=int(
+        os.environ["FULL_LISTING_INTERVAL_IN_MINUTES"]
+    ),
+)
+# only set if more than 1 loader may run at a time
+LOADER_LEASE_TABLE_NAME = os.environ.get("LOADER_LEASE_TABLE_NAME")
+dynamodb_client = boto3.client("dynamodb") if LOADER_LEASE_TABLE_NAME else None
 
-redshift_data_client = boto3.client("redshift-data")
 # aws_redshift.CfnCluster(...).attr_id (for cluster name) is broken, so using endpoint address instead
 REDSHIFT_CLUSTER_NAME = os.environ["REDSHIFT_ENDPOINT_ADDRESS"].split(".")[0]
 REDSHIFT_ROLE_ARN = os.environ["REDSHIFT_ROLE_ARN"]
 REDSHIFT_USER = os.environ["REDSHIFT_USER"]
 REDSHIFT_DATABASE_NAME = os.environ["REDSHIFT_DATABASE_NAME"]
-REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC = os.environ["REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC"]
-REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC = os.environ["REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC"]
+REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC = os.environ[
+    "REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC"
+]
+REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC = os.environ[
+    "REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC"
+]
+redshift_data_executor = RedshiftDataExecutor(
+    cluster_identifier=REDSHIFT_CLUSTER_NAME,
+    database=REDSHIFT_DATABASE_NAME,
+    db_user=REDSHIFT_USER,
+)
+USE_MANIFEST_COPY = json.loads(os.environ["USE_MANIFEST_COPY"])
+REDSHIFT_LOAD_MODE = os.environ["REDSHIFT_LOAD_MODE"]
+if REDSHIFT_LOAD_MODE not in ["append", "upsert"]:
+    raise ValueError(
+        f'`REDSHIFT_LOAD_MODE` should be "append" or "upsert", not "{REDSHIFT_LOAD_MODE}"'
+    )
+# Redshift still serializes writes to 1 table, so what overlaps is the Data API round
+# trips and manifests; upserts of different partitions would race on the same `id`s
+LOAD_PARTITIONS_CONCURRENTLY = json.loads(os.environ["LOAD_PARTITIONS_CONCURRENTLY"])
+if LOAD_PARTITIONS_CONCURRENTLY and REDSHIFT_LOAD_MODE != "append":
+    raise ValueError(
+        '`LOAD_PARTITIONS_CONCURRENTLY` needs `REDSHIFT_LOAD_MODE` to be "append", '
+        f'not "{REDSHIFT_LOAD_MODE}"'
+    )
 
+REDSHIFT_TABLE_FOR_DYNAMODB_CDC = (
+    f"{REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC}.{REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC}"
+)
+REDSHIFT_STAGING_TABLE_FOR_DYNAMODB_CDC = (  # temp table, so lives only for 1 session
+    f"{REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC}__staging"
+)
+load_ledger = LoadLedger(
+    redshift_data_executor=redshift_data_executor,
+    table_name=f"{REDSHIFT_TABLE_FOR_DYNAMODB_CDC}__load_ledger",
+)
+REDSHIFT_TABLE_COLUMNS_FOR_DYNAMODB_CDC = {  # column name: column type
+    "id": "varchar(30) UNIQUE NOT NULL",  # Redshift does not enforce uniqueness
+    "details": "super",
+    "price": "float",
+    "shares": "integer",
+    "ticker": "varchar(10)",
+    "ticket": "varchar(10)",
+    "time": "super",
+    # change metadata of the DynamoDB stream Lambda
+    "_cdc_op": "varchar(6)",  # INSERT, MODIFY or REMOVE (a row with only the keys)
+    "_cdc_sequence_number": "varchar(40)",  # zero padded, so sorts as a number
+    "_cdc_event_time": "timestamp",
+}
+# adds a column for every new DynamoDB attribute, before COPY `json 'auto'` drops it
+table_schema_manager = TableSchemaManager(
+    redshift_data_executor=redshift_data_executor,
+    s3_client=s3_client,
+    s3_bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
+    state_s3_filename=f"{LOADER_STATE_FOLDER}/table_columns.json",
+    attributes_folder=os.environ["DYNAMODB_STREAM_ATTRIBUTES_FOLDER"],
+    schema_name=REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC,
+    table_name=REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC,
+    columns=REDSHIFT_TABLE_COLUMNS_FOR_DYNAMODB_CDC,
+    create_table_sql_statements=[
+        f"CREATE SCHEMA IF NOT EXISTS {REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC};",
+        "CREATE TABLE IF NOT EXISTS {} ({});".format(
+            REDSHIFT_TABLE_FOR_DYNAMODB_CDC,
+            ", ".join(
+                f"{column_name} {column_type}"
+                for column_name, column_type in REDSHIFT_TABLE_COLUMNS_FOR_DYNAMODB_CDC.items()
+            ),
+        ),
+        load_ledger.get_create_table_sql_statement(),
+    ],
+)
 
-def execute_sql_statement(sql_statement: str) -> None:
-    response = redshift_data_client.execute_statement(
-        ClusterIdentifier=REDSHIFT_CLUSTER_NAME,
-        Database=REDSHIFT_DATABASE_NAME,
-        DbUser=REDSHIFT_USER,
-        Sql=sql_statement,
+COPY_FORMAT_OPTIONS_BY_SUFFIX = {  # hard coded suffixes of the DynamoDB stream Lambda
+    "__inserted_or_modified_records.json": f"REGION '{AWS_REGION}' format as json 'auto'",
+    "__inserted_or_modified_records.json.gz": f"REGION '{AWS_REGION}' format as json 'auto' gzip",
+    "__inserted_or_modified_records.json.zst": f"REGION '{AWS_REGION}' format as json 'auto' zstd",
+    # nested structs land in SUPER columns; COPY of columnar files does not take REGION
+    "__inserted_or_modified_records.parquet": "format as parquet serializetojson",
+}
+# COPY of Parquet files maps columns by position, so it names the columns of the
+# Parquet schema (the table's initial columns): the columns that the schema manager
+# adds later for new attributes are left NULL instead of shifting the rest
+COPY_COLUMN_LISTS_BY_SUFFIX = {
+    "__inserted_or_modified_records.parquet": " ({})".format(
+        ", ".join(map(quote_identifier, REDSHIFT_TABLE_COLUMNS_FOR_DYNAMODB_CDC))
+    ),
+}
+NO_INSERTED_OR_MODIFIED_RECORDS_SUFFIX = (
+    "__no_inserted_or_modified_records.txt"  # hard coded suffix
+)
+# a load is 1 batch statement: the upsert's CREATE, 2 DELETEs and INSERT, 1 COPY per
+# file format and the ledger INSERTs of up to `MAX_FILES_PER_RUN` files
+MAX_LOAD_SQL_STATEMENTS = (
+    4 * (REDSHIFT_LOAD_MODE == "upsert")
+    + len(COPY_FORMAT_OPTIONS_BY_SUFFIX)
+    + load_ledger.get_max_num_record_sql_statements(num_s3_files=MAX_FILES_PER_RUN)
+)
+if MAX_LOAD_SQL_STATEMENTS > MAX_SQL_STATEMENTS_PER_BATCH:
+    raise ValueError(
+        f"`MAX_FILES_PER_RUN` of {MAX_FILES_PER_RUN} needs up to "
+        f"{MAX_LOAD_SQL_STATEMENTS} SQL statements per load, but a Data API batch "
+        f"statement takes at most {MAX_SQL_STATEMENTS_PER_BATCH}"
     )
-    time.sleep(1)
-    while True:
-        response = redshift_data_client.describe_statement(Id=response["Id"])
-        status = response["Status"]
-        if status == "FINISHED":
-            print(f"Finished executing the following SQL statement: {sql_statement}")
-            return
-        elif status in ["SUBMITTED", "PICKED", "STARTED"]:
-            time.sleep(1)
-        elif status == "FAILED":
-            print(response)
-            raise  ### figure out useful message in exception
-        else:
-            print(response)
-            raise  ### figure out useful message in exception
 
 
-def move_s3_file(s3_bucket: str, old_s3_filename: str, new_s3_filename) -> None:
-    s3_client.copy_object(
-        Bucket=s3_bucket,
-        Key=new_s3_filename,
-        CopySource={"Bucket": s3_bucket, "Key": old_s3_filename},
+def write_manifest_file(s3_bucket: str, s3_file_sizes: dict) -> str:
+    """Write a Redshift COPY manifest listing every file to load in a single COPY.
+    Manifest files live in the processed folder so the lifecycle rule expires them."""
+    manifest_s3_filename = (
+        f"{PROCESSED_DYNAMODB_STREAM_FOLDER}/manifests/"
+        f"{datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}__{uuid.uuid4()}.manifest"
     )
-    s3_client.delete_object(
+    manifest = {
+        "entries": [
+            # mandatory so that COPY fails rather than silently skipping a file that
+            # would then be moved to the processed folder without being loaded
+            {
+                "url": f"s3://{s3_bucket}/{s3_filename}",
+                "mandatory": True,
+                "meta": {"content_length": s3_file_size},  # required for Parquet
+            }
+            for s3_filename, s3_file_size in s3_file_sizes.items()
+        ]
+    }
+    s3_client.put_object(
         Bucket=s3_bucket,
-        Key=old_s3_filename,
+        Key=manifest_s3_filename,
+        Body=json.dumps(manifest).encode(),
     )
-    print(
-        f"Moved s3://{s3_bucket}/{old_s3_filename} to "
-        f"s3://{s3_bucket}/{new_s3_filename}"
+    return manifest_s3_filename
+
+
+def get_copy_sql_statement(
+    table_name: str, s3_filename: str, suffix: str, is_manifest: bool
+) -> str:
+    """`suffix` (of the files to COPY) picks the COPY options"""
+    return f"""
+        COPY {table_name}{COPY_COLUMN_LISTS_BY_SUFFIX.get(suffix, "")}
+        FROM 's3://{S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT}/{s3_filename}'
+        iam_role '{REDSHIFT_ROLE_ARN}'
+        {COPY_FORMAT_OPTIONS_BY_SUFFIX[suffix]}{" manifest" if is_manifest else ""};
+    """
+
+
+def get_upsert_sql_statements(suffixes_by_manifest_s3_filename: dict) -> list:
+    """COPY into a staging table, then replace the rows of every `id` in the batch
+    with 1 set-based delete + insert of its latest image, so the table holds 1 row
+    per live `id` instead of 1 row per DynamoDB stream event. An `id` whose latest
+    change is a REMOVE is only deleted. Staged images that are not newer than the
+    table's row (by sequence number), e.g. of a file loaded late or again, are
+    dropped first, so they never overwrite a newer row."""
+    # also the columns added for new DynamoDB attributes
+    column_names = ", ".join(
+        quote_identifier(column_name)
+        for column_name in sorted(table_schema_manager.column_names)
     )
+    return [
+        f"""CREATE TEMP TABLE {REDSHIFT_STAGING_TABLE_FOR_DYNAMODB_CDC}
+            (LIKE {REDSHIFT_TABLE_FOR_DYNAMODB_CDC});""",
+        *[
+            get_copy_sql_statement(
+                table_name=REDSHIFT_STAGING_TABLE_FOR_DYNAMODB_CDC,
+                s3_filename=manifest_s3_filename,
+                suffix=suffix,
+                is_manifest=True,
+            )
+            for manifest_s3_filename, suffix in suffixes_by_manifest_s3_filename.items()
+        ],
+        # a missing sequence number (a file written before the change metadata) on
+        # either side compares as NULL, so such an image is not dropped
+        f"""DELETE FROM {REDSHIFT_STAGING_TABLE_FOR_DYNAMODB_CDC}
+            USING {REDSHIFT_TABLE_FOR_DYNAMODB_CDC}
+            WHERE {REDSHIFT_STAGING_TABLE_FOR_DYNAMODB_CDC}.id = {REDSHIFT_TABLE_FOR_DYNAMODB_CDC}.id
+            AND {REDSHIFT_STAGING_TABLE_FOR_DYNAMODB_CDC}._cdc_sequence_number
+                <= {REDSHIFT_TABLE_FOR_DYNAMODB_CDC}._cdc_sequence_number;""",
+        f"""DELETE FROM {REDSHIFT_TABLE_FOR_DYNAMODB_CDC}
+            USING {REDSHIFT_STAGING_TABLE_FOR_DYNAMODB_CDC}
+            WHERE {REDSHIFT_TABLE_FOR_DYNAMODB_CDC}.id = {REDSHIFT_STAGING_TABLE_FOR_DYNAMODB_CDC}.id;""",
+        # files written before the change metadata have no sequence number, so any
+        # 1 of their images is kept
+        f"""INSERT INTO {REDSHIFT_TABLE_FOR_DYNAMODB_CDC} ({column_names})
+            SELECT {column_names} FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY id ORDER BY _cdc_sequence_number DESC NULLS LAST
+                ) AS image_number
+                FROM {REDSHIFT_STAGING_TABLE_FOR_DYNAMODB_CDC}
+            )
+            WHERE image_number = 1 AND (_cdc_op IS NULL OR _cdc_op <> 'REMOVE');""",
+    ]
 
 
-def lambda_handler(event, context) -> None:
-    dynamodb_stream_s3_files = s3_client.list_objects_v2(
-        Bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
-        Prefix=f"{UNPROCESSED_DYNAMODB_STREAM_FOLDER}/",
-        Delimiter="/"
-    ).get("Contents", [])
-    dynamodb_stream_s3_files = [dct["Key"] for dct in dynamodb_stream_s3_files]
-    if dynamodb_stream_s3_files:
-        sql_statements = [
-            f"CREATE SCHEMA IF NOT EXISTS {REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC};",
-            f"""CREATE TABLE IF NOT EXISTS {REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC}.{REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC} (
-                id varchar(30) UNIQUE NOT NULL,
-                details super,
-                price float,
-                shares integer,
-                ticker varchar(10),
-                ticket varchar(10),
-                time super
-            );""",
-        ]
-        for sql_statement in sql_statements:
-            execute_sql_statement(sql_statement=sql_statement)
-        for s3_file in dynamodb_stream_s3_files:
-            if "__inserted_or_modified_records.json" in s3_file:  # hard coded suffix
-                sql_statement = f"""
-                    COPY {REDSHIFT_DATABASE_NAME}.{REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC}.{REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC}
-                    FROM 's3://{S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT}/{s3_file}'
-                    REGION '{AWS_REGION}'
-                    iam_role '{REDSHIFT_ROLE_ARN}'
-                    format as json 'auto';
-                """
-                execute_sql_statement(sql_statement=sql_statement)
-                move_s3_file(
-                    s3_bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
-                    old_s3_filename=s3_file,
-                    new_s3_filename=s3_file.replace(
-                        UNPROCESSED_DYNAMODB_STREAM_FOLDER,
-                        PROCESSED_DYNAMODB_STREAM_FOLDER,
+def classify_s3_files(s3_file_sizes: dict) -> tuple:
+    """COPY options differ per file format, so returns
+    ({suffix: {S3 filename: S3 file size}}, [S3 filenames of marker files])"""
+    inserted_or_modified_records_s3_files = defaultdict(dict)
+    no_inserted_or_modified_records_s3_files = []
+    for s3_file, s3_file_size in s3_file_sizes.items():
+        suffix = next(
+            (
+                suffix
+                for suffix in COPY_FORMAT_OPTIONS_BY_SUFFIX
+                if s3_file.endswith(suffix)
+            ),
+            None,
+        )
+        if suffix is not None:
+            inserted_or_modified_records_s3_files[suffix][s3_file] = s3_file_size
+        elif s3_file.endswith(NO_INSERTED_OR_MODIFIED_RECORDS_SUFFIX):
+            no_inserted_or_modified_records_s3_files.append(s3_file)
+        else:
+            raise ValueError(
+                f"Did not expect s3://{S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT}/"
+                f"{s3_file} in the unprocessed DynamoDB stream folder"
+            )
+    return (
+        inserted_or_modified_records_s3_files,
+        no_inserted_or_modified_records_s3_files,
+    )
+
+
+def get_manifest_load_sql_statements(
+    inserted_or_modified_records_s3_files: dict,
+) -> list:
+    # 1 COPY (and thus 1 commit) per file format instead of 1 COPY per file
+    suffixes_by_manifest_s3_filename = {
+        write_manifest_file(
+            s3_bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
+            s3_file_sizes=s3_file_sizes,
+        ): suffix
+        for suffix, s3_file_sizes in inserted_or_modified_records_s3_files.items()
+    }
+    if REDSHIFT_LOAD_MODE == "upsert":
+        return get_upsert_sql_statements(
+            suffixes_by_manifest_s3_filename=suffixes_by_manifest_s3_filename
+        )
+    return [
+        get_copy_sql_statement(
+            table_name=REDSHIFT_TABLE_FOR_DYNAMODB_CDC,
+            s3_filename=manifest_s3_filename,
+            suffix=suffix,
+            is_manifest=True,
+        )
+        for manifest_s3_filename, suffix in suffixes_by_manifest_s3_filename.items()
+    ]
+
+
+def get_loaded_s3_file_sizes(inserted_or_modified_records_s3_files: dict) -> dict:
+    """{S3 filename: S3 file size} of every file COPYed, whatever its format"""
+    return {
+        s3_file: s3_file_size
+        for s3_file_sizes in inserted_or_modified_records_s3_files.values()
+        for s3_file, s3_file_size in s3_file_sizes.items()
+    }
+
+
+def get_deadline(context) -> float:
+    """Epoch seconds at which this Lambda invocation times out"""
+    return time.time() + context.get_remaining_time_in_millis() / 1000
+
+
+def promote_s3_files(s3_files: list, context) -> None:
+    with metrics.timer("PromoteFiles"):
+        s3_file_promoter.promote(
+            s3_files=s3_files,
+            owner=context.aws_request_id,
+            expires_at=get_deadline(context),
+        )
+    metrics.add("FilesPromoted", len(s3_files))
+    pending_s3_file_lister.advance(s3_files=s3_files)
+
+
+def load_partitions_concurrently(s3_file_sizes_by_partition: dict, context) -> None:
+    """1 manifest COPY per partition, all submitted before any is waited on. Each
+    partition commits on its own (with its ledger entries), so a failing partition
+    leaves only its own files in the unprocessed folder."""
+    statement_ids_by_partition, s3_files_by_partition = {}, {}
+    failed_partitions, first_error = [], None
+    with metrics.timer("Copy"):
+        for partition, s3_file_sizes in s3_file_sizes_by_partition.items():
+            (
+                inserted_or_modified_records_s3_files,
+                no_inserted_or_modified_records_s3_files,
+            ) = classify_s3_files(s3_file_sizes=s3_file_sizes)
+            if inserted_or_modified_records_s3_files:
+                statement_ids_by_partition[partition] = redshift_data_executor.submit(
+                    *get_manifest_load_sql_statements(
+                        inserted_or_modified_records_s3_files=inserted_or_modified_records_s3_files
+                    ),
+                    *load_ledger.get_record_sql_statements(
+                        s3_file_sizes=get_loaded_s3_file_sizes(
+                            inserted_or_modified_records_s3_files
+                        ),
+                        loaded_by=context.aws_request_id,
                     ),
                 )
-            elif "__no_inserted_or_modified_records.txt" in s3_file:  # hard coded suffix
-                move_s3_file(
-                    s3_bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
-                    old_s3_filename=s3_file,
-                    new_s3_filename=s3_file.replace(
-                        UNPROCESSED_DYNAMODB_STREAM_FOLDER,
-                        PROCESSED_DYNAMODB_STREAM_FOLDER,
+            s3_files_by_partition[partition] = list(s3_file_sizes)
+        for partition, statement_id in statement_ids_by_partition.items():
+            try:
+                redshift_data_executor.wait([statement_id])
+            except RedshiftStatementError as e:
+                print(
+                    "Failed to load partition "
+                    f"s3://{S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT}/{partition}: {e}"
+                )
+                del s3_files_by_partition[partition]
+                failed_partitions.append(partition)
+                first_error = first_error or e
+    metrics.add("PartitionsLoaded", len(s3_files_by_partition))
+    metrics.add("PartitionsFailed", len(failed_partitions))
+    loaded_s3_files = [
+        s3_file for s3_files in s3_files_by_partition.values() for s3_file in s3_files
+    ]
+    with metrics.timer("PromoteFiles"):
+        s3_file_promoter.promote(
+            s3_files=loaded_s3_files,
+            owner=context.aws_request_id,
+            expires_at=get_deadline(context),
+        )
+    metrics.add("FilesPromoted", len(loaded_s3_files))
+    # the high-water mark stays before the oldest failed partition, so the next
+    # run lists it again
+    pending_s3_file_lister.advance(
+        s3_files=[
+            s3_file
+            for s3_file in loaded_s3_files
+            if not failed_partitions or s3_file < min(failed_partitions)
+        ]
+    )
+    if first_error is not None:
+        raise first_error
+
+
+def skip_loaded_s3_files(
+    s3_file_sizes_by_partition: dict, ddl_sql_statements: list, context
+) -> dict:
+    """Only moves the files that the ledger says are loaded, e.g. by a run that timed
+    out after its COPY committed but before its promotion state was written. Returns
+    the files left to load."""
+    s3_files = [
+        s3_file
+        for s3_file_sizes in s3_file_sizes_by_partition.values()
+        for s3_file in s3_file_sizes
+    ]
+    with metrics.timer("CheckLoadLedger"):
+        try:
+            already_loaded_s3_files = load_ledger.get_loaded_s3_files(
+                s3_files=s3_files, ddl_sql_statements=ddl_sql_statements
+            )
+            table_schema_manager.on_ddl_committed()
+        except RedshiftStatementError as e:
+            if not ddl_sql_statements:
+                raise
+            # e.g. a column type Redshift rejects: skip that column, not the load
+            print(f"Table schema DDL failed, running it 1 statement at a time: {e}")
+            metrics.add("DDLBatchesFailed")
+            table_schema_manager.execute_one_at_a_time()
+            already_loaded_s3_files = load_ledger.get_loaded_s3_files(
+                s3_files=s3_files, ddl_sql_statements=[]
+            )
+    metrics.add("FilesAlreadyLoaded", len(already_loaded_s3_files))
+    if not already_loaded_s3_files:
+        return s3_file_sizes_by_partition
+    promote_s3_files(s3_files=sorted(already_loaded_s3_files), context=context)
+    remaining_s3_file_sizes_by_partition = {}
+    for partition, s3_file_sizes in s3_file_sizes_by_partition.items():
+        s3_file_sizes = {
+            s3_file: s3_file_size
+            for s3_file, s3_file_size in s3_file_sizes.items()
+            if s3_file not in already_loaded_s3_files
+        }
+        if s3_file_sizes:
+            remaining_s3_file_sizes_by_partition[partition] = s3_file_sizes
+    return remaining_s3_file_sizes_by_partition
+
+
+def get_partitions_of_s3_event_notifications(event: dict) -> list:
+    """Partitions of the files created since the last run, from an SQS batch of S3
+    event notifications. Only the partitions are used, not the files themselves:
+    listing the partitions skips files that the schedule already loaded and picks up
+    files whose notification is still on its way."""
+    partitions = set()
+    for sqs_record in event["Records"]:
+        # S3 sends an `s3:TestEvent` without "Records" when the notification is set up
+        for s3_record in json.loads(sqs_record["body"]).get("Records", []):
+            s3_file = unquote_plus(s3_record["s3"]["object"]["key"])  # URL encoded
+            partitions.add(s3_file[: s3_file.rindex("/") + 1])
+    return list(partitions)
+
+
+@metrics.instrument
+def lambda_handler(event, context) -> None:
+    partition_leases = None
+    if LOADER_LEASE_TABLE_NAME:
+        partition_leases = PartitionLeases(
+            dynamodb_client=dynamodb_client,
+            table_name=LOADER_LEASE_TABLE_NAME,
+            owner=context.aws_request_id,
+            expires_at=get_deadline(context),
+        )
+    try:
+        load_pending_s3_files(
+            event=event,
+            context=context,
+            claim_partition=partition_leases.claim if partition_leases else None,
+        )
+    finally:
+        if partition_leases is not None:
+            partition_leases.release_all()
+
+
+def load_pending_s3_files(event: dict, context, claim_partition) -> None:
+    # files of a run that timed out after its COPY committed are already loaded
+    with metrics.timer("ResumePromotions"):
+        resumed_s3_files = s3_file_promoter.resume()
+    metrics.add("FilesResumed", len(resumed_s3_files))
+    with metrics.timer("ListPendingFiles"):
+        if event.get("Records"):  # triggered by SQS
+            s3_file_sizes_by_partition = pending_s3_file_lister.list_partitions(
+                partitions=get_partitions_of_s3_event_notifications(event=event),
+                max_files=MAX_FILES_PER_RUN,
+                claim_partition=claim_partition,
+            )
+        else:  # triggered by the schedule
+            s3_file_sizes_by_partition = pending_s3_file_lister.list_pending_s3_files(
+                max_files=MAX_FILES_PER_RUN,
+                owner=context.aws_request_id,
+                claim_partition=claim_partition,
+            )
+    for s3_file_sizes in s3_file_sizes_by_partition.values():
+        metrics.add("FilesIn", len(s3_file_sizes))
+        metrics.add("BytesIn", sum(s3_file_sizes.values()), unit="Bytes")
+    if s3_file_sizes_by_partition:
+        # none while the table has a column for every attribute of the pending files
+        with metrics.timer("PlanTableSchema"):
+            ddl_sql_statements = table_schema_manager.get_ddl_sql_statements()
+        metrics.add("DDLStatements", len(ddl_sql_statements))
+        # also runs the DDL, before any load (so there are no CREATE races)
+        s3_file_sizes_by_partition = skip_loaded_s3_files(
+            s3_file_sizes_by_partition=s3_file_sizes_by_partition,
+            ddl_sql_statements=ddl_sql_statements,
+            context=context,
+        )
+    if s3_file_sizes_by_partition:
+        if LOAD_PARTITIONS_CONCURRENTLY:
+            load_partitions_concurrently(
+                s3_file_sizes_by_partition=s3_file_sizes_by_partition, context=context
+            )
+            return
+        (
+            inserted_or_modified_records_s3_files,
+            no_inserted_or_modified_records_s3_files,
+        ) = classify_s3_files(
+            s3_file_sizes={  # partitions are listed oldest first
+                s3_file: s3_file_size
+                for s3_file_sizes in s3_file_sizes_by_partition.values()
+                for s3_file, s3_file_size in s3_file_sizes.items()
+            }
+        )
+        loaded_s3_file_sizes = get_loaded_s3_file_sizes(
+            inserted_or_modified_records_s3_files
+        )
+        if inserted_or_modified_records_s3_files and (
+            USE_MANIFEST_COPY or REDSHIFT_LOAD_MODE == "upsert"
+        ):
+            # load and ledger entries run in order as 1 batch statement: 1 Data API
+            # round trip and 1 transaction, so a failed upsert leaves both untouched
+            with metrics.timer("Copy"):
+                redshift_data_executor.execute(
+                    *get_manifest_load_sql_statements(
+                        inserted_or_modified_records_s3_files=inserted_or_modified_records_s3_files
                     ),
+                    *load_ledger.get_record_sql_statements(
+                        s3_file_sizes=loaded_s3_file_sizes,
+                        loaded_by=context.aws_request_id,
+                    ),
+                )
+            # only the files in the committed manifests are moved
+            promote_s3_files(
+                s3_files=list(loaded_s3_file_sizes)
+                + no_inserted_or_modified_records_s3_files,
+                context=context,
+            )
+        else:
+            loaded_s3_files = []
+            try:
+                for (
+                    suffix,
+                    s3_file_sizes,
+                ) in inserted_or_modified_records_s3_files.items():
+                    for s3_file, s3_file_size in s3_file_sizes.items():
+                        with metrics.timer("Copy"):
+                            redshift_data_executor.execute(
+                                get_copy_sql_statement(
+                                    table_name=REDSHIFT_TABLE_FOR_DYNAMODB_CDC,
+                                    s3_filename=s3_file,
+                                    suffix=suffix,
+                                    is_manifest=False,
+                                ),
+                                *load_ledger.get_record_sql_statements(
+                                    s3_file_sizes={s3_file: s3_file_size},
+                                    loaded_by=context.aws_request_id,
+                                ),
+                            )
+                        loaded_s3_files.append(s3_file)
+            finally:  # even if a later COPY fails, the loaded files must not be COPYed again
+                promote_s3_files(
+                    s3_files=loaded_s3_files + no_inserted_or_modified_records_s3_files,
+                    context=context,
                 )
-            else:
-                raise  ### figure out useful message in exception
     else:
+        pending_s3_file_lister.advance(s3_files=[])
         print(
             "No DynamoDB stream files in "
             f"s3://{S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT}/"
@@ -0,0 +1,102 @@
+"""Exactly-once loading of the DynamoDB stream files into Redshift.
+
+Every COPY is sent together with the INSERTs of its files into a ledger table in the
+same batch statement, i.e. in 1 transaction: either the rows and their ledger entries
+are committed or neither is. Before loading, the pending files are looked up in the
+ledger with 1 range query, so a file whose COPY committed but whose move to the
+processed folder never happened (e.g. the Lambda timed out in between) is only moved,
+not COPYed again.
+
+The stream file names are unique (timestamp and uuid), so the S3 key is the ledger
+key. Entries are only needed until their file has left the unprocessed folder, so
+old entries are deleted with the lookup.
+
+A batch statement takes at most 40 statements, so the entries are packed into as
+few INSERTs as fit in the 100 KB that the Data API takes per statement.
+"""
+
+import math
+from typing import Dict, Iterable, List, Set
+
+MAX_SQL_STATEMENT_BYTES = 100_000  # the Data API takes at most 100 KB per statement
+MAX_S3_KEY_BYTES = 1024  # S3's limit, also the width of `s3_key`
+MAX_LOADED_BY_BYTES = 64
+LEDGER_RETENTION_IN_DAYS = 7
+
+
+def quote(value: str) -> str:
+    return "'{}'".format(value.replace("'", "''"))
+
+
+class LoadLedger:
+    def __init__(self, redshift_data_executor, table_name: str) -> None:
+        self.redshift_data_executor = redshift_data_executor
+        self.table_name = table_name  # schema qualified
+
+    def get_create_table_sql_statement(self) -> str:
+        return f"""CREATE TABLE IF NOT EXISTS {self.table_name} (
+            s3_key varchar(1024) NOT NULL,
+            s3_size bigint,
+            loaded_by varchar(64),
+            loaded_at timestamp DEFAULT GETDATE()
+        ) SORTKEY (s3_key);"""
+
+    def get_loaded_s3_files(
+        self, s3_files: Iterable[str], ddl_sql_statements: List[str]
+    ) -> Set[str]:
+        """The `s3_files` that are already in the ledger. `ddl_sql_statements` (which
+        include the ledger's CREATE, if it may not exist yet) run in the same batch
+        statement, so the 1st run does not fail on a missing ledger."""
+        s3_files = set(s3_files)
+        if not s3_files:
+            return set()
+        response = self.redshift_data_executor.execute(
+            *ddl_sql_statements,
+            f"DELETE FROM {self.table_name} "
+            f"WHERE loaded_at < DATEADD(day, -{LEDGER_RETENTION_IN_DAYS}, GETDATE());",
+            # sorted keys, so the range only covers the partitions being loaded
+            f"""SELECT s3_key FROM {self.table_name}
+                WHERE s3_key BETWEEN {quote(min(s3_files))} AND {quote(max(s3_files))};""",
+        )
+        return {
+            record[0]["stringValue"]
+            for record in self.redshift_data_executor.get_records(
+                statement_id=response["SubStatements"][-1]["Id"]
+            )
+        } & s3_files
+
+    def get_insert_sql_statement(self, rows: List[str]) -> str:
+        return "INSERT INTO {} (s3_key, s3_size, loaded_by) VALUES {};".format(
+            self.table_name, ", ".join(rows)
+        )
+
+    def get_record_sql_statements(
+        self, s3_file_sizes: Dict[str, int], loaded_by: str
+    ) -> List[str]:
+        """To send in the same batch statement as the COPY of `s3_file_sizes`"""
+        sql_statements, rows = [], []
+        num_bytes = len(self.get_insert_sql_statement(rows=[]).encode())
+        for s3_file, s3_file_size in s3_file_sizes.items():
+            row = f"({quote(s3_file)}, {s3_file_size}, {quote(loaded_by)})"
+            num_row_bytes = len(row.encode()) + len(", ")
+            if rows and num_bytes + num_row_bytes > MAX_SQL_STATEMENT_BYTES:
+                sql_statements.append(self.get_insert_sql_statement(rows=rows))
+                rows = []
+                num_bytes = len(self.get_insert_sql_statement(rows=[]).encode())
+            rows.append(row)
+            num_bytes += num_row_bytes
+        if rows:
+            sql_statements.append(self.get_insert_sql_statement(rows=rows))
+        return sql_statements
+
+    def get_max_num_record_sql_statements(self, num_s3_files: int) -> int:
+        """Most statements that `get_record_sql_statements()` returns for
+        `num_s3_files` files, with the longest S3 keys"""
+        max_row = "('{}', {}, '{}'), ".format(
+            "x" * MAX_S3_KEY_BYTES, 2**63 - 1, "x" * MAX_LOADED_BY_BYTES
+        )
+        max_rows_per_statement = (
+            MAX_SQL_STATEMENT_BYTES
+            - len(self.get_insert_sql_statement(rows=[]).encode())
+        ) // len(max_row)
+        return math.ceil(num_s3_files / max_rows_per_statement)
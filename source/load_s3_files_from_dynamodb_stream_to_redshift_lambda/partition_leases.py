@@ -0,0 +1,57 @@
+"""Leases on partitions of pending DynamoDB stream files, so that concurrent loaders
+split the partitions between them instead of COPYing the same files twice.
+
+A lease is 1 item in a DynamoDB table, claimed with a conditional write that only
+succeeds if nobody holds the partition or the holder's lease has expired. A lease
+expires when its loader's Lambda times out, so a crashed loader does not hold on
+to its partitions.
+"""
+
+import time
+from typing import List
+
+
+class PartitionLeases:
+    def __init__(
+        self, dynamodb_client, table_name: str, owner: str, expires_at: float
+    ) -> None:
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.owner = owner  # e.g. the Lambda request ID
+        self.expires_at = expires_at  # epoch seconds, also the table's TTL attribute
+        self.claimed_partitions = []
+
+    def claim(self, partition: str) -> bool:
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "partition": {"S": partition},
+                    "owner": {"S": self.owner},
+                    "expires_at": {"N": str(int(self.expires_at))},
+                },
+                ConditionExpression="attribute_not_exists(#partition) OR expires_at < :now",
+                ExpressionAttributeNames={"#partition": "partition"},  # reserved word
+                ExpressionAttributeValues={":now": {"N": str(int(time.time()))}},
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            print(f"Skipped partition {partition}, which another loader holds")
+            return False
+        self.claimed_partitions.append(partition)
+        return True
+
+    def release_all(self) -> List[str]:
+        """Call once the claimed partitions are loaded and moved (or failed)"""
+        for partition in self.claimed_partitions:
+            try:
+                self.dynamodb_client.delete_item(
+                    TableName=self.table_name,
+                    Key={"partition": {"S": partition}},
+                    ConditionExpression="#owner = :owner",  # still ours
+                    ExpressionAttributeNames={"#owner": "owner"},
+                    ExpressionAttributeValues={":owner": {"S": self.owner}},
+                )
+            except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+                pass
+        released_partitions, self.claimed_partitions = self.claimed_partitions, []
+        return released_partitions
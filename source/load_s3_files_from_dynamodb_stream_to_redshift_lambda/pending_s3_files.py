@@ -0,0 +1,223 @@
+"""Find the pending DynamoDB stream files without re-listing the whole unprocessed
+folder every run.
+
+The stream files are partitioned by time, e.g.
+`unprocessed/dt=2022-01-01/hour=12/[shard=03/]2022-01-01T12:34:56Z__...`, so S3
+lists the partitions oldest first, and a partition disappears once all of its files
+are moved to the processed folder. Partitions are walked depth first until
+`max_files` files are found, so a run never lists more of the backlog than it loads.
+The newest loaded key is kept as a high-water mark in a small JSON state object and
+the next listing skips the days before it (minus a lookback window for files that
+land late, e.g. a slow writer Lambda). Every now and then the whole folder is listed
+anyway, so that a file later than the lookback window is not stranded.
+
+With `claim_partition` (e.g. `PartitionLeases.claim`), partitions that another
+loader holds are skipped, so concurrent loaders split the pending files. Each loader
+writes its own state object (like the promotion state) and reads the newest values of
+all of them, so one loader never moves another's high-water mark backwards. A loader
+only deletes the state objects that it has merged into its own.
+"""
+
+import json
+import re
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+PARTITION_TIMESTAMP_PATTERN = re.compile(r"/dt=(\d{4}-\d{2}-\d{2})/hour=(\d{2})/")
+
+
+class PendingS3FileLister:
+    def __init__(
+        self,
+        s3_client,
+        s3_bucket: str,
+        folder: str,
+        state_folder: str,
+        lookback_in_minutes: int,
+        full_listing_interval_in_minutes: int,
+    ) -> None:
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.folder = folder
+        self.state_folder = state_folder
+        self.lookback = timedelta(minutes=lookback_in_minutes)
+        self.full_listing_interval = timedelta(minutes=full_listing_interval_in_minutes)
+        self.state = None
+        self.state_changed = False
+        self.owner = None
+        self.read_state_s3_filenames = []
+
+    def get_state_s3_filename(self, owner: str) -> str:
+        return f"{self.state_folder}/{owner}.json"
+
+    def read_state(self) -> dict:
+        """The newest high-water mark and full listing of all loaders' state objects"""
+        state = {"high_water_mark": None, "last_full_listing_at": None}
+        self.read_state_s3_filenames = []
+        for page in self.s3_client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.s3_bucket, Prefix=f"{self.state_folder}/"
+        ):
+            for dct in page.get("Contents", []):
+                try:
+                    loader_state = json.loads(
+                        self.s3_client.get_object(
+                            Bucket=self.s3_bucket, Key=dct["Key"]
+                        )["Body"].read()
+                    )
+                except self.s3_client.exceptions.NoSuchKey:  # merged meanwhile
+                    continue
+                for name, value in loader_state.items():
+                    if value is not None and (
+                        state[name] is None or value > state[name]
+                    ):
+                        state[name] = value
+                self.read_state_s3_filenames.append(dct["Key"])
+        return state
+
+    def write_state(self) -> None:
+        """Writes this loader's state object, then deletes the ones merged into it"""
+        state_s3_filename = self.get_state_s3_filename(owner=self.owner)
+        self.s3_client.put_object(
+            Bucket=self.s3_bucket,
+            Key=state_s3_filename,
+            Body=json.dumps(self.state).encode(),
+        )
+        merged_s3_filenames = [
+            s3_filename
+            for s3_filename in self.read_state_s3_filenames
+            if s3_filename != state_s3_filename
+        ]
+        if merged_s3_filenames:  # a handful, well within 1 call's 1000 keys
+            self.s3_client.delete_objects(
+                Bucket=self.s3_bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": s3_filename} for s3_filename in merged_s3_filenames
+                    ],
+                    "Quiet": True,
+                },
+            )
+        self.read_state_s3_filenames = [state_s3_filename]
+
+    def get_start_after(self, now: datetime) -> Optional[str]:
+        """None means list the whole folder, including files of the old flat layout"""
+        if self.state["high_water_mark"] is None or (
+            self.state["last_full_listing_at"] is None
+            or now - datetime.fromisoformat(self.state["last_full_listing_at"])
+            >= self.full_listing_interval
+        ):
+            return None
+        match = PARTITION_TIMESTAMP_PATTERN.search(self.state["high_water_mark"])
+        if match is None:  # high-water mark of the old flat layout
+            return None
+        high_water_mark_time = datetime.strptime(  # truncated to the hour
+            " ".join(match.groups()), "%Y-%m-%d %H"
+        )
+        start_after_time = high_water_mark_time - self.lookback
+        # "dt=2022-01-01" sorts right before "dt=2022-01-01/", so that day is listed
+        return f"{self.folder}/dt={start_after_time.strftime('%Y-%m-%d')}"
+
+    def list_prefix(
+        self, prefix: str, start_after: Optional[str] = None
+    ) -> Iterator[Tuple[str, object]]:
+        """("file", {"Key": ..., "Size": ...}) or ("partition", sub-prefix) in key order"""
+        list_kwargs = {"Bucket": self.s3_bucket, "Prefix": prefix, "Delimiter": "/"}
+        if start_after is not None:
+            list_kwargs["StartAfter"] = start_after
+        for page in self.s3_client.get_paginator("list_objects_v2").paginate(
+            **list_kwargs
+        ):
+            items = [("file", dct) for dct in page.get("Contents", [])] + [
+                ("partition", dct["Prefix"]) for dct in page.get("CommonPrefixes", [])
+            ]
+            yield from sorted(
+                items,
+                key=lambda item: item[1]["Key"] if item[0] == "file" else item[1],
+            )
+
+    def list_pending_s3_files(
+        self,
+        max_files: int,
+        owner: str,
+        claim_partition: Optional[Callable[[str], bool]] = None,
+    ) -> Dict[str, Dict[str, int]]:
+        """{partition: {S3 filename: S3 file size}} of at most `max_files` of the
+        oldest pending files; the rest are left for the next run. `owner` is e.g. the
+        Lambda request ID."""
+        self.owner = owner
+        self.state, self.state_changed = self.read_state(), False
+        now = datetime.utcnow()
+        start_after = self.get_start_after(now=now)
+        if start_after is None:
+            self.state["last_full_listing_at"] = now.isoformat()
+            self.state_changed = True
+        return self.walk_partitions(
+            prefixes=[(f"{self.folder}/", start_after)],
+            max_files=max_files,
+            claim_partition=claim_partition,
+        )
+
+    def list_partitions(
+        self,
+        partitions: List[str],
+        max_files: int,
+        claim_partition: Optional[Callable[[str], bool]] = None,
+    ) -> Dict[str, Dict[str, int]]:
+        """Like `list_pending_s3_files`, but only in the given partitions, e.g. the
+        ones of S3 event notifications. The high-water mark is left alone."""
+        self.state, self.state_changed = None, False
+        return self.walk_partitions(
+            prefixes=[
+                (partition, None) for partition in sorted(partitions, reverse=True)
+            ],
+            max_files=max_files,
+            claim_partition=claim_partition,
+        )
+
+    def walk_partitions(
+        self,
+        prefixes: List[Tuple[str, Optional[str]]],
+        max_files: int,
+        claim_partition: Optional[Callable[[str], bool]] = None,
+    ) -> Dict[str, Dict[str, int]]:
+        """`prefixes` is a stack of (partition, StartAfter); the last is walked first"""
+        s3_file_sizes_by_partition = {}
+        num_files = 0
+        while prefixes:
+            prefix, prefix_start_after = prefixes.pop()
+            sub_prefixes = []
+            is_claimed = None  # only claim partitions that have files
+            for item_type, item in self.list_prefix(
+                prefix, start_after=prefix_start_after
+            ):
+                if item_type == "partition":
+                    sub_prefixes.append((item, None))
+                    continue
+                if num_files == max_files:
+                    print(
+                        f"Listed {max_files} pending files; "
+                        "the rest are left for the next run"
+                    )
+                    return s3_file_sizes_by_partition
+                if is_claimed is None:
+                    is_claimed = claim_partition is None or claim_partition(prefix)
+                if not is_claimed:
+                    continue
+                s3_file_sizes_by_partition.setdefault(prefix, {})[item["Key"]] = item[
+                    "Size"
+                ]
+                num_files += 1
+            prefixes.extend(reversed(sub_prefixes))  # oldest partition is walked first
+        return s3_file_sizes_by_partition
+
+    def advance(self, s3_files: List[str]) -> None:
+        """Call once `s3_files` are loaded and moved out of the folder"""
+        if self.state is None:  # not listed by `list_pending_s3_files`
+            return
+        if s3_files:
+            self.state["high_water_mark"] = max(
+                [*s3_files, self.state["high_water_mark"] or ""]
+            )
+            self.state_changed = True
+        if self.state_changed:  # most runs without new files cost no PUT
+            self.write_state()
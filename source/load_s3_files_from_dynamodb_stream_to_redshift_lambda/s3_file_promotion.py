@@ -0,0 +1,148 @@
+"""Promote loaded S3 files from the unprocessed to the processed folder: copies run
+concurrently in a bounded thread pool and the sources are removed with 1
+`delete_objects` call per 1000 keys instead of 1 `delete_object` call per file.
+
+Progress is kept in a small JSON state object per loader, so a Lambda that times out
+in the middle of a promotion has it finished by a later run instead of COPYing the
+same files into Redshift again. A state object is only taken over once its loader's
+Lambda has timed out, so concurrent loaders do not finish each other's promotions.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from botocore.exceptions import ClientError
+
+MAX_KEYS_PER_DELETE_OBJECTS = 1000  # hard limit of the S3 API
+
+
+class S3FilePromotionError(Exception):
+    pass
+
+
+class S3FilePromoter:
+    def __init__(
+        self,
+        s3_client,
+        s3_bucket: str,
+        old_folder: str,
+        new_folder: str,
+        state_folder: str,
+        max_workers: int = 16,
+    ) -> None:
+        self.s3_client = s3_client  # thread safe, unlike a boto3 session
+        self.s3_bucket = s3_bucket
+        self.old_folder = old_folder
+        self.new_folder = new_folder
+        self.state_folder = state_folder
+        self.max_workers = max_workers
+
+    def get_new_s3_filename(self, old_s3_filename: str) -> str:
+        return old_s3_filename.replace(self.old_folder, self.new_folder, 1)
+
+    def get_state_s3_filename(self, owner: str) -> str:
+        return f"{self.state_folder}/{owner}.json"
+
+    def promote(self, s3_files: List[str], owner: str, expires_at: float) -> None:
+        """Call only after the files are committed to Redshift. `owner` is e.g. the
+        Lambda request ID and `expires_at` (epoch seconds) its Lambda's deadline."""
+        if not s3_files:
+            return
+        state_s3_filename = self.get_state_s3_filename(owner=owner)
+        state = {"expires_at": expires_at, "s3_files": s3_files}
+        self.write_state(
+            state_s3_filename=state_s3_filename, state={**state, "phase": "copy"}
+        )
+        self.copy_s3_files(s3_files=s3_files, tolerate_missing=False)
+        self.write_state(
+            state_s3_filename=state_s3_filename, state={**state, "phase": "delete"}
+        )
+        self.delete_s3_files(s3_files=s3_files)
+        self.s3_client.delete_object(Bucket=self.s3_bucket, Key=state_s3_filename)
+        print(
+            f"Moved {len(s3_files)} files from s3://{self.s3_bucket}/{self.old_folder}/ "
+            f"to s3://{self.s3_bucket}/{self.new_folder}/"
+        )
+
+    def resume(self) -> List[str]:
+        """Finish the promotions that timed out loaders did not. Returns the promoted
+        files, which are already loaded and must not be COPYed again."""
+        promoted_s3_files = []
+        for page in self.s3_client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.s3_bucket, Prefix=f"{self.state_folder}/"
+        ):
+            for dct in page.get("Contents", []):
+                try:
+                    state = json.loads(
+                        self.s3_client.get_object(
+                            Bucket=self.s3_bucket, Key=dct["Key"]
+                        )["Body"].read()
+                    )
+                except self.s3_client.exceptions.NoSuchKey:  # finished meanwhile
+                    continue
+                if state["expires_at"] > time.time():  # its loader is still running
+                    continue
+                print(
+                    f"Resuming promotion of {len(state['s3_files'])} files from "
+                    f"the \"{state['phase']}\" phase"
+                )
+                if state["phase"] == "copy":
+                    # some sources may already be copied and deleted by the previous run
+                    self.copy_s3_files(
+                        s3_files=state["s3_files"], tolerate_missing=True
+                    )
+                self.delete_s3_files(s3_files=state["s3_files"])
+                self.s3_client.delete_object(Bucket=self.s3_bucket, Key=dct["Key"])
+                promoted_s3_files.extend(state["s3_files"])
+        return promoted_s3_files
+
+    def write_state(self, state_s3_filename: str, state: dict) -> None:
+        self.s3_client.put_object(
+            Bucket=self.s3_bucket,
+            Key=state_s3_filename,
+            Body=json.dumps(state).encode(),
+        )
+
+    def copy_s3_file(self, s3_file: str, tolerate_missing: bool) -> None:
+        try:
+            self.s3_client.copy_object(
+                Bucket=self.s3_bucket,
+                Key=self.get_new_s3_filename(s3_file),
+                CopySource={"Bucket": self.s3_bucket, "Key": s3_file},
+            )
+        except ClientError as e:
+            if not (tolerate_missing and e.response["Error"]["Code"] == "NoSuchKey"):
+                raise
+
+    def copy_s3_files(self, s3_files: List[str], tolerate_missing: bool) -> None:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # consume the results so that the first failed copy is raised
+            list(
+                executor.map(
+                    lambda s3_file: self.copy_s3_file(
+                        s3_file=s3_file, tolerate_missing=tolerate_missing
+                    ),
+                    s3_files,
+                )
+            )
+
+    def delete_s3_files(self, s3_files: List[str]) -> None:
+        # deleting a key that does not exist succeeds, so this is safe to repeat
+        for i in range(0, len(s3_files), MAX_KEYS_PER_DELETE_OBJECTS):
+            response = self.s3_client.delete_objects(
+                Bucket=self.s3_bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": s3_file}
+                        for s3_file in s3_files[i : i + MAX_KEYS_PER_DELETE_OBJECTS]
+                    ],
+                    "Quiet": True,  # only failed keys are returned
+                },
+            )
+            if response.get("Errors"):
+                raise S3FilePromotionError(
+                    f"Failed to delete {len(response['Errors'])} files from "
+                    f"s3://{self.s3_bucket}/, e.g. {response['Errors'][0]}"
+                )
@@ -0,0 +1,185 @@
+"""Keep the columns of the Redshift CDC table in step with the DynamoDB attributes
+without running DDL on every load.
+
+The table's column names are cached in the warm Lambda and in a small JSON state
+object, so only a cold start reads them (from the state object, or from the catalog
+if there is none). Every run diffs them against the declared columns and the
+attributes that the DynamoDB stream Lambda registered (`StreamAttributeRegistry`,
+1 S3 listing). Only a difference costs DDL: the cache may be stale (another loader
+may have added the column), so the catalog is read first, and then every column
+still missing gets an `ALTER TABLE ... ADD COLUMN`. Reading the catalog also brings
+the `CREATE ... IF NOT EXISTS` statements, for a table (or ledger) not there yet.
+
+If that DDL fails, it is run again 1 statement at a time, and a column whose ALTER
+still fails is skipped (its attribute is then not loaded, as `json 'auto'` ignores
+it) and remembered in the state object, so 1 bad column never blocks the loads.
+"""
+
+import json
+from typing import Dict, List, Optional, Set
+
+from redshift_data_executor import RedshiftStatementError  # from shared Lambda layer
+
+
+def quote_identifier(identifier: str) -> str:
+    """So that attributes like `order` or `user` (reserved words) can be columns"""
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+# of the types that the stream Lambda registers, widest first: an attribute seen
+# with several types gets the 1st one that holds all of them
+REDSHIFT_TYPES_BY_WIDTH = ["super", "varchar(65535)", "float8", "bigint", "boolean"]
+
+
+class TableSchemaManager:
+    def __init__(
+        self,
+        redshift_data_executor,
+        s3_client,
+        s3_bucket: str,
+        state_s3_filename: str,
+        attributes_folder: str,
+        schema_name: str,
+        table_name: str,
+        columns: Dict[str, str],
+        create_table_sql_statements: List[str],
+    ) -> None:
+        self.redshift_data_executor = redshift_data_executor
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.state_s3_filename = state_s3_filename
+        self.attributes_folder = attributes_folder
+        self.schema_name = schema_name
+        self.table_name = table_name  # not schema qualified
+        self.columns = columns  # column name: column type of a new table
+        self.create_table_sql_statements = create_table_sql_statements
+        self.column_names: Optional[Set[str]] = None  # warm cache
+        self.skipped_column_names: Set[str] = set()  # whose ALTER failed
+        self.planned_column_names: Optional[Set[str]] = None
+        self.planned_sql_statements: List[str] = []
+        self.planned_column_names_by_sql_statement: Dict[str, str] = {}  # of the ALTERs
+        self.state = None  # as last read or written
+
+    def read_state(self) -> Optional[dict]:
+        try:
+            return json.loads(
+                self.s3_client.get_object(
+                    Bucket=self.s3_bucket, Key=self.state_s3_filename
+                )["Body"].read()
+            )
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+
+    def get_state(self) -> dict:
+        return {
+            "column_names": sorted(self.column_names),
+            "skipped_column_names": sorted(self.skipped_column_names),
+        }
+
+    def write_state(self) -> None:
+        self.state = self.get_state()
+        self.s3_client.put_object(
+            Bucket=self.s3_bucket,
+            Key=self.state_s3_filename,
+            Body=json.dumps(self.state).encode(),
+        )
+
+    def read_catalog(self) -> Set[str]:
+        """Column names of the table, none if it does not exist"""
+        response = self.redshift_data_executor.execute(
+            f"""SELECT column_name FROM svv_columns
+                WHERE table_schema = '{self.schema_name.lower()}'
+                AND table_name = '{self.table_name.lower()}';"""
+        )
+        return {
+            record[0]["stringValue"]
+            for record in self.redshift_data_executor.get_records(
+                statement_id=response["Id"]
+            )
+        }
+
+    def list_attribute_types(self) -> Dict[str, str]:
+        """{attribute name: Redshift type} of what the stream Lambda registered"""
+        redshift_types_by_name = {}
+        for page in self.s3_client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.s3_bucket, Prefix=f"{self.attributes_folder}/"
+        ):
+            for dct in page.get("Contents", []):
+                name, _, redshift_type = dct["Key"][
+                    len(self.attributes_folder) + 1 :
+                ].partition("/")
+                redshift_types_by_name.setdefault(name, set()).add(redshift_type)
+        return {
+            name: next(
+                (
+                    redshift_type
+                    for redshift_type in REDSHIFT_TYPES_BY_WIDTH
+                    if redshift_type in redshift_types
+                ),
+                "super",  # holds any JSON value
+            )
+            for name, redshift_types in redshift_types_by_name.items()
+        }
+
+    def get_ddl_sql_statements(self) -> List[str]:
+        """DDL to run before loading, usually none. Call `on_ddl_committed()` once it
+        has run, or `execute_one_at_a_time()` if it failed."""
+        if self.column_names is None:  # cold start
+            self.state = self.read_state()
+            if self.state is not None:
+                self.column_names = set(self.state["column_names"])
+                self.skipped_column_names = set(
+                    self.state.get("skipped_column_names", [])
+                )
+        # declared columns win, e.g. `_cdc_*` of a table created before them
+        columns = {
+            column_name: column_type
+            for column_name, column_type in {
+                **self.list_attribute_types(),
+                **self.columns,
+            }.items()
+            if column_name not in self.skipped_column_names
+        }
+        if self.column_names is not None and not set(columns) - self.column_names:
+            self.planned_column_names = self.column_names
+            self.planned_sql_statements = []
+            return []
+        column_names = self.read_catalog() or set(self.columns)  # created if missing
+        self.planned_column_names_by_sql_statement = {
+            f"ALTER TABLE {self.schema_name}.{self.table_name} "
+            f"ADD COLUMN {quote_identifier(column_name)} {column_type};": column_name
+            for column_name, column_type in columns.items()
+            if column_name not in column_names
+        }
+        self.planned_sql_statements = [
+            *self.create_table_sql_statements,
+            *self.planned_column_names_by_sql_statement,
+        ]
+        print(f"Table schema DDL: {self.planned_sql_statements}")
+        self.planned_column_names = column_names | set(columns)
+        return self.planned_sql_statements
+
+    def on_ddl_committed(self) -> None:
+        self.column_names = self.planned_column_names
+        if self.get_state() != self.state:
+            self.write_state()
+
+    def execute_one_at_a_time(self) -> None:
+        """After the DDL failed in 1 batch (which rolled all of it back): a failing
+        CREATE raises, a failing ALTER only skips its column"""
+        failed_column_names = set()
+        for sql_statement in self.planned_sql_statements:
+            try:
+                self.redshift_data_executor.execute(sql_statement)
+            except RedshiftStatementError as e:
+                if sql_statement not in self.planned_column_names_by_sql_statement:
+                    self.column_names = None  # the next run reads the catalog again
+                    raise
+                column_name = self.planned_column_names_by_sql_statement[sql_statement]
+                print(f"Skipping column {column_name}: {e}")
+                failed_column_names.add(column_name)
+        # e.g. another loader may have added a column first
+        column_names = self.read_catalog()
+        self.skipped_column_names |= failed_column_names - column_names
+        self.planned_column_names = column_names
+        self.on_ddl_committed()
@@ -0,0 +1,231 @@
+"""Per-bucket row counts and column checksums that MySQL, Redshift and Python all
+compute the same way, so a source table and its replica in Redshift can be compared
+bucket by bucket instead of with a single `COUNT(*)`.
+
+Every column is folded into an exact integer/decimal sum that does not depend on the
+order of the rows: numbers are summed as is, booleans as 0/1, dates and timestamps as
+days/seconds since 1970 and strings as the first 8 hex digits of their MD5. NULLs are
+skipped by SUM on both sides. Rows are bucketed by 1 column: by month for a date or
+timestamp column (i.e. the partition), by `num_buckets` hash/modulo ranges otherwise,
+so a mismatch points at the rows to look at, and a run can checksum only some of the
+buckets (`get_bucket_filter()`).
+"""
+
+import math
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# DATA_TYPE in `information_schema.columns` of MySQL and Redshift
+COLUMN_KINDS = {
+    "mysql": {
+        "tinyint": "number",  # `boolean` is tinyint(1), see `get_column_kind()`
+        "smallint": "number",
+        "mediumint": "number",
+        "int": "number",
+        "bigint": "number",
+        "decimal": "number",
+        "float": "float",
+        "double": "float",
+        "date": "date",
+        "datetime": "timestamp",
+        "timestamp": "timestamp",
+    },
+    "redshift": {
+        "smallint": "number",
+        "integer": "number",
+        "bigint": "number",
+        "numeric": "number",
+        "boolean": "boolean",
+        "real": "float",
+        "double precision": "float",
+        "date": "date",
+        "timestamp without time zone": "timestamp",
+        "timestamp with time zone": "timestamp",
+    },
+}
+SUM_EXPRESSIONS = {  # every other kind is checksummed as a string
+    "mysql": {
+        "number": "SUM({column})",
+        "boolean": "SUM({column})",
+        "float": "ROUND(SUM({column}), 6)",
+        "date": "SUM(DATEDIFF({column}, '1970-01-01'))",
+        "timestamp": "SUM(TIMESTAMPDIFF(SECOND, '1970-01-01', {column}))",
+        "string": "SUM(CAST(CONV(SUBSTRING(MD5({column}), 1, 8), 16, 10) AS UNSIGNED))",
+    },
+    "redshift": {
+        "number": "SUM({column})",
+        "boolean": "SUM(CASE WHEN {column} THEN 1 ELSE 0 END)",
+        "float": "ROUND(SUM({column}), 6)",
+        "date": "SUM(DATEDIFF(day, '1970-01-01', {column}))",
+        "timestamp": "SUM(DATEDIFF(second, '1970-01-01', {column}))",
+        "string": (
+            "SUM(CAST(STRTOL(SUBSTRING(MD5({column}), 1, 8), 16) AS DECIMAL(38, 0)))"
+        ),
+    },
+}
+BUCKET_EXPRESSIONS = {
+    "mysql": {
+        "number": "MOD(CAST(FLOOR({column}) AS SIGNED), {num_buckets})",
+        "boolean": "CAST({column} AS SIGNED)",
+        "date": "DATE_FORMAT({column}, '%Y-%m')",
+        "timestamp": "DATE_FORMAT({column}, '%Y-%m')",
+        "string": (
+            "MOD(CAST(CONV(SUBSTRING(MD5({column}), 1, 8), 16, 10) AS UNSIGNED), "
+            "{num_buckets})"
+        ),
+    },
+    "redshift": {
+        "number": "MOD(CAST(FLOOR({column}) AS BIGINT), {num_buckets})",
+        "boolean": "CASE WHEN {column} THEN 1 ELSE 0 END",
+        "date": "TO_CHAR({column}, 'YYYY-MM')",
+        "timestamp": "TO_CHAR({column}, 'YYYY-MM')",
+        "string": "MOD(STRTOL(SUBSTRING(MD5({column}), 1, 8), 16), {num_buckets})",
+    },
+}
+IDENTIFIER_QUOTES = {"mysql": "`", "redshift": '"'}  # e.g. a column named `date`
+BucketChecksums = Dict[str, Tuple[Decimal, ...]]  # bucket -> (rows, column sums...)
+NULL_BUCKET = "None"  # `str()` of the bucket of the rows whose bucket column is NULL
+
+
+def get_column_kind(dialect: str, data_type: str, column_type: str = "") -> str:
+    """`column_type` is MySQL's COLUMN_TYPE, e.g. "tinyint(1)" for a boolean"""
+    if dialect == "mysql" and column_type.lower() == "tinyint(1)":
+        return "boolean"
+    return COLUMN_KINDS[dialect].get(data_type.lower(), "string")
+
+
+def get_bucket_expression(
+    dialect: str, bucket_column: str, bucket_kind: str, num_buckets: int
+) -> str:
+    """The float kind is bucketed as a number"""
+    quote = IDENTIFIER_QUOTES[dialect]
+    return BUCKET_EXPRESSIONS[dialect][
+        "number" if bucket_kind == "float" else bucket_kind
+    ].format(column=f"{quote}{bucket_column}{quote}", num_buckets=num_buckets)
+
+
+def get_bucket_checksums_sql_statement(
+    dialect: str,
+    table: str,
+    column_kinds: Dict[str, str],
+    bucket_column: Optional[str],
+    num_buckets: int,
+    where: Optional[str] = None,
+) -> str:
+    """1 row per bucket: bucket, number of rows, then 1 sum per column of `column_kinds`
+    (in that order). `where` (see `get_bucket_filter()`) limits it to some buckets."""
+    quote = IDENTIFIER_QUOTES[dialect]
+    if bucket_column is None:
+        bucket_expression = "'all'"
+    else:
+        bucket_expression = get_bucket_expression(
+            dialect=dialect,
+            bucket_column=bucket_column,
+            bucket_kind=column_kinds[bucket_column],
+            num_buckets=num_buckets,
+        )
+    sql_statement = (
+        "SELECT {bucket_expression}, COUNT(*), {sums} FROM {table}{where} GROUP BY 1;"
+    )
+    return sql_statement.format(
+        bucket_expression=bucket_expression,
+        sums=", ".join(
+            SUM_EXPRESSIONS[dialect][kind].format(column=f"{quote}{column}{quote}")
+            for column, kind in column_kinds.items()
+        ),
+        table=table,
+        where="" if where is None else f" WHERE {where}",
+    )
+
+
+def get_bucket_filter(
+    dialect: str,
+    bucket_column: str,
+    bucket_kind: str,
+    num_buckets: int,
+    buckets: List[str],
+    since_bucket: Optional[str] = None,
+) -> str:
+    """SQL condition for the rows of `buckets`, and for month buckets also of every
+    bucket from `since_bucket` on. Month buckets are date ranges, so an index on the
+    bucket column is used."""
+    quote = IDENTIFIER_QUOTES[dialect]
+    column = f"{quote}{bucket_column}{quote}"
+    conditions = []
+    if NULL_BUCKET in buckets:
+        conditions.append(f"{column} IS NULL")
+    buckets = [bucket for bucket in buckets if bucket != NULL_BUCKET]
+    if bucket_kind in ["date", "timestamp"]:
+        if since_bucket is not None:
+            conditions.append(f"{column} >= '{since_bucket}-01'")
+        for bucket in buckets:
+            year, month = (int(part) for part in bucket.split("-"))
+            next_bucket = f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+            conditions.append(
+                f"({column} >= '{bucket}-01' AND {column} < '{next_bucket}-01')"
+            )
+    elif buckets:
+        conditions.append(
+            "{} IN ({})".format(
+                get_bucket_expression(
+                    dialect=dialect,
+                    bucket_column=bucket_column,
+                    bucket_kind=bucket_kind,
+                    num_buckets=num_buckets,
+                ),
+                ", ".join(str(int(bucket)) for bucket in buckets),
+            )
+        )
+    return " OR ".join(conditions) or "1 = 0"
+
+
+def to_decimal(value) -> Optional[Decimal]:
+    return None if value is None else Decimal(str(value))
+
+
+def parse_mysql_rows(rows: Iterable[tuple]) -> BucketChecksums:
+    return {str(row[0]): tuple(to_decimal(value) for value in row[1:]) for row in rows}
+
+
+def parse_redshift_field(field: dict):
+    """A field of `get_statement_result()`; numeric sums come back as `stringValue`"""
+    if field.get("isNull"):
+        return None
+    if "booleanValue" in field:
+        return int(field["booleanValue"])
+    return next(iter(field.values()))
+
+
+def parse_redshift_records(records: Iterable[List[dict]]) -> BucketChecksums:
+    return parse_mysql_rows(
+        [parse_redshift_field(field) for field in record] for record in records
+    )
+
+
+def values_match(source_value, target_value, kind: str) -> bool:
+    if source_value is None or target_value is None:
+        return source_value is None and target_value is None
+    if kind == "float":  # float sums depend on the order of the additions
+        return math.isclose(source_value, target_value, rel_tol=1e-9, abs_tol=1e-6)
+    return source_value == target_value
+
+
+def get_mismatched_buckets(
+    source_checksums: BucketChecksums,
+    target_checksums: BucketChecksums,
+    kinds: List[str],
+) -> List[str]:
+    """Buckets that are missing on either side or that differ in any value.
+    `kinds` is the kind of each value after the row count."""
+    return sorted(
+        bucket
+        for bucket in source_checksums.keys() | target_checksums.keys()
+        if bucket not in source_checksums
+        or bucket not in target_checksums
+        or not all(
+            values_match(source_value, target_value, kind)
+            for source_value, target_value, kind in zip(
+                source_checksums[bucket], target_checksums[bucket], ["number", *kinds]
+            )
+        )
+    )
@@ -0,0 +1,510 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import boto3
+from bucket_checksums import (
+    get_bucket_checksums_sql_statement,
+    get_bucket_filter,
+    get_column_kind,
+    parse_mysql_rows,
+    parse_redshift_field,
+    parse_redshift_records,
+)
+from incremental_checksums import IncrementalBucketChecksums
+from lambda_metrics import metrics  # from shared Lambda layer
+from mysql_connection_manager import MySQLConnectionManager  # from shared Lambda layer
+from redshift_data_executor import (  # from shared Lambda layer
+    RedshiftDataExecutor,
+    RedshiftStatementError,
+)
+
+RECONCILIATION_NUM_BUCKETS = int(os.environ["RECONCILIATION_NUM_BUCKETS"])
+# empty means all rows are in 1 bucket
+RECONCILIATION_RDS_BUCKET_COLUMN = (
+    os.environ["RECONCILIATION_RDS_BUCKET_COLUMN"] or None
+)
+RECONCILIATION_HEARTBEAT_TABLE_NAME = os.environ["RECONCILIATION_HEARTBEAT_TABLE_NAME"]
+RECONCILIATION_SAMPLE_BUCKETS_PER_RUN = int(
+    os.environ["RECONCILIATION_SAMPLE_BUCKETS_PER_RUN"]
+)
+# the DynamoDB table is sampled 1 scan segment at a time, not scanned every run
+RECONCILIATION_DYNAMODB_SCAN_SEGMENTS = int(
+    os.environ["RECONCILIATION_DYNAMODB_SCAN_SEGMENTS"]
+)
+RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN = int(
+    os.environ["RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN"]
+)
+# for changes that reach Redshift after later ones, e.g. from a backlog
+RECONCILIATION_LOOKBACK_IN_MINUTES = int(
+    os.environ["RECONCILIATION_LOOKBACK_IN_MINUTES"]
+)
+RECONCILIATION_STATE_FOLDER = os.environ["RECONCILIATION_STATE_FOLDER"]
+HEARTBEAT_RETENTION_IN_MILLISECONDS = 24 * 60 * 60 * 1000
+BATCH_GET_ITEM_MAX_KEYS = 100
+REDSHIFT_IDS_PER_STATEMENT = 1000  # well within the 100 KB of a Data API statement
+REDSHIFT_CONCURRENT_STATEMENTS = 10
+
+RDS_HOST = os.environ["RDS_HOST"]
+RDS_USER = os.environ["RDS_USER"]
+RDS_PASSWORD = os.environ["RDS_PASSWORD"]
+RDS_DATABASE_NAME = os.environ["RDS_DATABASE_NAME"]
+RDS_TABLE_NAME = os.environ["RDS_TABLE_NAME"]
+# module level, so the connection is reused across warm invocations
+mysql_connection_manager = MySQLConnectionManager(
+    host=RDS_HOST,
+    user=RDS_USER,
+    passwd=RDS_PASSWORD,
+    db=RDS_DATABASE_NAME,
+    connect_timeout=5,
+)
+
+DYNAMODB_TABLE_NAME = os.environ["DYNAMODB_TABLE_NAME"]
+dynamodb_client = boto3.client("dynamodb")
+metrics.count_requests(dynamodb_client, name="DynamoDBRequests")
+S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT = os.environ[
+    "S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT"
+]
+UNPROCESSED_DYNAMODB_STREAM_FOLDER = os.environ["UNPROCESSED_DYNAMODB_STREAM_FOLDER"]
+s3_client = boto3.client("s3")
+metrics.count_requests(s3_client, name="S3Requests")
+
+# aws_redshift.CfnCluster(...).attr_id (for cluster name) is broken, so using endpoint address instead
+REDSHIFT_CLUSTER_NAME = os.environ["REDSHIFT_ENDPOINT_ADDRESS"].split(".")[0]
+REDSHIFT_USER = os.environ["REDSHIFT_USER"]
+REDSHIFT_DATABASE_NAME = os.environ["REDSHIFT_DATABASE_NAME"]
+REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC = os.environ[
+    "REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC"
+]
+REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC = os.environ[
+    "REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC"
+]
+redshift_data_executor = RedshiftDataExecutor(
+    cluster_identifier=REDSHIFT_CLUSTER_NAME,
+    database=REDSHIFT_DATABASE_NAME,
+    db_user=REDSHIFT_USER,
+)
+
+
+def read_state(name: str) -> Optional[dict]:
+    """`name` is e.g. "rds_to_redshift.json"; None before the 1st run"""
+    try:
+        return json.loads(
+            s3_client.get_object(
+                Bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
+                Key=f"{RECONCILIATION_STATE_FOLDER}/{name}",
+            )["Body"].read()
+        )
+    except s3_client.exceptions.NoSuchKey:
+        return None
+
+
+def write_state(name: str, state: dict) -> None:
+    s3_client.put_object(
+        Bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
+        Key=f"{RECONCILIATION_STATE_FOLDER}/{name}",
+        Body=json.dumps(state).encode(),
+    )
+
+
+def get_redshift_column_kinds(table_name: str) -> dict:
+    """DMS writes the RDS tables into the Redshift schema named after the RDS database"""
+    response = redshift_data_executor.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        f"WHERE table_schema = '{RDS_DATABASE_NAME}' AND table_name = '{table_name}';"
+    )
+    return {
+        record[0]["stringValue"]: get_column_kind(
+            dialect="redshift", data_type=record[1]["stringValue"]
+        )
+        for record in redshift_data_executor.get_records(statement_id=response["Id"])
+    }
+
+
+def get_rds_column_kinds(cursor, table_name: str) -> dict:
+    cursor.execute(
+        "SELECT column_name, data_type, column_type FROM information_schema.columns "
+        "WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position;",
+        (RDS_DATABASE_NAME, table_name),
+    )
+    return {
+        column_name.lower(): get_column_kind(
+            dialect="mysql", data_type=data_type, column_type=column_type
+        )
+        for column_name, data_type, column_type in cursor.fetchall()
+    }
+
+
+def measure_dms_replication_lag(cursor, redshift_statement_id: str) -> None:
+    """The heartbeat table is replicated by DMS like any other table. The age of the
+    oldest heartbeat that has not reached Redshift yet is the replication lag, so
+    its resolution is the schedule rate of this Lambda. Then a new heartbeat is
+    written for the next run."""
+    now_in_milliseconds = int(time.time() * 1000)
+    try:
+        redshift_data_executor.wait([redshift_statement_id])
+        redshift_heartbeat_field = redshift_data_executor.get_records(
+            statement_id=redshift_statement_id
+        )[0][0]
+    except RedshiftStatementError as error:  # e.g. DMS has not created the table yet
+        print(f"Cannot read the heartbeat table from Redshift: {error}")
+    else:
+        cursor.execute(
+            f"SELECT MIN(beat_at_ms) FROM {RECONCILIATION_HEARTBEAT_TABLE_NAME} "
+            "WHERE beat_at_ms > %s;",
+            (parse_redshift_field(redshift_heartbeat_field) or 0,),
+        )
+        oldest_unreplicated_heartbeat_in_milliseconds = cursor.fetchone()[0]
+        replication_lag_in_seconds = (
+            0
+            if oldest_unreplicated_heartbeat_in_milliseconds is None
+            else (now_in_milliseconds - oldest_unreplicated_heartbeat_in_milliseconds)
+            / 1000
+        )
+        metrics.add("DMSReplicationLag", replication_lag_in_seconds, unit="Seconds")
+        print(f"DMS replication lag is {replication_lag_in_seconds} seconds.")
+    cursor.execute(
+        f"INSERT INTO {RECONCILIATION_HEARTBEAT_TABLE_NAME} (beat_at_ms) VALUES (%s);",
+        (now_in_milliseconds,),
+    )
+    cursor.execute(
+        f"DELETE FROM {RECONCILIATION_HEARTBEAT_TABLE_NAME} WHERE beat_at_ms < %s;",
+        (now_in_milliseconds - HEARTBEAT_RETENTION_IN_MILLISECONDS,),
+    )
+    cursor.connection.commit()
+
+
+def report_mismatched_buckets(
+    path: str, mismatched_buckets: List[str], num_buckets: int
+) -> None:
+    metrics.add(f"{path}MismatchedBuckets", len(mismatched_buckets))
+    metrics.add(f"{path}Buckets", num_buckets)
+    if mismatched_buckets:
+        print(f"{path} buckets that do not match: {mismatched_buckets}")
+
+
+@metrics.timed("ReconcileRDSToRedshift")
+def reconcile_rds_to_redshift() -> None:
+    """Both sides are queried at the same time: the Redshift statements are submitted
+    first and polled only after the MySQL queries have returned. Only the buckets
+    that may have changed since the last run are checksummed (see
+    `IncrementalBucketChecksums`), the others are taken from the state object."""
+    redshift_table = f"{REDSHIFT_DATABASE_NAME}.{RDS_DATABASE_NAME}.{RDS_TABLE_NAME}"
+    redshift_heartbeat_statement_id = redshift_data_executor.submit(
+        f"SELECT MAX(beat_at_ms) FROM {REDSHIFT_DATABASE_NAME}.{RDS_DATABASE_NAME}."
+        f"{RECONCILIATION_HEARTBEAT_TABLE_NAME};"
+    )
+    redshift_column_kinds = get_redshift_column_kinds(table_name=RDS_TABLE_NAME)
+    conn = mysql_connection_manager.get_connection()
+    try:
+        with conn.cursor() as cursor:
+            mysql_connection_manager.ensure_ddl(
+                cursor,
+                f"CREATE TABLE if not exists {RECONCILIATION_HEARTBEAT_TABLE_NAME} "
+                "(id bigint AUTO_INCREMENT PRIMARY KEY, beat_at_ms bigint NOT NULL);",
+            )
+            rds_column_kinds = get_rds_column_kinds(cursor, table_name=RDS_TABLE_NAME)
+            missing_columns = rds_column_kinds.keys() - redshift_column_kinds.keys()
+            metrics.add("RDSToRedshiftMissingColumns", len(missing_columns))
+            if missing_columns:
+                print(f"Columns not in Redshift (yet): {sorted(missing_columns)}")
+            column_kinds = {
+                column: kind
+                for column, kind in rds_column_kinds.items()
+                if column not in missing_columns
+            }
+            if column_kinds and (
+                RECONCILIATION_RDS_BUCKET_COLUMN is None
+                or RECONCILIATION_RDS_BUCKET_COLUMN in column_kinds
+            ):
+                incremental_checksums = IncrementalBucketChecksums(
+                    state=read_state("rds_to_redshift.json"),
+                    columns=list(column_kinds),
+                    bucket_kind=column_kinds.get(RECONCILIATION_RDS_BUCKET_COLUMN),
+                    num_buckets=RECONCILIATION_NUM_BUCKETS,
+                    num_sample_buckets=RECONCILIATION_SAMPLE_BUCKETS_PER_RUN,
+                )
+                buckets, since_bucket = incremental_checksums.plan()
+                checksums_sql_statements = {
+                    dialect: get_bucket_checksums_sql_statement(
+                        dialect=dialect,
+                        table=table,
+                        column_kinds=dialect_column_kinds,
+                        bucket_column=RECONCILIATION_RDS_BUCKET_COLUMN,
+                        num_buckets=RECONCILIATION_NUM_BUCKETS,
+                        where=(
+                            None
+                            if buckets is None
+                            else get_bucket_filter(
+                                dialect=dialect,
+                                bucket_column=RECONCILIATION_RDS_BUCKET_COLUMN,
+                                bucket_kind=dialect_column_kinds[
+                                    RECONCILIATION_RDS_BUCKET_COLUMN
+                                ],
+                                num_buckets=RECONCILIATION_NUM_BUCKETS,
+                                buckets=buckets,
+                                since_bucket=since_bucket,
+                            )
+                        ),
+                    )
+                    for dialect, table, dialect_column_kinds in [
+                        ("mysql", RDS_TABLE_NAME, column_kinds),
+                        (
+                            "redshift",
+                            redshift_table,
+                            {
+                                column: redshift_column_kinds[column]
+                                for column in column_kinds
+                            },
+                        ),
+                    ]
+                }
+                redshift_checksums_statement_id = redshift_data_executor.submit(
+                    checksums_sql_statements["redshift"]
+                )
+                with metrics.timer("RDSChecksums"):
+                    cursor.execute(checksums_sql_statements["mysql"])
+                    rds_checksums = parse_mysql_rows(cursor.fetchall())
+                redshift_data_executor.wait([redshift_checksums_statement_id])
+                redshift_checksums = parse_redshift_records(
+                    redshift_data_executor.get_records(
+                        statement_id=redshift_checksums_statement_id
+                    )
+                )
+                mismatched_buckets = incremental_checksums.update(
+                    source_checksums=rds_checksums,
+                    target_checksums=redshift_checksums,
+                    kinds=list(column_kinds.values()),
+                )
+                write_state("rds_to_redshift.json", incremental_checksums.state)
+                metrics.add("RDSRows", incremental_checksums.get_num_rows("source"))
+                metrics.add(
+                    "RDSToRedshiftRows", incremental_checksums.get_num_rows("target")
+                )
+                metrics.add(
+                    "RDSToRedshiftCheckedBuckets",
+                    len(rds_checksums.keys() | redshift_checksums.keys()),
+                )
+                report_mismatched_buckets(
+                    path="RDSToRedshift",
+                    mismatched_buckets=mismatched_buckets,
+                    num_buckets=incremental_checksums.get_num_buckets(),
+                )
+            else:
+                print(
+                    f"Redshift table `{redshift_table}` is not replicated yet, "
+                    "so there is nothing to compare."
+                )
+            measure_dms_replication_lag(
+                cursor, redshift_statement_id=redshift_heartbeat_statement_id
+            )
+    except Exception:
+        mysql_connection_manager.discard_connection()
+        raise
+
+
+def measure_dynamodb_stream_backlog() -> None:
+    """S3 lists keys in order and the unprocessed files are partitioned by time, so
+    the 1st key is (1 of) the oldest file that the loader has not loaded yet"""
+    response = s3_client.list_objects_v2(
+        Bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
+        Prefix=f"{UNPROCESSED_DYNAMODB_STREAM_FOLDER}/",
+        MaxKeys=1,
+    )
+    backlog_age_in_seconds = (
+        (
+            datetime.now(timezone.utc) - response["Contents"][0]["LastModified"]
+        ).total_seconds()
+        if response.get("Contents")
+        else 0
+    )
+    metrics.add("DynamoDBStreamBacklogAge", backlog_age_in_seconds, unit="Seconds")
+    print(
+        f"Oldest unloaded DynamoDB stream file is {backlog_age_in_seconds} seconds old."
+    )
+
+
+def get_latest_redshift_images_sql_statement(redshift_table: str, where: str) -> str:
+    """id, operation and event time of the latest image of every id that has a row
+    matching `where`. In "append" mode every change of an item is 1 more row."""
+    return f"""SELECT id, _cdc_op, TO_CHAR(_cdc_event_time, 'YYYY-MM-DD HH24:MI:SS') FROM (
+            SELECT id, _cdc_op, _cdc_event_time, ROW_NUMBER() OVER (
+                PARTITION BY id ORDER BY _cdc_sequence_number DESC NULLS LAST
+            ) AS image_number
+            FROM {redshift_table}
+            WHERE id IN (SELECT id FROM {redshift_table} WHERE {where})
+        )
+        WHERE image_number = 1;"""
+
+
+def get_existing_dynamodb_keys(keys: List[str]) -> set:
+    existing_keys = set()
+    for i in range(0, len(keys), BATCH_GET_ITEM_MAX_KEYS):
+        request_items = {
+            DYNAMODB_TABLE_NAME: {
+                "Keys": [
+                    {"id": {"S": key}} for key in keys[i : i + BATCH_GET_ITEM_MAX_KEYS]
+                ],
+                "ProjectionExpression": "id",
+            }
+        }
+        while request_items:
+            response = dynamodb_client.batch_get_item(RequestItems=request_items)
+            existing_keys.update(
+                item["id"]["S"]
+                for item in response["Responses"].get(DYNAMODB_TABLE_NAME, [])
+            )
+            request_items = response.get("UnprocessedKeys")
+    return existing_keys
+
+
+def check_changed_dynamodb_ids(redshift_table: str, state: dict) -> None:
+    """The ids that changed in Redshift since the last run (by their CDC event time)
+    should exist in DynamoDB, unless their latest image is a REMOVE"""
+    since = (
+        datetime.fromisoformat(state["watermark"])
+        if state["watermark"] is not None
+        else datetime.now(timezone.utc).replace(tzinfo=None)
+    ) - timedelta(minutes=RECONCILIATION_LOOKBACK_IN_MINUTES)
+    response = redshift_data_executor.execute(
+        get_latest_redshift_images_sql_statement(
+            redshift_table=redshift_table,
+            where=f"_cdc_event_time > '{since.isoformat(sep=' ', timespec='seconds')}'",
+        )
+    )
+    records = [
+        [parse_redshift_field(field) for field in record]
+        for record in redshift_data_executor.get_records(statement_id=response["Id"])
+    ]
+    with metrics.timer("DynamoDBBatchGetItem"):
+        existing_keys = get_existing_dynamodb_keys([key for key, _, _ in records])
+    mismatched_ids = sorted(
+        key
+        for key, operation, _ in records
+        if (key in existing_keys) == (operation == "REMOVE")
+    )
+    metrics.add("DynamoDBToRedshiftChangedIds", len(records))
+    metrics.add("DynamoDBToRedshiftMismatchedIds", len(mismatched_ids))
+    if mismatched_ids:
+        print(
+            f"Changed ids whose latest Redshift image does not match DynamoDB: {mismatched_ids}"
+        )
+    state["watermark"] = max(
+        [event_time for _, _, event_time in records if event_time is not None],
+        default=state["watermark"] or since.isoformat(sep=" ", timespec="seconds"),
+    )
+
+
+def scan_dynamodb_keys(segment: int) -> List[str]:
+    keys = []
+    kwargs = {
+        "TableName": DYNAMODB_TABLE_NAME,
+        "ProjectionExpression": "id",
+        "Segment": segment,
+        "TotalSegments": RECONCILIATION_DYNAMODB_SCAN_SEGMENTS,
+    }
+    while True:
+        response = dynamodb_client.scan(**kwargs)
+        keys.extend(item["id"]["S"] for item in response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return keys
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def check_sampled_dynamodb_ids(redshift_table: str, state: dict) -> None:
+    """Every item of the next `RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN` scan segments
+    should have a live latest image in Redshift, so the whole table is checked once
+    every `RECONCILIATION_DYNAMODB_SCAN_SEGMENTS` / `RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN`
+    runs"""
+    segments = [
+        (state["next_segment"] + i) % RECONCILIATION_DYNAMODB_SCAN_SEGMENTS
+        for i in range(RECONCILIATION_DYNAMODB_SEGMENTS_PER_RUN)
+    ]
+    with metrics.timer("DynamoDBScan"):
+        with ThreadPoolExecutor(max_workers=len(segments)) as thread_pool:
+            keys = [
+                key
+                for keys in thread_pool.map(scan_dynamodb_keys, segments)
+                for key in keys
+            ]
+    live_keys = set()
+    sql_statements = [
+        get_latest_redshift_images_sql_statement(
+            redshift_table=redshift_table,
+            where="id IN ({})".format(
+                ", ".join(
+                    "'{}'".format(key.replace("'", "''"))
+                    for key in keys[i : i + REDSHIFT_IDS_PER_STATEMENT]
+                )
+            ),
+        )
+        for i in range(0, len(keys), REDSHIFT_IDS_PER_STATEMENT)
+    ]
+    for i in range(0, len(sql_statements), REDSHIFT_CONCURRENT_STATEMENTS):
+        for response in redshift_data_executor.execute_concurrently(
+            [sql_statement]
+            for sql_statement in sql_statements[i : i + REDSHIFT_CONCURRENT_STATEMENTS]
+        ):
+            live_keys.update(
+                record[0]["stringValue"]
+                for record in redshift_data_executor.get_records(
+                    statement_id=response["Id"]
+                )
+                if parse_redshift_field(record[1]) != "REMOVE"
+            )
+    missing_ids = sorted(set(keys) - live_keys)
+    metrics.add("DynamoDBSampledItems", len(keys))
+    metrics.add("DynamoDBToRedshiftMissingIds", len(missing_ids))
+    if missing_ids:
+        print(f"Sampled DynamoDB ids that are not in Redshift: {missing_ids}")
+    state["next_segment"] = (segments[-1] + 1) % RECONCILIATION_DYNAMODB_SCAN_SEGMENTS
+
+
+@metrics.timed("ReconcileDynamoDBToRedshift")
+def reconcile_dynamodb_to_redshift() -> None:
+    """Instead of scanning the whole table every run, the ids that changed since the
+    last run are checked against DynamoDB and a rotating sample of DynamoDB is checked
+    against Redshift. The watermark and the next segment are kept in a state object."""
+    redshift_table = (
+        f"{REDSHIFT_DATABASE_NAME}.{REDSHIFT_SCHEMA_NAME_FOR_DYNAMODB_CDC}."
+        f"{REDSHIFT_TABLE_NAME_FOR_DYNAMODB_CDC}"
+    )
+    redshift_num_rows_statement_id = redshift_data_executor.submit(
+        f"SELECT COUNT(*) FROM {redshift_table};"
+    )
+    state = read_state("dynamodb_to_redshift.json") or {
+        "watermark": None,
+        "next_segment": 0,
+    }
+    check_changed_dynamodb_ids(redshift_table=redshift_table, state=state)
+    check_sampled_dynamodb_ids(redshift_table=redshift_table, state=state)
+    write_state("dynamodb_to_redshift.json", state)
+    measure_dynamodb_stream_backlog()
+    # updated by DynamoDB about every 6 hours, but free
+    metrics.add(
+        "DynamoDBItems",
+        dynamodb_client.describe_table(TableName=DYNAMODB_TABLE_NAME)["Table"][
+            "ItemCount"
+        ],
+    )
+    redshift_data_executor.wait([redshift_num_rows_statement_id])
+    metrics.add(
+        "DynamoDBToRedshiftRows",
+        redshift_data_executor.get_records(statement_id=redshift_num_rows_statement_id)[
+            0
+        ][0]["longValue"],
+    )
+
+
+@metrics.instrument
+def lambda_handler(event, context):
+    with ThreadPoolExecutor(max_workers=2) as thread_pool:
+        futures = [
+            thread_pool.submit(reconcile_rds_to_redshift),
+            thread_pool.submit(reconcile_dynamodb_to_redshift),
+        ]
+    for future in futures:
+        future.result()  # re-raise
@@ -0,0 +1,144 @@
+"""Recompute the bucket checksums of a source table and its replica only where they
+may have changed, instead of over the whole table every run.
+
+The checksums of every bucket are kept in a small JSON state object with a watermark,
+the newest month bucket seen. Rows land in the newest months, so a run rechecks the
+buckets from the watermark on, every bucket that did not match last time (to see
+whether it caught up), and a rotating sample of `num_sample_buckets` older buckets,
+so a change to old rows is still found within a few runs. Hash/modulo buckets have
+no order to keep a watermark on, so they are only sampled (and rechecked while they
+do not match). Without a bucket column, or when the columns change, the whole table
+is checksummed again.
+"""
+
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+from bucket_checksums import NULL_BUCKET, BucketChecksums, get_mismatched_buckets
+
+
+def serialize_values(values: Optional[tuple]) -> Optional[List[Optional[str]]]:
+    if values is None:
+        return None
+    return [None if value is None else str(value) for value in values]
+
+
+class IncrementalBucketChecksums:
+    def __init__(
+        self,
+        state: Optional[dict],
+        columns: List[str],
+        bucket_kind: Optional[str],
+        num_buckets: int,
+        num_sample_buckets: int,
+    ) -> None:
+        """`bucket_kind` is the kind of the bucket column (see `get_column_kind()`),
+        None if there is none"""
+        if state is None or state["columns"] != columns:
+            state = {
+                "columns": columns,
+                "watermark": None,
+                "next_sample": 0,
+                "checksums": {},
+            }
+        self.state = state
+        self.bucket_kind = bucket_kind
+        self.num_buckets = num_buckets
+        self.num_sample_buckets = num_sample_buckets
+        self.buckets: Optional[List[str]] = None
+        self.since_bucket: Optional[str] = None
+
+    @property
+    def has_months(self) -> bool:
+        return self.bucket_kind in ["date", "timestamp"]
+
+    def plan(self) -> Tuple[Optional[List[str]], Optional[str]]:
+        """(buckets to recheck, bucket from which on all buckets are rechecked), or
+        (None, None) to recheck the whole table"""
+        checksums = self.state["checksums"]
+        if self.bucket_kind is None or not checksums:
+            self.buckets = self.since_bucket = None
+            return self.buckets, self.since_bucket
+        mismatched_buckets = {
+            bucket for bucket, checksum in checksums.items() if not checksum["matches"]
+        }
+        if self.has_months:
+            self.since_bucket = self.state["watermark"]
+            candidate_buckets = sorted(
+                bucket
+                for bucket in checksums
+                if self.since_bucket is None
+                or bucket == NULL_BUCKET
+                or bucket < self.since_bucket
+            )
+        else:
+            candidate_buckets = [str(bucket) for bucket in range(self.num_buckets)]
+            if NULL_BUCKET in checksums:
+                candidate_buckets.append(NULL_BUCKET)
+        candidate_buckets = [
+            bucket for bucket in candidate_buckets if bucket not in mismatched_buckets
+        ]
+        sample_buckets = []
+        if candidate_buckets:
+            start = self.state["next_sample"] % len(candidate_buckets)
+            sample_buckets = (candidate_buckets * 2)[
+                start : start + min(self.num_sample_buckets, len(candidate_buckets))
+            ]
+            self.state["next_sample"] = start + len(sample_buckets)
+        self.buckets = sorted(mismatched_buckets | set(sample_buckets))
+        return self.buckets, self.since_bucket
+
+    def is_rechecked(self, bucket: str) -> bool:
+        return (
+            self.buckets is None
+            or bucket in self.buckets
+            or (
+                self.since_bucket is not None
+                and bucket != NULL_BUCKET
+                and bucket >= self.since_bucket
+            )
+        )
+
+    def update(
+        self,
+        source_checksums: BucketChecksums,
+        target_checksums: BucketChecksums,
+        kinds: List[str],
+    ) -> List[str]:
+        """Takes the checksums of the planned buckets; returns the mismatched ones"""
+        mismatched_buckets = get_mismatched_buckets(
+            source_checksums=source_checksums,
+            target_checksums=target_checksums,
+            kinds=kinds,
+        )
+        checksums = {
+            bucket: checksum
+            for bucket, checksum in self.state["checksums"].items()
+            if not self.is_rechecked(bucket)
+        }
+        for bucket in source_checksums.keys() | target_checksums.keys():
+            checksums[bucket] = {
+                "source": serialize_values(source_checksums.get(bucket)),
+                "target": serialize_values(target_checksums.get(bucket)),
+                "matches": bucket not in mismatched_buckets,
+            }
+        self.state["checksums"] = checksums
+        if self.has_months:
+            self.state["watermark"] = max(
+                (bucket for bucket in checksums if bucket != NULL_BUCKET), default=None
+            )
+        return mismatched_buckets
+
+    def get_num_rows(self, side: str) -> int:
+        """Of all buckets, as of when each was last checked. `side` is "source" or
+        "target"."""
+        return int(
+            sum(
+                Decimal(checksum[side][0])
+                for checksum in self.state["checksums"].values()
+                if checksum[side] is not None
+            )
+        )
+
+    def get_num_buckets(self) -> int:
+        return len(self.state["checksums"])
@@ -0,0 +1,137 @@
+"""Per-invocation metrics of the Lambdas in CloudWatch Embedded Metric Format (EMF).
+
+Counters and stage timers only update a dict in memory. `flush()` prints all of them
+as 1 JSON line per invocation, which CloudWatch Logs turns into metrics without any
+PutMetricData call. The line also carries the request ID and X-Ray trace ID, so a
+slow invocation can be found in Logs Insights. With `METRICS_SINK` set to "none"
+(the default outside of Lambda), nothing is printed.
+
+Use the module level `metrics`, so the handler and the modules it calls share it:
+    @metrics.instrument
+    def lambda_handler(event, context):
+        with metrics.timer("Copy"):  # CopyDuration in milliseconds
+            ...
+        metrics.add("RecordsIn", len(records))
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_SINKS = ["emf", "none"]
+
+
+class MetricsLogger:
+    def __init__(self, namespace: str, function_name: str, sink: str = "emf") -> None:
+        if sink not in METRICS_SINKS:
+            raise ValueError(f'`METRICS_SINK` should be "emf" or "none", not "{sink}"')
+        self.namespace = namespace
+        self.function_name = function_name  # the only dimension
+        self.sink = sink
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+        # the Redshift loader updates counters from its S3 promotion threads
+        self.lock = threading.Lock()
+
+    def add(self, name: str, value: float = 1, unit: str = "Count") -> None:
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Adds the milliseconds spent in the block to `{stage}Duration`"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(
+                f"{stage}Duration",
+                (time.perf_counter() - start_time) * 1000,
+                unit="Milliseconds",
+            )
+
+    def timed(self, stage: str):
+        """Decorator version of `timer()`"""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def set_property(self, name: str, value) -> None:
+        """Searchable in Logs Insights, but not a metric"""
+        self.properties[name] = value
+
+    def count_requests(self, boto3_client, name: str) -> None:
+        """Adds 1 to `name` per API call of the client, e.g. every S3 request"""
+        boto3_client.meta.events.register(
+            "before-call", lambda **kwargs: self.add(name)  # returns None, so no effect
+        )
+
+    def instrument(self, lambda_handler):
+        """Times the whole invocation, counts errors and flushes at the end"""
+
+        @functools.wraps(lambda_handler)
+        def wrapper(event, context):
+            self.set_property("RequestId", context.aws_request_id)
+            if "_X_AMZN_TRACE_ID" in os.environ:
+                self.set_property("TraceId", os.environ["_X_AMZN_TRACE_ID"])
+            try:
+                with self.timer("Handler"):
+                    return lambda_handler(event, context)
+            except Exception:
+                self.add("Errors")
+                raise
+            finally:
+                self.flush()
+
+        return wrapper
+
+    def flush(self) -> None:
+        with self.lock:
+            values, self.values = self.values, {}
+            units, self.units = self.units, {}
+            properties, self.properties = self.properties, {}
+        if self.sink == "none" or not values:
+            return
+        print(
+            json.dumps(
+                {
+                    "_aws": {
+                        "Timestamp": int(time.time() * 1000),
+                        "CloudWatchMetrics": [
+                            {
+                                "Namespace": self.namespace,
+                                "Dimensions": [["FunctionName"]],
+                                "Metrics": [
+                                    {"Name": name, "Unit": units[name]}
+                                    for name in values
+                                ],
+                            }
+                        ],
+                    },
+                    "FunctionName": self.function_name,
+                    **properties,
+                    **values,
+                }
+            )
+        )
+
+
+metrics = MetricsLogger(
+    namespace=os.environ.get("METRICS_NAMESPACE", "CDCToDataWarehouse"),
+    function_name=os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local"),
+    sink=os.environ.get(
+        "METRICS_SINK", "emf" if "AWS_LAMBDA_FUNCTION_NAME" in os.environ else "none"
+    ),
+)
@@ -0,0 +1,54 @@
+"""Keep 1 pymysql connection alive across warm Lambda invocations.
+
+Create the manager at module level so it lives as long as the Lambda container:
+warm invocations reuse the connection (after a cheap ping) instead of paying for a
+new TCP + TLS + auth handshake, and DDL that was already run is not sent again.
+"""
+
+import pymysql  # bundled with every Lambda that uses this module
+
+
+class MySQLConnectionManager:
+    def __init__(self, **connect_kwargs) -> None:
+        self.connect_kwargs = connect_kwargs  # passed as is to `pymysql.connect`
+        self.connection = None
+        self.ensured_ddl_sql_statements = set()
+        self.stats = {
+            "connection_hits": 0,
+            "connection_misses": 0,
+            "ddl_hits": 0,
+            "ddl_misses": 0,
+        }
+
+    def get_connection(self):
+        if self.connection is not None:
+            try:
+                self.connection.ping(reconnect=False)
+                self.stats["connection_hits"] += 1
+                return self.connection
+            except pymysql.err.Error:  # e.g. closed by the server after wait_timeout
+                self.discard_connection()
+        self.stats["connection_misses"] += 1
+        self.connection = pymysql.connect(**self.connect_kwargs)
+        return self.connection
+
+    def discard_connection(self) -> None:
+        """Call after an error so the next invocation starts with a clean connection"""
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except pymysql.err.Error:
+                pass
+        self.connection = None
+
+    def ensure_ddl(self, cursor, sql_statement: str) -> bool:
+        """Run idempotent DDL (e.g. CREATE TABLE if not exists) once per container.
+        Returns whether the statement was actually sent to MySQL."""
+        if sql_statement in self.ensured_ddl_sql_statements:
+            self.stats["ddl_hits"] += 1
+            return False
+        cursor.execute(sql_statement)
+        cursor.connection.commit()
+        self.ensured_ddl_sql_statements.add(sql_statement)
+        self.stats["ddl_misses"] += 1
+        return True
@@ -0,0 +1,166 @@
+"""Submit SQL statements through the Redshift Data API and wait for them to finish.
+
+Statements that must run in order are submitted together with `batch_execute_statement`
+(1 round trip, 1 transaction). Independent statements are submitted one after another
+without waiting, then all of their IDs are polled in the same loop, so they overlap
+on the cluster. Polling starts at a few milliseconds and backs off up to a cap, so fast
+statements are not charged a full second of sleeping.
+"""
+
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import boto3
+from lambda_metrics import metrics
+
+RUNNING_STATUSES = ("SUBMITTED", "PICKED", "STARTED")
+MAX_SQL_STATEMENTS_PER_BATCH = 40  # of `batch_execute_statement`
+# a load's ledger INSERTs are up to 100 KB each, too much to log on every run
+MAX_LOGGED_SQL_LENGTH = 200
+
+
+def shorten_sql_statement(sql_statement: str) -> str:
+    """On 1 line and at most `MAX_LOGGED_SQL_LENGTH` characters, for logs"""
+    sql_statement = " ".join(sql_statement.split())
+    if len(sql_statement) <= MAX_LOGGED_SQL_LENGTH:
+        return sql_statement
+    return (
+        f"{sql_statement[:MAX_LOGGED_SQL_LENGTH]}... "
+        f"({len(sql_statement)} characters)"
+    )
+
+
+class RedshiftStatementError(Exception):
+    """Raised when a Redshift Data API statement ends as FAILED or ABORTED"""
+
+    def __init__(self, response: dict) -> None:
+        self.response = response
+        super().__init__(
+            f'Redshift statement {response["Id"]} ended as {response["Status"]}: '
+            f'{response.get("Error", "no error message")}. '
+            f'SQL: {shorten_sql_statement(response.get("QueryString", ""))}'
+        )
+
+
+class RedshiftDataExecutor:
+    def __init__(
+        self,
+        cluster_identifier: str,
+        database: str,
+        db_user: str,
+        redshift_data_client=None,
+        initial_poll_interval_seconds: float = 0.02,
+        max_poll_interval_seconds: float = 1.0,
+        backoff_multiplier: float = 2.0,
+        timeout_seconds: Optional[float] = None,
+    ) -> None:
+        # boto3 clients are thread safe and this class keeps no per-call state,
+        # so 1 executor can be shared by a thread pool
+        self.redshift_data_client = redshift_data_client or boto3.client(
+            "redshift-data"
+        )
+        self.cluster_identifier = cluster_identifier
+        self.database = database
+        self.db_user = db_user
+        self.initial_poll_interval_seconds = initial_poll_interval_seconds
+        self.max_poll_interval_seconds = max_poll_interval_seconds
+        self.backoff_multiplier = backoff_multiplier
+        self.timeout_seconds = timeout_seconds
+
+    def submit(self, *sql_statements: str) -> str:
+        """Submit without waiting. Several statements run in order in 1 transaction."""
+        if not sql_statements:
+            raise ValueError("Need at least 1 SQL statement to submit")
+        if len(sql_statements) > MAX_SQL_STATEMENTS_PER_BATCH:
+            raise ValueError(
+                f"Cannot submit {len(sql_statements)} SQL statements in 1 batch, "
+                f"the Data API takes at most {MAX_SQL_STATEMENTS_PER_BATCH}"
+            )
+        connection_kwargs = {
+            "ClusterIdentifier": self.cluster_identifier,
+            "Database": self.database,
+            "DbUser": self.db_user,
+        }
+        if len(sql_statements) == 1:
+            response = self.redshift_data_client.execute_statement(
+                Sql=sql_statements[0], **connection_kwargs
+            )
+        else:
+            response = self.redshift_data_client.batch_execute_statement(
+                Sqls=list(sql_statements), **connection_kwargs
+            )
+        metrics.add("DataApiStatements")
+        return response["Id"]
+
+    def wait(self, statement_ids: Iterable[str]) -> Dict[str, dict]:
+        """Poll every in-flight statement in the same loop until all of them finish.
+        Returns the final `describe_statement` response of each statement ID."""
+        pending_statement_ids = list(dict.fromkeys(statement_ids))  # dedupe, keep order
+        finished_statements = {}
+        poll_interval_seconds = self.initial_poll_interval_seconds
+        start_time = time.monotonic()
+        while pending_statement_ids:
+            time.sleep(poll_interval_seconds)
+            still_pending_statement_ids = []
+            for statement_id in pending_statement_ids:
+                response = self.redshift_data_client.describe_statement(Id=statement_id)
+                metrics.add("DataApiPolls")
+                status = response["Status"]
+                if status == "FINISHED":
+                    finished_statements[statement_id] = response
+                elif status in RUNNING_STATUSES:
+                    still_pending_statement_ids.append(statement_id)
+                else:  # FAILED or ABORTED
+                    raise RedshiftStatementError(response)
+            pending_statement_ids = still_pending_statement_ids
+            if (
+                self.timeout_seconds is not None
+                and pending_statement_ids
+                and time.monotonic() - start_time > self.timeout_seconds
+            ):
+                raise TimeoutError(
+                    f"Redshift statements {pending_statement_ids} did not finish "
+                    f"within {self.timeout_seconds} seconds"
+                )
+            poll_interval_seconds = min(
+                poll_interval_seconds * self.backoff_multiplier,
+                self.max_poll_interval_seconds,
+            )
+        return finished_statements
+
+    def execute(self, *sql_statements: str) -> dict:
+        """Submit and wait. Several statements run in order in 1 transaction."""
+        statement_id = self.submit(*sql_statements)
+        response = self.wait([statement_id])[statement_id]
+        print(
+            f"Finished Redshift statement {statement_id} of {len(sql_statements)} "
+            f"SQL statement(s), starting with: {shorten_sql_statement(sql_statements[0])}"
+        )
+        return response
+
+    def execute_concurrently(
+        self, sql_statement_groups: Iterable[Sequence[str]]
+    ) -> List[dict]:
+        """Each group is submitted as 1 (batch) statement; the groups run independently
+        of each other. Returns the responses in the same order as the groups."""
+        sql_statement_groups = [tuple(group) for group in sql_statement_groups]
+        statement_ids = [self.submit(*group) for group in sql_statement_groups]
+        finished_statements = self.wait(statement_ids)
+        print(
+            f"Finished {len(statement_ids)} concurrent Redshift statements "
+            f"{statement_ids} of {sum(map(len, sql_statement_groups))} SQL "
+            "statement(s)"
+        )
+        return [finished_statements[statement_id] for statement_id in statement_ids]
+
+    def get_records(self, statement_id: str) -> List[list]:
+        """All result rows of a finished statement. For a batch statement, pass the
+        ID of the sub-statement, e.g. the `Id` in the `SubStatements` of `wait()`."""
+        records = []
+        kwargs = {"Id": statement_id}
+        while True:
+            response = self.redshift_data_client.get_statement_result(**kwargs)
+            records.extend(response["Records"])
+            if not response.get("NextToken"):
+                return records
+            kwargs["NextToken"] = response["NextToken"]
@@ -1,60 +1,166 @@
 import json
 import os
 import uuid
-from datetime import datetime
-from decimal import Decimal
+from typing import List
 
 import boto3
-from boto3.dynamodb.types import TypeDeserializer
+from dynamodb_image_decoder import encode_stream_record, get_key
+from lambda_metrics import metrics  # from shared Lambda layer
+from record_sinks import FirehoseSink, LocalFileBufferSink, S3ObjectSink
+from stream_attributes import StreamAttributeRegistry
+
+ATTRIBUTE_TYPES = {"int": int, "float": float, "str": str, "bool": bool}
 
-s3_bucket = boto3.resource("s3").Bucket(
-    os.environ["S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT"]
-)
 UNPROCESSED_DYNAMODB_STREAM_FOLDER = os.environ["UNPROCESSED_DYNAMODB_STREAM_FOLDER"]
+DYNAMODB_STREAM_SINK = os.environ["DYNAMODB_STREAM_SINK"]
+DYNAMODB_STREAM_OUTPUT_FORMAT = os.environ["DYNAMODB_STREAM_OUTPUT_FORMAT"]
+# only the upsert of the Redshift loader deletes the rows of a REMOVEd key
+WRITE_TOMBSTONES = os.environ["REDSHIFT_LOAD_MODE"] == "upsert"
+DYNAMODB_STREAM_ATTRIBUTE_TYPES = {  # coerce attributes to the Redshift column types
+    attribute_name: ATTRIBUTE_TYPES[attribute_type]
+    for attribute_name, attribute_type in json.loads(
+        os.environ["DYNAMODB_STREAM_ATTRIBUTE_TYPES"]
+    ).items()
+}
+S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT = os.environ[
+    "S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT"
+]
+FAILED_DYNAMODB_STREAM_RECORDS_FOLDER = os.environ[
+    "FAILED_DYNAMODB_STREAM_RECORDS_FOLDER"
+]
+s3_client = None
+if DYNAMODB_STREAM_SINK == "s3":
+    record_sink = S3ObjectSink(
+        s3_bucket=boto3.resource("s3").Bucket(
+            S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT
+        ),
+        folder=UNPROCESSED_DYNAMODB_STREAM_FOLDER,
+        output_format=DYNAMODB_STREAM_OUTPUT_FORMAT,
+        num_shards=int(os.environ["DYNAMODB_STREAM_NUM_S3_SHARDS"]),
+    )
+    s3_client = record_sink.s3_bucket.meta.client
+    metrics.count_requests(s3_client, name="S3Requests")
+elif DYNAMODB_STREAM_SINK == "firehose":
+    record_sink = FirehoseSink(
+        firehose_client=boto3.client("firehose"),
+        delivery_stream_name=os.environ["FIREHOSE_DELIVERY_STREAM_NAME"],
+    )
+    metrics.count_requests(record_sink.firehose_client, name="FirehoseRequests")
+    s3_client = boto3.client("s3")
+    metrics.count_requests(s3_client, name="S3Requests")
+elif DYNAMODB_STREAM_SINK == "local":  # for running the Lambda locally
+    record_sink = LocalFileBufferSink(
+        directory=os.path.join(
+            os.environ["LOCAL_RECORD_SINK_DIRECTORY"],
+            UNPROCESSED_DYNAMODB_STREAM_FOLDER,
+        ),
+        output_format=DYNAMODB_STREAM_OUTPUT_FORMAT,
+    )
+else:
+    raise ValueError(
+        '`DYNAMODB_STREAM_SINK` should be "s3", "firehose" or "local", '
+        f'not "{DYNAMODB_STREAM_SINK}"'
+    )
+# Parquet files have a fixed schema, and the local sink has no loader
+stream_attribute_registry = None
+if s3_client is not None and DYNAMODB_STREAM_OUTPUT_FORMAT != "parquet":
+    stream_attribute_registry = StreamAttributeRegistry(
+        s3_client=s3_client,
+        s3_bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
+        folder=os.environ["DYNAMODB_STREAM_ATTRIBUTES_FOLDER"],
+        attribute_types=DYNAMODB_STREAM_ATTRIBUTE_TYPES,
+    )
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, Decimal):
-            return float(o)
-        return super().default(o)
 
+def write_failed_record(record: dict) -> None:
+    """Keeps a copy of a stream record that cannot be encoded, to replay it once
+    fixed: the on-failure destination only gets its shard and sequence numbers, and
+    the stream keeps it for 24 hours"""
+    if s3_client is None:  # the local sink only prints it
+        return
+    s3_client.put_object(
+        Bucket=S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT,
+        Key=(
+            f"{FAILED_DYNAMODB_STREAM_RECORDS_FOLDER}/"
+            f"{record.get('eventID') or uuid.uuid4()}.json"
+        ),
+        Body=json.dumps(record, default=str).encode(),
+    )
+
+
+def get_batch_item_failures(records: List[dict]) -> dict:
+    """Lambda retries the shard from the lowest reported sequence number, so every
+    record from the 1st failed one on is reported, to keep the changes of a key in
+    order. A record without a sequence number fails the whole batch."""
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": record.get("dynamodb", {}).get("SequenceNumber")}
+            for record in records
+        ]
+    }
 
-def lambda_handler(event, context) -> None:
-    s3_file_contents = []
+
+@metrics.instrument
+def lambda_handler(event, context) -> dict:
     # print(event["Records"])
-    print(f"Number of records received from DynamoDB stream: {len(event['Records'])}")
-    for record in event["Records"]:
-        if record["eventName"] in ["INSERT", "MODIFY"]:
-            s3_file_contents.append(
-                TypeDeserializer().deserialize({"M": record["dynamodb"]["NewImage"]})
-            )
-        elif record["eventName"] in ["REMOVE"]:
-            pass
-        else:
-            raise ValueError(
-                "Did not expect DynamoDB stream's `eventName` "
-                f'to be "{record["eventName"]}"'
+    records = event["Records"]
+    metrics.add("RecordsIn", len(records))  # from the DynamoDB stream
+    num_encoded_records = len(records)
+    with metrics.timer("Encode"):
+        # the records of a key come from 1 shard in stream order (also with a
+        # parallelization factor), so its last change is its latest image (or, in
+        # upsert mode, its tombstone)
+        last_changes_by_key = {}  # key -> (position in the batch, S3 file content)
+        for position, record in enumerate(records):
+            try:
+                key = get_key(record["dynamodb"]["Keys"])
+                s3_file_content = encode_stream_record(
+                    record,
+                    attribute_types=DYNAMODB_STREAM_ATTRIBUTE_TYPES,
+                    tombstones=WRITE_TOMBSTONES,
+                )
+            except (KeyError, TypeError, ValueError) as error:
+                # only the records before a poison record are written; it and the
+                # rest of the batch are retried until the on-failure destination
+                print(
+                    "Cannot encode DynamoDB stream record with sequence number "
+                    f"{record.get('dynamodb', {}).get('SequenceNumber')}, "
+                    f"copied to {FAILED_DYNAMODB_STREAM_RECORDS_FOLDER}: {error!r}"
+                )
+                metrics.add("RecordsFailed")
+                write_failed_record(record)
+                num_encoded_records = position
+                break
+            if s3_file_content is None:  # a REMOVE without tombstones
+                continue
+            # in the order of the last changes
+            last_changes_by_key.pop(key, None)
+            last_changes_by_key[key] = (position, s3_file_content)
+        last_changes = list(last_changes_by_key.values())
+    metrics.add("RecordsCollapsed", num_encoded_records - len(last_changes))
+    if stream_attribute_registry is not None:
+        # before the write, so the loader adds their columns before it COPYs them
+        with metrics.timer("RegisterAttributes"):
+            num_registered_attributes = stream_attribute_registry.register(
+                images=(
+                    record["dynamodb"].get("NewImage", record["dynamodb"]["Keys"])
+                    for record in records[:num_encoded_records]
+                )
             )
-    # print(s3_file_contents)
-    s3_file_contents_in_redshift_json_string = "\n".join(
-        json.dumps(record, cls=DecimalEncoder) for record in s3_file_contents
+        metrics.add("AttributesRegistered", num_registered_attributes)
+    num_written_changes = len(last_changes)
+    with metrics.timer("Write"):
+        try:
+            record_sink.write(records=[content for _, content in last_changes])
+        except Exception as error:
+            # reported instead of raised, so Lambda retries from the 1st change that
+            # was not written instead of bisecting the whole batch
+            num_written_changes = getattr(error, "num_written_records", 0)
+            print(f"Cannot write DynamoDB stream records: {error!r}")
+            metrics.add("WriteErrors")
+    metrics.add("RecordsOut", num_written_changes)  # to the record sink
+    first_failed_position = min(
+        [position for position, _ in last_changes[num_written_changes:]]
+        + [num_encoded_records]
     )
-    if s3_file_contents_in_redshift_json_string:
-        s3_bucket.put_object(
-            Key=(
-                f"{UNPROCESSED_DYNAMODB_STREAM_FOLDER}/"
-                f"{datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}__{uuid.uuid4()}__"
-                f"{len(s3_file_contents)}__inserted_or_modified_records.json"  # hard coded suffix
-            ),
-            Body=s3_file_contents_in_redshift_json_string.encode(),
-        )
-    else:
-        s3_bucket.put_object(
-            Key=(
-                f"{UNPROCESSED_DYNAMODB_STREAM_FOLDER}/"
-                f"{datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}__{uuid.uuid4()}"
-                "__no_inserted_or_modified_records.txt"  # hard coded suffix
-            )
-        )
-    print(f"Number of records written to S3 file: {len(s3_file_contents)}")
-    return
+    return get_batch_item_failures(records[first_failed_position:])
@@ -0,0 +1,86 @@
+import gzip
+import io
+import json
+from typing import List
+
+# the Redshift loader picks the COPY options from these hard coded suffixes
+OUTPUT_FORMAT_SUFFIXES = {
+    "json": "__inserted_or_modified_records.json",
+    "json_gzip": "__inserted_or_modified_records.json.gz",
+    "json_zstd": "__inserted_or_modified_records.json.zst",
+    "parquet": "__inserted_or_modified_records.parquet",
+}
+
+
+def get_parquet_schema():
+    """Schema of `trades.json` records. COPY of Parquet files maps columns by position,
+    so the column order must match the loader's column list (the Redshift table's
+    initial columns, not the ones added for new attributes). `details` and `time` stay
+    nested structs, which COPY ... SERIALIZETOJSON loads into the SUPER columns."""
+    import pyarrow as pa  # only bundled with the Lambda for the "parquet" format
+
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            (
+                "details",
+                pa.struct(
+                    [
+                        ("asks", pa.list_(pa.float64())),
+                        ("bids", pa.list_(pa.float64())),
+                        ("lag", pa.int64()),
+                        ("system", pa.string()),
+                    ]
+                ),
+            ),
+            ("price", pa.float64()),
+            ("shares", pa.int64()),
+            ("ticker", pa.string()),
+            ("ticket", pa.string()),
+            ("time", pa.struct([("date", pa.string())])),
+            ("_cdc_op", pa.string()),
+            ("_cdc_sequence_number", pa.string()),
+            ("_cdc_event_time", pa.timestamp("ms")),
+        ]
+    )
+
+
+def encode_records(records: List[str], output_format: str) -> bytes:
+    """Encode Redshift-ready JSON lines into the body of 1 S3 file"""
+    json_lines = "\n".join(records).encode()
+    if output_format == "json":
+        return json_lines
+    elif output_format == "json_gzip":
+        return gzip.compress(json_lines, compresslevel=6)
+    elif output_format == "json_zstd":
+        import zstandard  # only bundled with the Lambda for the "json_zstd" format
+
+        return zstandard.ZstdCompressor().compress(json_lines)
+    elif output_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet
+
+        # absent columns become null and attributes outside the schema are dropped,
+        # like COPY ... json 'auto'; timestamps arrive as strings in the JSON lines
+        schema = get_parquet_schema()
+        table = pa.Table.from_pylist(
+            [json.loads(record) for record in records],
+            schema=pa.schema(
+                [
+                    (
+                        pa.field(field.name, pa.string())
+                        if pa.types.is_timestamp(field.type)
+                        else field
+                    )
+                    for field in schema
+                ]
+            ),
+        ).cast(schema)
+        buffer = io.BytesIO()
+        pyarrow.parquet.write_table(table, buffer, compression="snappy")
+        return buffer.getvalue()
+    else:
+        raise ValueError(
+            f"`output_format` should be one of {list(OUTPUT_FORMAT_SUFFIXES)}, "
+            f'not "{output_format}"'
+        )
@@ -0,0 +1,202 @@
+import glob
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import List
+
+from lambda_metrics import metrics  # from shared Lambda layer
+from output_formats import OUTPUT_FORMAT_SUFFIXES, encode_records
+
+
+def get_s3_filename(
+    folder: str, num_records: int, output_format: str, num_shards: int = 0
+) -> str:
+    """Partitioned by time, e.g. `dt=2022-01-01/hour=12/`, so the loader lists and
+    loads partitions independently. With `num_shards`, files of the same hour are
+    spread over `shard=00/` to `shard={num_shards - 1}/` by the hash of their uuid."""
+    now = datetime.utcnow()
+    file_uuid = uuid.uuid4()
+    partition = f"dt={now.strftime('%Y-%m-%d')}/hour={now.strftime('%H')}/"
+    if num_shards:
+        partition += f"shard={file_uuid.int % num_shards:02d}/"
+    return (
+        f"{folder}/{partition}"
+        f"{now.strftime('%Y-%m-%dT%H:%M:%SZ')}__{file_uuid}__"
+        f"{num_records}{OUTPUT_FORMAT_SUFFIXES[output_format]}"
+    )
+
+
+class RecordSinkError(Exception):
+    """Only the first `num_written_records` records were written"""
+
+    def __init__(self, message: str, num_written_records: int) -> None:
+        super().__init__(message)
+        self.num_written_records = num_written_records
+
+
+class RecordSink:
+    """Where the Redshift-ready JSON lines of the DynamoDB stream end up"""
+
+    def write(self, records: List[str]) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+
+class S3ObjectSink(RecordSink):
+    """1 S3 file per Lambda invocation; nothing is written if there are no records"""
+
+    def __init__(
+        self, s3_bucket, folder: str, output_format: str, num_shards: int = 0
+    ) -> None:
+        self.s3_bucket = s3_bucket  # boto3.resource("s3").Bucket(...)
+        self.folder = folder
+        self.output_format = output_format
+        self.num_shards = num_shards
+
+    def write(self, records: List[str]) -> None:
+        if records:
+            body = encode_records(records=records, output_format=self.output_format)
+            self.s3_bucket.put_object(
+                Key=get_s3_filename(
+                    folder=self.folder,
+                    num_records=len(records),
+                    output_format=self.output_format,
+                    num_shards=self.num_shards,
+                ),
+                Body=body,
+            )
+            metrics.add("BytesWritten", len(body), unit="Bytes")
+
+
+class FirehoseSink(RecordSink):
+    """Firehose buffers records across Lambda invocations and writes 1 S3 file per
+    buffer size/interval (set on the delivery stream), not 1 per invocation.
+    Compression is also set on the delivery stream."""
+
+    MAX_RECORDS_PER_CALL = 500  # Firehose PutRecordBatch limits
+    MAX_BYTES_PER_CALL = 4 * 1024 * 1024
+    MAX_RETRIES = 3
+
+    def __init__(self, firehose_client, delivery_stream_name: str) -> None:
+        self.firehose_client = firehose_client
+        self.delivery_stream_name = delivery_stream_name
+
+    def write(self, records: List[str]) -> None:
+        """Raises `RecordSinkError` with the number of records (in order) that
+        Firehose accepted before the 1st one that it did not"""
+        batch, batch_num_bytes, num_bytes = [], 0, 0
+        for i, record in enumerate(records):
+            data = f"{record}\n".encode()  # Firehose concatenates records as is
+            if batch and (
+                len(batch) == self.MAX_RECORDS_PER_CALL
+                or batch_num_bytes + len(data) > self.MAX_BYTES_PER_CALL
+            ):
+                self._put_record_batch(batch, first_record_index=i - len(batch))
+                batch, batch_num_bytes = [], 0
+            batch.append({"Data": data})
+            batch_num_bytes += len(data)
+            num_bytes += len(data)
+        if batch:
+            self._put_record_batch(batch, first_record_index=len(records) - len(batch))
+        metrics.add("BytesWritten", num_bytes, unit="Bytes")
+
+    def _put_record_batch(self, batch: List[dict], first_record_index: int) -> None:
+        record_indexes = range(first_record_index, first_record_index + len(batch))
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                response = self.firehose_client.put_record_batch(
+                    DeliveryStreamName=self.delivery_stream_name, Records=batch
+                )
+            except Exception as error:
+                raise RecordSinkError(
+                    f"Firehose delivery stream {self.delivery_stream_name}: {error!r}",
+                    num_written_records=record_indexes[0],
+                ) from error
+            if not response["FailedPutCount"]:
+                return
+            batch, record_indexes = zip(  # only resend the records that failed
+                *(
+                    (record, record_index)
+                    for record, record_index, result in zip(
+                        batch, record_indexes, response["RequestResponses"]
+                    )
+                    if "ErrorCode" in result  # e.g. throttled
+                )
+            )
+            batch = list(batch)
+            metrics.add("RecordsRetried", len(batch))
+            time.sleep(0.1 * 2**attempt)
+        raise RecordSinkError(
+            f"{len(batch)} records were not accepted by Firehose delivery stream "
+            f"{self.delivery_stream_name} after {self.MAX_RETRIES} retries",
+            num_written_records=record_indexes[0],
+        )
+
+
+class LocalFileBufferSink(RecordSink):
+    """File-backed rolling buffer with the same semantics as Firehose, for running
+    the Lambda locally: JSON lines are appended to a buffer file that is encoded
+    into an output file once it reaches `target_file_size_bytes` or gets older than
+    `max_latency_seconds`"""
+
+    BUFFER_FILENAME_PREFIX = "buffer__"
+
+    def __init__(
+        self,
+        directory: str,
+        output_format: str,
+        target_file_size_bytes: int = 64 * 1024 * 1024,
+        max_latency_seconds: float = 60,
+    ) -> None:
+        self.directory = directory
+        self.output_format = output_format
+        self.target_file_size_bytes = target_file_size_bytes
+        self.max_latency_seconds = max_latency_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def _get_buffer_filename(self):
+        buffer_filenames = glob.glob(
+            os.path.join(self.directory, f"{self.BUFFER_FILENAME_PREFIX}*")
+        )
+        return buffer_filenames[0] if buffer_filenames else None
+
+    def write(self, records: List[str]) -> None:
+        if not records:
+            return
+        buffer_filename = self._get_buffer_filename()
+        if buffer_filename is None:
+            buffer_filename = os.path.join(
+                self.directory, f"{self.BUFFER_FILENAME_PREFIX}{time.time()}"
+            )
+        with open(buffer_filename, "a") as f:
+            f.write("".join(f"{record}\n" for record in records))
+        buffer_created_at = float(
+            os.path.basename(buffer_filename)[len(self.BUFFER_FILENAME_PREFIX) :]
+        )
+        if (
+            os.path.getsize(buffer_filename) >= self.target_file_size_bytes
+            or time.time() - buffer_created_at >= self.max_latency_seconds
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        buffer_filename = self._get_buffer_filename()
+        if buffer_filename is None:
+            return
+        with open(buffer_filename) as f:
+            records = f.read().splitlines()
+        output_filename = get_s3_filename(  # same partitions as in S3
+            folder=self.directory,
+            num_records=len(records),
+            output_format=self.output_format,
+        )
+        os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+        with open(output_filename, "wb") as f:
+            num_bytes = f.write(
+                encode_records(records=records, output_format=self.output_format)
+            )
+        metrics.add("BytesWritten", num_bytes, unit="Bytes")
+        os.remove(buffer_filename)
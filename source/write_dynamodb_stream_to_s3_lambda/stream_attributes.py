@@ -0,0 +1,104 @@
+"""Tell the Redshift loader which top-level attributes the stream files have, so that
+it adds a column for a new attribute instead of COPY `json 'auto'` silently dropping
+it.
+
+Every (attribute, Redshift type) seen is 1 empty S3 object,
+`<folder>/<attribute name>/<Redshift type>`: writing it is idempotent and needs no
+lock across concurrent Lambdas, and the loader gets all of them with 1 listing. A
+warm Lambda lists the folder once and then only writes what it has not seen yet, so
+the steady state makes no S3 requests. Attributes are written before the file that
+has them, so the loader never lists a file whose attributes it does not know.
+"""
+
+import re
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+# only names that COPY `json 'auto'` matches to a (lower case) Redshift column
+COLUMN_NAME_PATTERN = re.compile(r"[a-z_][a-z0-9_]{0,126}")
+REDSHIFT_TYPES_BY_DYNAMODB_TYPE = {  # "NULL" says nothing about the type
+    "S": "varchar(65535)",
+    "N": "float8",  # DynamoDB numbers do not say whether they are integers
+    "BOOL": "boolean",
+    "B": "varchar(65535)",  # base64 in the event
+    "M": "super",
+    "L": "super",
+    "SS": "super",
+    "NS": "super",
+    "BS": "super",
+}
+REDSHIFT_TYPES_BY_ATTRIBUTE_TYPE = {  # of `DYNAMODB_STREAM_ATTRIBUTE_TYPES`
+    int: "bigint",
+    float: "float8",
+    str: "varchar(65535)",
+    bool: "boolean",
+}
+
+
+class StreamAttributeRegistry:
+    def __init__(
+        self,
+        s3_client,
+        s3_bucket: str,
+        folder: str,
+        attribute_types: Optional[Dict[str, Callable]] = None,
+    ) -> None:
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.folder = folder
+        self.attribute_types = attribute_types or {}
+        self.registered_attributes: Optional[Set[Tuple[str, str]]] = None
+        self.skipped_names: Set[str] = set()
+
+    def list_registered_attributes(self) -> Set[Tuple[str, str]]:
+        registered_attributes = set()
+        for page in self.s3_client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.s3_bucket, Prefix=f"{self.folder}/"
+        ):
+            for dct in page.get("Contents", []):
+                name, _, redshift_type = dct["Key"][len(self.folder) + 1 :].partition(
+                    "/"
+                )
+                registered_attributes.add((name, redshift_type))
+        return registered_attributes
+
+    def get_attributes(self, images: Iterable[dict]) -> Set[Tuple[str, str]]:
+        """(attribute name, Redshift type) of the top-level attributes of `images`"""
+        attributes = set()
+        for image in images:
+            for name, attribute_value in image.items():
+                if name in self.attribute_types:
+                    redshift_type = REDSHIFT_TYPES_BY_ATTRIBUTE_TYPE[
+                        self.attribute_types[name]
+                    ]
+                else:
+                    redshift_type = REDSHIFT_TYPES_BY_DYNAMODB_TYPE.get(
+                        next(iter(attribute_value))  # exactly 1 item
+                    )
+                    if redshift_type is None:
+                        continue
+                attributes.add((name, redshift_type))
+        return attributes
+
+    def register(self, images: Iterable[dict]) -> int:
+        """Returns the number of attributes registered for the 1st time"""
+        if self.registered_attributes is None:  # once per warm Lambda
+            self.registered_attributes = self.list_registered_attributes()
+        num_registered_attributes = 0
+        for name, redshift_type in sorted(
+            self.get_attributes(images) - self.registered_attributes
+        ):
+            if not COLUMN_NAME_PATTERN.fullmatch(name):
+                if name not in self.skipped_names:
+                    print(
+                        f'Attribute "{name}" cannot be a Redshift column, so it is not loaded'
+                    )
+                    self.skipped_names.add(name)
+                continue
+            self.s3_client.put_object(
+                Bucket=self.s3_bucket,
+                Key=f"{self.folder}/{name}/{redshift_type}",
+                Body=b"",
+            )
+            self.registered_attributes.add((name, redshift_type))
+            num_registered_attributes += 1
+        return num_registered_attributes
@@ -0,0 +1,23 @@
+"""The Lambdas' modules are imported like the Lambda runtime does: from their own
+directory and the shared Lambda layer. Modules called `handler` are not imported
+here, as every Lambda has one."""
+
+import os
+import sys
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIRECTORY = os.path.join(REPO_DIRECTORY, "source")
+sys.path[:0] = [
+    REPO_DIRECTORY,
+    os.path.join(
+        SOURCE_DIRECTORY, "load_s3_files_from_dynamodb_stream_to_redshift_lambda"
+    ),
+    os.path.join(SOURCE_DIRECTORY, "reconcile_cdc_lambda"),
+    os.path.join(SOURCE_DIRECTORY, "write_dynamodb_stream_to_s3_lambda"),
+    os.path.join(SOURCE_DIRECTORY, "shared_lambda_layer", "python"),
+]
+os.environ.update(
+    AWS_DEFAULT_REGION="us-east-1",
+    AWS_ACCESS_KEY_ID="testing",  # moto only, never sent anywhere
+    AWS_SECRET_ACCESS_KEY="testing",
+)
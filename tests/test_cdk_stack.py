@@ -0,0 +1,211 @@
+"""Synthesizes `CDCStack` from the `cdk.json` config (with overrides) and checks the
+resulting CloudFormation template. Lambda assets are not bundled."""
+
+import json
+import os
+
+import pytest
+
+cdk = pytest.importorskip("aws_cdk")
+
+from aws_cdk.assertions import Match, Template  # noqa: E402
+
+from cdk_infrastructure import CDCStack  # noqa: E402
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def synth_template(monkeypatch, tmp_path):
+    monkeypatch.chdir(REPO_DIRECTORY)  # Lambda asset paths are relative
+
+    def synth_template(**overrides) -> Template:
+        with open("cdk.json") as f:
+            context = json.load(f)["context"]
+        context["environment"].update(overrides)
+        context["aws:cdk:bundling-stacks"] = []  # no Docker
+        app = cdk.App(outdir=str(tmp_path), context=context)
+        environment = app.node.try_get_context("environment")
+        stack = CDCStack(
+            app,
+            "CDCStack",
+            env=cdk.Environment(
+                account="123456789012", region=environment["AWS_REGION"]
+            ),
+            environment=environment,
+        )
+        return Template.from_stack(stack)
+
+    return synth_template
+
+
+def get_replication_tasks(template: Template) -> list:
+    return list(template.find_resources("AWS::DMS::ReplicationTask").values())
+
+
+def test_dms_tables_are_sharded_over_the_replication_tasks(synth_template):
+    template = synth_template(
+        DMS_TABLES=[
+            {"table_name": "rds_cdc_table", "schema_name": "%", "parallel_load": None},
+            {"table_name": "cdc_heartbeat", "schema_name": "%", "parallel_load": None},
+            {
+                "table_name": "big_table",
+                "schema_name": "shop",
+                "parallel_load": {"type": "partitions-auto"},
+                "replication_task": 1,
+            },
+        ],
+        DMS_NUM_REPLICATION_TASKS=2,
+    )
+    template.resource_count_is("AWS::DMS::ReplicationTask", 2)
+    rules_by_task = [
+        json.loads(task["Properties"]["TableMappings"])["rules"]
+        for task in get_replication_tasks(template)
+    ]
+    selected_tables = [
+        sorted(
+            rule["object-locator"]["table-name"]
+            for rule in rules
+            if rule["rule-type"] == "selection" and rule["rule-action"] == "include"
+        )
+        for rules in rules_by_task
+    ]
+    # round robin, except for `replication_task`
+    assert sorted(selected_tables) == [
+        ["big_table", "cdc_heartbeat"],
+        ["rds_cdc_table"],
+    ]
+    assert [
+        (rule["object-locator"], rule["parallel-load"])
+        for rules in rules_by_task
+        for rule in rules
+        if rule["rule-type"] == "table-settings"
+    ] == [
+        (
+            {"schema-name": "shop", "table-name": "big_table"},
+            {"type": "partitions-auto"},
+        )
+    ]
+
+
+def test_dms_replication_task_settings(synth_template):
+    template = synth_template(
+        DMS_REPLICATION_TASK_TUNING={
+            "BatchApplyEnabled": True,
+            "ParallelApplyThreads": 8,
+            "LobMode": "limited",
+            "LobMaxSizeInKB": 64,
+        }
+    )
+    (task,) = get_replication_tasks(template)
+    settings = json.loads(task["Properties"]["ReplicationTaskSettings"])
+    assert settings["TargetMetadata"] == {
+        "SupportLobs": True,
+        "FullLobMode": False,
+        "LimitedSizeLobMode": True,
+        "LobMaxSize": 64,
+        "BatchApplyEnabled": True,
+        "ParallelApplyThreads": 8,
+    }
+
+
+def test_dms_lob_mode_is_validated(synth_template):
+    with pytest.raises(ValueError, match="LobMode"):
+        synth_template(DMS_REPLICATION_TASK_TUNING={"LobMode": "unlimited"})
+
+
+def get_loader_function(template: Template) -> dict:
+    (loader_function,) = [
+        function
+        for function in template.find_resources("AWS::Lambda::Function").values()
+        # custom resource handlers have no environment
+        if "MAX_FILES_PER_RUN"
+        in function["Properties"].get("Environment", {}).get("Variables", {})
+    ]
+    return loader_function
+
+
+def get_lease_tables(template: Template) -> dict:
+    return template.find_resources(
+        "AWS::DynamoDB::Table",
+        {
+            "Properties": {
+                "TimeToLiveSpecification": {
+                    "AttributeName": "expires_at",
+                    "Enabled": True,
+                }
+            }
+        },
+    )
+
+
+def test_single_loader_is_triggered_by_new_stream_files(synth_template):
+    template = synth_template(
+        LOADER_RESERVED_CONCURRENCY=1, LOADER_TRIGGER="sqs", LOADER_SQS_BATCH_SIZE=100
+    )
+    assert (
+        get_loader_function(template)["Properties"]["ReservedConcurrentExecutions"] == 1
+    )
+    assert get_lease_tables(template) == {}
+    template.has_resource_properties(
+        "Custom::S3BucketNotifications",
+        {
+            "NotificationConfiguration": {
+                "QueueConfigurations": [
+                    {
+                        "Events": ["s3:ObjectCreated:*"],
+                        "Filter": {
+                            "Key": {
+                                "FilterRules": [
+                                    {
+                                        "Name": "prefix",
+                                        "Value": "unprocessed_dynamodb_streams/",
+                                    }
+                                ]
+                            }
+                        },
+                        "QueueArn": Match.any_value(),
+                    }
+                ]
+            }
+        },
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {"BatchSize": 100, "MaximumBatchingWindowInSeconds": 20},
+    )
+
+
+def test_concurrent_loaders_split_partitions_with_leases(synth_template):
+    template = synth_template(
+        LOADER_RESERVED_CONCURRENCY=4, REDSHIFT_LOAD_MODE="append"
+    )
+    loader_function = get_loader_function(template)
+    assert loader_function["Properties"]["ReservedConcurrentExecutions"] == 4
+    (lease_table_id,) = get_lease_tables(template)
+    template.has_resource_properties(
+        "AWS::DynamoDB::Table",
+        {
+            "KeySchema": [{"AttributeName": "partition", "KeyType": "HASH"}],
+            "BillingMode": "PAY_PER_REQUEST",
+        },
+    )
+    assert loader_function["Properties"]["Environment"]["Variables"][
+        "LOADER_LEASE_TABLE_NAME"
+    ] == {"Ref": lease_table_id}
+
+
+def test_unreserved_loader_has_no_reserved_concurrency(synth_template):
+    template = synth_template(
+        LOADER_RESERVED_CONCURRENCY=None, REDSHIFT_LOAD_MODE="append"
+    )
+    assert (
+        "ReservedConcurrentExecutions"
+        not in get_loader_function(template)["Properties"]
+    )
+    assert len(get_lease_tables(template)) == 1
+
+
+def test_concurrent_loaders_need_append_mode(synth_template):
+    with pytest.raises(ValueError, match="REDSHIFT_LOAD_MODE"):
+        synth_template(LOADER_RESERVED_CONCURRENCY=4, REDSHIFT_LOAD_MODE="upsert")
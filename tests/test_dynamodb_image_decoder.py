@@ -0,0 +1,32 @@
+import json
+
+import pytest
+from dynamodb_image_decoder import decode_image
+
+IMAGE = {
+    "id": {"S": "a"},
+    "shares": {"N": "12345678901234567890"},
+    "price": {"N": "10.5"},
+    "address": {"M": {"city": {"S": "Paris"}, "zip": {"N": "75001"}}},
+    "tags": {"L": [{"S": "x"}, {"N": "1"}]},
+}
+
+
+def test_big_integers_keep_every_digit():
+    assert decode_image(IMAGE, attribute_types={"shares": int})["shares"] == (
+        12345678901234567890
+    )
+
+
+def test_maps_and_lists_are_coerced_to_json_strings():
+    record = decode_image(
+        IMAGE, attribute_types={"address": str, "tags": str, "price": str}
+    )
+    assert json.loads(record["address"]) == {"city": "Paris", "zip": 75001}
+    assert json.loads(record["tags"]) == ["x", 1]
+    assert record["price"] == "10.5"
+
+
+def test_fractions_are_not_truncated_to_integers():
+    with pytest.raises(ValueError):
+        decode_image(IMAGE, attribute_types={"price": int})
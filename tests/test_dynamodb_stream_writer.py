@@ -0,0 +1,162 @@
+import importlib.util
+import json
+import os
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from moto import mock_aws
+from record_sinks import FirehoseSink, RecordSinkError
+
+WRITER_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "source",
+    "write_dynamodb_stream_to_s3_lambda",
+)
+BUCKET_NAME = "cdc-bucket"
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    """The stream writer's handler module, with an S3 sink in moto"""
+    monkeypatch.setenv("UNPROCESSED_DYNAMODB_STREAM_FOLDER", "unprocessed")
+    monkeypatch.setenv("FAILED_DYNAMODB_STREAM_RECORDS_FOLDER", "failed")
+    monkeypatch.setenv("DYNAMODB_STREAM_SINK", "s3")
+    monkeypatch.setenv("DYNAMODB_STREAM_OUTPUT_FORMAT", "json")
+    monkeypatch.setenv("REDSHIFT_LOAD_MODE", "append")
+    monkeypatch.setenv("DYNAMODB_STREAM_ATTRIBUTE_TYPES", json.dumps({"shares": "int"}))
+    monkeypatch.setenv("DYNAMODB_STREAM_NUM_S3_SHARDS", "0")
+    monkeypatch.setenv("DYNAMODB_STREAM_ATTRIBUTES_FOLDER", "state/attributes")
+    monkeypatch.setenv("S3_BUCKET_FOR_DYNAMODB_STREAM_TO_REDSHIFT", BUCKET_NAME)
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET_NAME)
+        spec = importlib.util.spec_from_file_location(
+            "write_dynamodb_stream_to_s3_handler",
+            os.path.join(WRITER_DIRECTORY, "handler.py"),
+        )
+        handler = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(handler)
+        yield handler
+
+
+def get_record(sequence_number: int, key: str, event_name: str = "INSERT") -> dict:
+    return {
+        "eventID": f"event-{sequence_number}",
+        "eventName": event_name,
+        "dynamodb": {
+            "Keys": {"id": {"S": key}},
+            "NewImage": {"id": {"S": key}, "shares": {"N": "10"}},
+            "SequenceNumber": str(sequence_number),
+            "ApproximateCreationDateTime": 1640995200,
+        },
+    }
+
+
+def invoke(writer, records: list) -> list:
+    response = writer.lambda_handler(
+        {"Records": records}, SimpleNamespace(aws_request_id="request")
+    )
+    return [failure["itemIdentifier"] for failure in response["batchItemFailures"]]
+
+
+def get_written_records(prefix: str) -> list:
+    s3_client = boto3.client("s3")
+    return [
+        json.loads(line)
+        for s3_object in s3_client.list_objects_v2(
+            Bucket=BUCKET_NAME, Prefix=prefix
+        ).get("Contents", [])
+        for line in s3_client.get_object(Bucket=BUCKET_NAME, Key=s3_object["Key"])[
+            "Body"
+        ]
+        .read()
+        .splitlines()
+    ]
+
+
+def get_written_ids(prefix: str) -> list:
+    return [record["id"] for record in get_written_records(prefix)]
+
+
+def get_written_ops(prefix: str) -> list:
+    return [record["_cdc_op"] for record in get_written_records(prefix)]
+
+
+def test_no_failures_are_reported_for_a_written_batch(writer):
+    assert invoke(writer, [get_record(1, "a"), get_record(2, "b")]) == []
+    assert get_written_ids("unprocessed/") == ["a", "b"]
+
+
+def test_removes_are_skipped_in_append_mode(writer):
+    records = [get_record(1, "a"), get_record(2, "a", event_name="REMOVE")]
+    assert invoke(writer, records) == []
+    assert get_written_ids("unprocessed/") == ["a"]  # its last image, as before
+
+
+def test_removes_are_written_as_tombstones_in_upsert_mode(writer, monkeypatch):
+    monkeypatch.setattr(writer, "WRITE_TOMBSTONES", True)
+    records = [get_record(1, "a"), get_record(2, "a", event_name="REMOVE")]
+    assert invoke(writer, records) == []
+    assert get_written_ops("unprocessed/") == ["REMOVE"]
+
+
+def test_records_from_a_poison_record_on_are_reported(writer):
+    records = [
+        get_record(1, "a"),
+        get_record(2, "b", event_name="UNEXPECTED"),
+        get_record(3, "a"),
+    ]
+    assert invoke(writer, records) == ["2", "3"]
+    # the later change of "a" is retried with the poison record, not written early
+    assert get_written_ids("unprocessed/") == ["a"]
+    assert boto3.client("s3").get_object(Bucket=BUCKET_NAME, Key="failed/event-2.json")
+
+
+def test_records_from_the_first_unwritten_change_on_are_reported(writer, monkeypatch):
+    def write(records):
+        raise RecordSinkError("throttled", num_written_records=1)
+
+    monkeypatch.setattr(writer.record_sink, "write", write)
+    # collapsed to the changes of "b" (position 1) and "a" (position 2)
+    records = [get_record(1, "a"), get_record(2, "b"), get_record(3, "a")]
+    assert invoke(writer, records) == ["3"]
+
+
+class FakeFirehoseClient:
+    """Never accepts `rejected_data`"""
+
+    def __init__(self, rejected_data: bytes) -> None:
+        self.rejected_data = rejected_data
+
+    def put_record_batch(self, DeliveryStreamName: str, Records: list) -> dict:
+        results = [
+            (
+                {"ErrorCode": "ServiceUnavailableException"}
+                if record["Data"] == self.rejected_data
+                else {"RecordId": "id"}
+            )
+            for record in Records
+        ]
+        return {
+            "FailedPutCount": sum("ErrorCode" in result for result in results),
+            "RequestResponses": results,
+        }
+
+
+def test_firehose_sink_counts_the_records_before_the_first_rejected_one(monkeypatch):
+    monkeypatch.setattr(FirehoseSink, "MAX_RECORDS_PER_CALL", 2)
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    record_sink = FirehoseSink(
+        firehose_client=FakeFirehoseClient(rejected_data=b"d\n"),
+        delivery_stream_name="stream",
+    )
+    with pytest.raises(RecordSinkError) as error:
+        record_sink.write(records=["a", "b", "c", "d", "e"])
+    assert error.value.num_written_records == 3
+
+
+def test_records_with_a_lossy_attribute_coercion_are_reported(writer):
+    records = [get_record(1, "a"), get_record(2, "b")]
+    records[1]["dynamodb"]["NewImage"]["shares"] = {"N": "10.5"}  # `shares` is int
+    assert invoke(writer, records) == ["2"]
+    assert get_written_ids("unprocessed/") == ["a"]
@@ -0,0 +1,96 @@
+from decimal import Decimal
+
+from bucket_checksums import get_bucket_filter
+from incremental_checksums import IncrementalBucketChecksums
+
+MONTHS = [f"2022-{month:02d}" for month in range(1, 13)]
+
+
+def get_checksums(rows_by_bucket: dict, buckets, since_bucket) -> dict:
+    """What the checksums SQL statement returns with the filter of the plan"""
+    return {
+        bucket: (Decimal(num_rows),)
+        for bucket, num_rows in rows_by_bucket.items()
+        if buckets is None
+        or bucket in buckets
+        or (since_bucket is not None and bucket >= since_bucket)
+    }
+
+
+def run(state, source_rows_by_bucket: dict, target_rows_by_bucket: dict):
+    incremental_checksums = IncrementalBucketChecksums(
+        state=state,
+        columns=["date"],
+        bucket_kind="date",
+        num_buckets=16,
+        num_sample_buckets=2,
+    )
+    buckets, since_bucket = incremental_checksums.plan()
+    mismatched_buckets = incremental_checksums.update(
+        source_checksums=get_checksums(source_rows_by_bucket, buckets, since_bucket),
+        target_checksums=get_checksums(target_rows_by_bucket, buckets, since_bucket),
+        kinds=[],
+    )
+    return incremental_checksums, buckets, since_bucket, mismatched_buckets
+
+
+def test_only_new_months_and_a_sample_are_rechecked():
+    rows_by_bucket = {month: 10 for month in MONTHS}
+    incremental_checksums, buckets, _, mismatched_buckets = run(
+        None, rows_by_bucket, rows_by_bucket
+    )
+    assert buckets is None  # the 1st run checksums the whole table
+    assert mismatched_buckets == []
+    assert incremental_checksums.state["watermark"] == "2022-12"
+
+    incremental_checksums, buckets, since_bucket, _ = run(
+        incremental_checksums.state, rows_by_bucket, rows_by_bucket
+    )
+    assert since_bucket == "2022-12"
+    assert len(buckets) == 2
+    assert incremental_checksums.get_num_rows("source") == 120
+    assert incremental_checksums.get_num_buckets() == 12
+
+
+def test_change_to_an_old_month_is_found_by_the_rotating_sample():
+    rows_by_bucket = {month: 10 for month in MONTHS}
+    state = run(None, rows_by_bucket, rows_by_bucket)[0].state
+    target_rows_by_bucket = {**rows_by_bucket, "2022-03": 9}  # 1 row lost
+    for _ in range(len(MONTHS) // 2):  # 2 of the 11 older months per run
+        incremental_checksums, _, _, mismatched_buckets = run(
+            state, rows_by_bucket, target_rows_by_bucket
+        )
+        state = incremental_checksums.state
+        if mismatched_buckets:
+            break
+    assert mismatched_buckets == ["2022-03"]
+    # rechecked every run until it matches again
+    incremental_checksums, buckets, _, mismatched_buckets = run(
+        state, rows_by_bucket, rows_by_bucket
+    )
+    assert "2022-03" in buckets
+    assert mismatched_buckets == []
+
+
+def test_month_bucket_filter():
+    assert get_bucket_filter(
+        dialect="mysql",
+        bucket_column="date",
+        bucket_kind="date",
+        num_buckets=16,
+        buckets=["None", "2021-12"],
+        since_bucket="2022-06",
+    ) == (
+        "`date` IS NULL OR `date` >= '2022-06-01' OR "
+        "(`date` >= '2021-12-01' AND `date` < '2022-01-01')"
+    )
+    assert (
+        get_bucket_filter(
+            dialect="redshift",
+            bucket_column="amount",
+            bucket_kind="number",
+            num_buckets=16,
+            buckets=[],
+        )
+        == "1 = 0"
+    )
@@ -0,0 +1,37 @@
+import pytest
+from load_ledger import MAX_S3_KEY_BYTES, MAX_SQL_STATEMENT_BYTES, LoadLedger
+from redshift_data_executor import MAX_SQL_STATEMENTS_PER_BATCH
+
+LOADED_BY = "7f8a7c1e-0a4b-4e8e-9d43-2b0c6d1f5a3e"  # a Lambda request ID
+
+
+@pytest.fixture
+def load_ledger():
+    return LoadLedger(
+        redshift_data_executor=None,
+        table_name="dynamodb_schema.dynamodb_cdc_table__load_ledger",
+    )
+
+
+@pytest.mark.parametrize("s3_key_length", [150, MAX_S3_KEY_BYTES])
+def test_ledger_rows_are_packed_into_few_inserts(load_ledger, s3_key_length):
+    s3_file_sizes = {
+        f"{i:06d}".ljust(s3_key_length, "x"): 1_000_000 + i for i in range(2_000)
+    }
+    sql_statements = load_ledger.get_record_sql_statements(
+        s3_file_sizes=s3_file_sizes, loaded_by=LOADED_BY
+    )
+    assert all(
+        len(sql_statement.encode()) <= MAX_SQL_STATEMENT_BYTES
+        for sql_statement in sql_statements
+    )
+    assert sum(
+        sql_statement.count("), (") + 1 for sql_statement in sql_statements
+    ) == len(s3_file_sizes)
+    assert (
+        len(sql_statements)
+        <= load_ledger.get_max_num_record_sql_statements(
+            num_s3_files=len(s3_file_sizes)
+        )
+        < MAX_SQL_STATEMENTS_PER_BATCH
+    )
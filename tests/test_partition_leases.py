@@ -0,0 +1,63 @@
+import time
+
+import boto3
+import pytest
+from moto import mock_aws
+from partition_leases import PartitionLeases
+
+TABLE_NAME = "loader_leases"
+
+
+@pytest.fixture
+def dynamodb_client():
+    with mock_aws():
+        dynamodb_client = boto3.client("dynamodb")
+        dynamodb_client.create_table(  # like `LoaderLeaseTable` in the stack
+            TableName=TABLE_NAME,
+            KeySchema=[{"AttributeName": "partition", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "partition", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield dynamodb_client
+
+
+def get_partition_leases(dynamodb_client, owner: str, expires_in_seconds: int):
+    return PartitionLeases(
+        dynamodb_client=dynamodb_client,
+        table_name=TABLE_NAME,
+        owner=owner,
+        expires_at=time.time() + expires_in_seconds,
+    )
+
+
+def test_partition_is_held_until_released(dynamodb_client):
+    first_loader = get_partition_leases(dynamodb_client, "first", expires_in_seconds=60)
+    second_loader = get_partition_leases(
+        dynamodb_client, "second", expires_in_seconds=60
+    )
+    assert first_loader.claim("dt=2022-01-01/hour=12")
+    assert not second_loader.claim("dt=2022-01-01/hour=12")
+    assert second_loader.claim("dt=2022-01-01/hour=13")  # other partitions are free
+    assert first_loader.release_all() == ["dt=2022-01-01/hour=12"]
+    assert second_loader.claim("dt=2022-01-01/hour=12")
+    assert second_loader.claimed_partitions == [
+        "dt=2022-01-01/hour=13",
+        "dt=2022-01-01/hour=12",
+    ]
+
+
+def test_expired_lease_is_taken_over(dynamodb_client):
+    crashed_loader = get_partition_leases(
+        dynamodb_client, "crashed", expires_in_seconds=-10
+    )
+    next_loader = get_partition_leases(dynamodb_client, "next", expires_in_seconds=60)
+    assert crashed_loader.claim("dt=2022-01-01/hour=12")
+    assert next_loader.claim("dt=2022-01-01/hour=12")
+    # the crashed loader coming back does not release the lease it lost
+    crashed_loader.release_all()
+    assert dynamodb_client.get_item(
+        TableName=TABLE_NAME, Key={"partition": {"S": "dt=2022-01-01/hour=12"}}
+    )["Item"]["owner"] == {"S": "next"}
+    assert not get_partition_leases(
+        dynamodb_client, "third", expires_in_seconds=60
+    ).claim("dt=2022-01-01/hour=12")
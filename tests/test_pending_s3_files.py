@@ -0,0 +1,52 @@
+import boto3
+import pytest
+from moto import mock_aws
+from pending_s3_files import PendingS3FileLister
+
+BUCKET_NAME = "cdc-bucket"
+STATE_FOLDER = "state/listing_cursors"
+
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        yield s3_client
+
+
+def get_lister(s3_client) -> PendingS3FileLister:
+    return PendingS3FileLister(
+        s3_client=s3_client,
+        s3_bucket=BUCKET_NAME,
+        folder="unprocessed",
+        state_folder=STATE_FOLDER,
+        lookback_in_minutes=60,
+        full_listing_interval_in_minutes=60,
+    )
+
+
+def get_s3_file(hour: int) -> str:
+    return f"unprocessed/dt=2022-01-01/hour={hour:02d}/2022-01-01T{hour:02d}:00:00Z"
+
+
+def test_concurrent_loaders_never_move_the_high_water_mark_backwards(s3_client):
+    for hour in (10, 12):
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=get_s3_file(hour), Body=b"")
+    first_loader, second_loader = get_lister(s3_client), get_lister(s3_client)
+    first_loader.list_pending_s3_files(max_files=10, owner="first")
+    second_loader.list_pending_s3_files(max_files=10, owner="second")
+    first_loader.advance(s3_files=[get_s3_file(12)])
+    second_loader.advance(s3_files=[get_s3_file(10)])  # finishes last
+    next_loader = get_lister(s3_client)
+    next_loader.list_pending_s3_files(max_files=10, owner="next")
+    assert next_loader.state["high_water_mark"] == get_s3_file(12)
+    next_loader.advance(s3_files=[get_s3_file(11)])
+    # the merged state objects are replaced by the next loader's
+    assert [
+        dct["Key"]
+        for dct in s3_client.list_objects_v2(
+            Bucket=BUCKET_NAME, Prefix=f"{STATE_FOLDER}/"
+        )["Contents"]
+    ] == [f"{STATE_FOLDER}/next.json"]
+    assert get_lister(s3_client).read_state()["high_water_mark"] == get_s3_file(12)
@@ -0,0 +1,38 @@
+from redshift_data_executor import (
+    MAX_SQL_STATEMENTS_PER_BATCH,
+    RedshiftDataExecutor,
+    shorten_sql_statement,
+)
+
+
+class FakeRedshiftDataClient:
+    """Every statement finishes immediately"""
+
+    def batch_execute_statement(self, Sqls, **kwargs) -> dict:
+        return {"Id": "batch"}
+
+    def describe_statement(self, Id: str) -> dict:
+        return {"Id": Id, "Status": "FINISHED"}
+
+
+def test_long_sql_statements_are_shortened():
+    sql_statement = "INSERT INTO t VALUES\n    " + ", ".join(["('key')"] * 10000)
+    shortened = shorten_sql_statement(sql_statement)
+    assert shortened.startswith("INSERT INTO t VALUES ('key'), ")
+    assert shortened.endswith(f"... ({len(sql_statement) - 4} characters)")
+    assert shorten_sql_statement("SELECT\n  1;") == "SELECT 1;"
+
+
+def test_a_full_batch_is_logged_in_1_short_line(capsys):
+    executor = RedshiftDataExecutor(
+        cluster_identifier="cluster",
+        database="database",
+        db_user="user",
+        redshift_data_client=FakeRedshiftDataClient(),
+    )
+    executor.execute(*["INSERT INTO t VALUES " + "('key'), " * 10000] * 40)
+    logged_lines = capsys.readouterr().out.splitlines()
+    assert len(logged_lines) == 1
+    assert "batch" in logged_lines[0]
+    assert f"of {MAX_SQL_STATEMENTS_PER_BATCH} SQL statement(s)" in logged_lines[0]
+    assert len(logged_lines[0]) < 500
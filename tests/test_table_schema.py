@@ -0,0 +1,145 @@
+import re
+import uuid
+
+import boto3
+import pytest
+from moto import mock_aws
+from redshift_data_executor import RedshiftDataExecutor, RedshiftStatementError
+from stream_attributes import StreamAttributeRegistry
+from table_schema import TableSchemaManager
+
+BUCKET = "bucket"
+ATTRIBUTES_FOLDER = "loader_state/stream_attributes"
+STATE_S3_FILENAME = "loader_state/table_columns.json"
+COLUMNS = {"id": "varchar(30) UNIQUE NOT NULL", "price": "float"}
+# an unquoted reserved word is a syntax error in Redshift
+UNQUOTED_RESERVED_WORD = re.compile(r"ADD COLUMN (order|user) ", re.IGNORECASE)
+
+
+class FakeRedshiftDataClient:
+    """A batch fails as a whole, like its transaction; `rejected_types` stand in for
+    any other DDL that Redshift refuses"""
+
+    def __init__(self, column_names, rejected_types=()) -> None:
+        self.column_names = set(column_names)
+        self.rejected_types = rejected_types
+        self.batches = []
+        self.statements = {}
+
+    def _run(self, sql_statements) -> dict:
+        self.batches.append(sql_statements)
+        statement_id = str(uuid.uuid4())
+        failed = any(
+            UNQUOTED_RESERVED_WORD.search(sql_statement)
+            or any(
+                rejected_type in sql_statement for rejected_type in self.rejected_types
+            )
+            for sql_statement in sql_statements
+        )
+        if not failed:
+            for sql_statement in sql_statements:
+                match = re.search(r'ADD COLUMN "(\w+)"', sql_statement)
+                if match:
+                    self.column_names.add(match.group(1))
+        self.statements[statement_id] = {
+            "Id": statement_id,
+            "Status": "FAILED" if failed else "FINISHED",
+            "QueryString": ";".join(sql_statements),
+        }
+        return {"Id": statement_id}
+
+    def execute_statement(self, Sql, **kwargs) -> dict:
+        return self._run([Sql])
+
+    def batch_execute_statement(self, Sqls, **kwargs) -> dict:
+        return self._run(Sqls)
+
+    def describe_statement(self, Id) -> dict:
+        return self.statements[Id]
+
+    def get_statement_result(self, Id, **kwargs) -> dict:
+        return {
+            "Records": [[{"stringValue": name}] for name in sorted(self.column_names)]
+        }
+
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=BUCKET)
+        yield s3_client
+
+
+def get_table_schema_manager(s3_client, redshift_data_client) -> TableSchemaManager:
+    return TableSchemaManager(
+        redshift_data_executor=RedshiftDataExecutor(
+            cluster_identifier="cluster",
+            database="database",
+            db_user="user",
+            redshift_data_client=redshift_data_client,
+            initial_poll_interval_seconds=0,
+        ),
+        s3_client=s3_client,
+        s3_bucket=BUCKET,
+        state_s3_filename=STATE_S3_FILENAME,
+        attributes_folder=ATTRIBUTES_FOLDER,
+        schema_name="dynamodb_schema",
+        table_name="dynamodb_cdc_table",
+        columns=COLUMNS,
+        create_table_sql_statements=["CREATE TABLE IF NOT EXISTS t (id varchar(30));"],
+    )
+
+
+def register(s3_client, image: dict) -> None:
+    StreamAttributeRegistry(
+        s3_client=s3_client, s3_bucket=BUCKET, folder=ATTRIBUTES_FOLDER
+    ).register(images=[image])
+
+
+def test_reserved_word_attributes_are_quoted(s3_client):
+    register(s3_client, {"id": {"S": "1"}, "order": {"N": "1"}, "user": {"S": "a"}})
+    redshift_data_client = FakeRedshiftDataClient(column_names=COLUMNS)
+    table_schema_manager = get_table_schema_manager(s3_client, redshift_data_client)
+
+    ddl_sql_statements = table_schema_manager.get_ddl_sql_statements()
+
+    assert (
+        'ALTER TABLE dynamodb_schema.dynamodb_cdc_table ADD COLUMN "order" float8;'
+        in ddl_sql_statements
+    )
+    assert (
+        'ALTER TABLE dynamodb_schema.dynamodb_cdc_table ADD COLUMN "user" varchar(65535);'
+        in ddl_sql_statements
+    )
+    table_schema_manager.redshift_data_executor.execute(*ddl_sql_statements)
+    table_schema_manager.on_ddl_committed()
+    # the steady state: no DDL, and no catalog read either
+    num_batches = len(redshift_data_client.batches)
+    assert table_schema_manager.get_ddl_sql_statements() == []
+    assert len(redshift_data_client.batches) == num_batches
+
+
+def test_failing_column_is_skipped_instead_of_blocking_loads(s3_client):
+    register(s3_client, {"id": {"S": "1"}, "order": {"N": "1"}, "blob": {"M": {}}})
+    # e.g. a cluster without SUPER
+    redshift_data_client = FakeRedshiftDataClient(
+        column_names=COLUMNS, rejected_types=["super"]
+    )
+    table_schema_manager = get_table_schema_manager(s3_client, redshift_data_client)
+    ddl_sql_statements = table_schema_manager.get_ddl_sql_statements()
+    with pytest.raises(RedshiftStatementError):
+        table_schema_manager.redshift_data_executor.execute(*ddl_sql_statements)
+
+    table_schema_manager.execute_one_at_a_time()
+
+    assert table_schema_manager.column_names == {"id", "price", "order"}
+    assert table_schema_manager.skipped_column_names == {"blob"}
+    assert table_schema_manager.get_ddl_sql_statements() == []
+    # a cold start does not retry the column either
+    assert (
+        get_table_schema_manager(
+            s3_client, redshift_data_client
+        ).get_ddl_sql_statements()
+        == []
+    )